@@ -2,19 +2,31 @@ from django.contrib import admin
 
 from mptt.admin import MPTTModelAdmin
 
-from .models import SourceDocument, OrgUnit, DataElement, DataValue, Category, CategoryCombo, ValidationRule, load_excel_to_datavalues, load_excel_to_validations
+from .models import SourceDocument, OrgUnit, DataElement, DataValue, Category, CategoryCombo, ValidationRule, ValidationViolation, IngestionJob
 
-def load_document_values(modeladmin, request, queryset):
+# loading runs in the ingestion worker (manage.py ingestion_worker), these actions only queue the jobs
+def queue_jobs(modeladmin, request, queryset, job_type, load_method='ORM'):
     for doc in queryset:
-        all_values = load_excel_to_datavalues(doc)
-        for site_name, site_vals in all_values.items():
-            DataValue.objects.bulk_create(site_vals)
+        IngestionJob.objects.create(source_doc=doc, job_type=job_type, load_method=load_method)
+    modeladmin.message_user(request, 'Queued %d ingestion job(s), see Ingestion Jobs for progress' % (queryset.count(),))
+
+def load_document_values(modeladmin, request, queryset):
+    queue_jobs(modeladmin, request, queryset, 'VALUES', 'ORM')
 
 load_document_values.short_description = 'Load data values from document into DB'
 
+def load_document_values_copy(modeladmin, request, queryset):
+    queue_jobs(modeladmin, request, queryset, 'VALUES', 'COPY')
+
+load_document_values_copy.short_description = 'Load data values from document into DB (bulk COPY)'
+
+def load_document_values_upsert(modeladmin, request, queryset):
+    queue_jobs(modeladmin, request, queryset, 'VALUES', 'UPSERT')
+
+load_document_values_upsert.short_description = 'Re-load data values from document into DB (update existing values)'
+
 def load_document_validations(modeladmin, request, queryset):
-    for doc in queryset:
-        load_excel_to_validations(doc)
+    queue_jobs(modeladmin, request, queryset, 'VALIDATIONS')
 
 load_document_validations.short_description = 'Load validation rules from document into DB'
 
@@ -22,7 +34,7 @@ class SourceDocumentAdmin(admin.ModelAdmin):
     readonly_fields = ('orig_filename',)
     list_display = ['uploaded_at', 'orig_filename']
     ordering = ['uploaded_at']
-    actions = [load_document_values, load_document_validations]
+    actions = [load_document_values, load_document_values_copy, load_document_values_upsert, load_document_validations]
 
 class OrgUnitAdmin(MPTTModelAdmin):
     list_display = ['name', 'level']
@@ -38,10 +50,20 @@ class DataValueAdmin(admin.ModelAdmin):
     list_filter = ('data_element__name',)
     search_fields = ['data_element__name', 'category_combo__name', 'site_str']
 
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['source_doc', 'job_type', 'load_method', 'state', 'rows_processed', 'rows_per_second', 'created_at', 'finished_at']
+    list_filter = ('state', 'job_type')
+    readonly_fields = ('rows_processed', 'num_inserted', 'num_updated', 'num_unchanged', 'rows_per_second', 'error', 'started_at', 'finished_at')
+
 class ValidationRuleAdmin(admin.ModelAdmin):
     list_display = ['name', 'expression']
     filter_horizontal = ['data_elements']
 
+class ValidationViolationAdmin(admin.ModelAdmin):
+    list_display = ['rule', 'org_unit', 'period', 'left_value', 'right_value', 'checked_at']
+    list_filter = ('rule', 'period__period_type')
+    search_fields = ['rule__name', 'org_unit__name', 'period__iso']
+
 admin.site.register(SourceDocument, SourceDocumentAdmin)
 admin.site.register(OrgUnit, OrgUnitAdmin)
 admin.site.register(DataElement, DataElementAdmin)
@@ -49,6 +71,8 @@ admin.site.register(DataValue, DataValueAdmin)
 admin.site.register(Category)
 admin.site.register(CategoryCombo, CategoryComboAdmin)
 admin.site.register(ValidationRule, ValidationRuleAdmin)
+admin.site.register(ValidationViolation, ValidationViolationAdmin)
+admin.site.register(IngestionJob, IngestionJobAdmin)
 
 admin.site.site_title = 'RHITES-EC Data Validation Administrative Interface'
 admin.site.site_header = 'RHITES-EC Data Validation Admin'
@@ -0,0 +1,73 @@
+def is_separator(c):
+    return c == ',' or c.isspace()
+
+class CategoryMatcher():
+    r"""
+    Splits data element column headers on the category (disaggregation) names
+    they contain, in a single left-to-right pass over the header.
+
+    A category only matches directly after a run of separators (whitespace or
+    commas) and, where several categories match at the same place, the one
+    listed first wins. This gives the same result as re.split() on an
+    alternation of '[\s,]+?(<category>)' patterns, with empty pieces removed,
+    but the cost no longer grows with the number of categories.
+
+    >>> m = CategoryMatcher(['Male', 'Female', '<5 Years', 'Lost  to Followup', 'Lost'])
+    >>> m.split('105-4 Tested HIV+ Female, <5 Years')
+    ('105-4 Tested HIV+', 'Female', '<5 Years')
+
+    >>> m.split('106a Cohort  All patients 12 months Lost  to Followup')
+    ('106a Cohort  All patients 12 months', 'Lost  to Followup')
+
+    >>> m.split('Male partners tested') # no separator before the category
+    ('Male partners tested',)
+
+    >>> m.split_all(['Deliveries Female', 'Deliveries Male'])
+    [('Deliveries', 'Female'), ('Deliveries', 'Male')]
+
+    """
+
+    def __init__(self, categories):
+        self.categories = tuple(categories)
+        # trie of nested dicts, the None key holds the priority (list position) of the category ending there
+        self.trie = dict()
+        for priority, categ in enumerate(self.categories):
+            node = self.trie
+            for c in categ:
+                node = node.setdefault(c, dict())
+            node.setdefault(None, priority)
+
+    def match_at(self, text, pos):
+        """Return the end of the highest priority category starting at pos, or None"""
+        node = self.trie
+        best_priority = best_end = None
+        for i in range(pos, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            priority = node.get(None)
+            if priority is not None and (best_priority is None or priority < best_priority):
+                best_priority, best_end = priority, i+1
+        return best_end
+
+    def split(self, text):
+        pieces = list()
+        piece_start = 0
+        i, text_len = 0, len(text)
+        while i < text_len:
+            if not is_separator(text[i]):
+                i += 1
+                continue
+            sep_start = i
+            while i < text_len and is_separator(text[i]):
+                i += 1
+            categ_end = self.match_at(text, i)
+            if categ_end is not None:
+                pieces.append(text[piece_start:sep_start])
+                pieces.append(text[i:categ_end])
+                piece_start = i = categ_end
+        pieces.append(text[piece_start:])
+        return tuple(filter(None, pieces))
+
+    def split_all(self, texts):
+        return [self.split(t) for t in texts]
@@ -0,0 +1,88 @@
+import hashlib
+import zipfile
+import xml.etree.ElementTree as ET
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_DOC_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+def hash_chunks(chunks, h=None):
+    """Feed an iterable of byte strings to a (new sha256) hash object and return it"""
+    if h is None:
+        h = hashlib.sha256()
+    for chunk in chunks:
+        h.update(chunk)
+    return h
+
+def read_chunks(f, chunk_size=HASH_CHUNK_SIZE):
+    return iter(lambda: f.read(chunk_size), b'')
+
+def file_content_hash(chunks):
+    """Hex sha256 of a file, given as an iterable of byte strings (e.g. Django's File.chunks())"""
+    return hash_chunks(chunks).hexdigest()
+
+def worksheet_parts(zf):
+    """Return a list of (sheet name, zip member name) pairs for the worksheets of an opened .xlsx zip file"""
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    rel_targets = dict((rel.get('Id'), rel.get('Target')) for rel in rels.iter(NS_PKG_REL + 'Relationship'))
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    parts = list()
+    for sheet in workbook.iter(NS_MAIN + 'sheet'):
+        target = rel_targets[sheet.get(NS_DOC_REL + 'id')]
+        # targets are relative to xl/, unless absolute within the package
+        parts.append((sheet.get('name'), target.lstrip('/') if target.startswith('/') else 'xl/' + target))
+    return parts
+
+def item_text(elem):
+    """The text of a shared string or inline string element, joining rich text runs (but not phonetic hints)"""
+    texts = [t.text or '' for t in elem.findall(NS_MAIN + 't')]
+    texts.extend(t.text or '' for r in elem.findall(NS_MAIN + 'r') for t in r.findall(NS_MAIN + 't'))
+    return ''.join(texts)
+
+def shared_strings(zf):
+    """The workbook's shared strings table, as a list indexed like the t="s" cells refer to it"""
+    if 'xl/sharedStrings.xml' not in zf.namelist():
+        return []
+    strings = list()
+    with zf.open('xl/sharedStrings.xml') as f:
+        for event, elem in ET.iterparse(f):
+            if elem.tag == NS_MAIN + 'si':
+                strings.append(item_text(elem))
+                elem.clear()
+    return strings
+
+def sheet_cell_chunks(f, strings):
+    """
+    Generate a byte string per cell of a worksheet part: its reference, type,
+    formula and value, with shared string indexes replaced by the strings
+    """
+    for event, elem in ET.iterparse(f):
+        if elem.tag != NS_MAIN + 'c':
+            continue
+        cell_type = elem.get('t', 'n')
+        formula = elem.findtext(NS_MAIN + 'f') or ''
+        value = elem.findtext(NS_MAIN + 'v') or ''
+        if cell_type == 's' and value:
+            value = strings[int(value)]
+        elif cell_type == 'inlineStr':
+            inline = elem.find(NS_MAIN + 'is')
+            value = item_text(inline) if inline is not None else ''
+        yield '\x1f'.join((elem.get('r', ''), cell_type, formula, value)).encode('utf-8') + b'\x1e'
+        elem.clear()
+
+def worksheet_content_hashes(file_path):
+    """
+    Return a dict of sheet name to the hex sha256 of that worksheet's cells,
+    streamed out of the .xlsx zip. Text cells only hold indexes into the
+    workbook's shared strings table, so they are hashed with the strings they
+    refer to: a sheet's hash does not change when other sheets add strings
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        strings = shared_strings(zf)
+        sheet_hashes = dict()
+        for sheet_name, part_name in worksheet_parts(zf):
+            with zf.open(part_name) as f:
+                sheet_hashes[sheet_name] = hash_chunks(sheet_cell_chunks(f, strings)).hexdigest()
+    return sheet_hashes
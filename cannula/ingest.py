@@ -0,0 +1,250 @@
+from django.db import connection, transaction
+from django.conf import settings
+from django.utils import timezone
+
+import logging
+logger = logging.getLogger(__name__)
+
+import io
+import time
+from collections import namedtuple
+from functools import partial
+
+from .models import DataValue, IngestionJob, ORG_UNIT_PATHS, DATAVALUE_ROW_COLUMNS, invalidate_header_cache, invalidate_period_cache, aggregate_slices, refresh_aggregates, refresh_validation_results, load_excel_to_datavalues, load_excel_to_validations, resolve_workbook_dimensions
+from .instrument import StageTimer, record_queries
+
+LOAD_METHODS = IngestionJob.LOAD_METHODS
+
+# duplicates: values dropped because a later value in the same batch has the same key
+WriteCounts = namedtuple('WriteCounts', ['inserted', 'updated', 'unchanged', 'duplicates'])
+LoadStats = namedtuple('LoadStats', ['load_method', 'num_values', 'num_inserted', 'num_updated', 'num_unchanged', 'num_duplicates', 'seconds', 'values_per_second', 'stages'])
+
+# columns of cannula_datavalue populated from a workbook, in COPY order (that of the loader's rows)
+DATAVALUE_COPY_COLUMNS = DATAVALUE_ROW_COLUMNS
+DATAVALUE_STAGING_TABLE = 'cannula_datavalue_staging'
+# matches the expression index cannula_datavalue_period_uniq (see migration 0012)
+DATAVALUE_CONFLICT_KEY = "data_element_id, category_combo_id, org_unit_id, COALESCE(year, ''), COALESCE(quarter, ''), COALESCE(month, '')"
+
+def datavalue_conflict_key():
+    if getattr(settings, 'DATAVALUE_PARTITIONED', False):
+        from .partitions import PARTITIONED_CONFLICT_KEY
+        return PARTITIONED_CONFLICT_KEY
+    return DATAVALUE_CONFLICT_KEY
+
+def copy_text(val):
+    """
+    Format a value for the PostgreSQL COPY text format
+
+    >>> copy_text(None), copy_text(12), copy_text('Kumi\\tHC IV')
+    ('\\\\N', '12', 'Kumi\\\\tHC IV')
+
+    """
+    if val is None:
+        return '\\N'
+    val_str = str(val)
+    return val_str.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def datavalue_copy_rows(value_batch):
+    for row in value_batch:
+        yield '\t'.join(map(copy_text, row)) + '\n'
+
+def create_staging_table(cursor):
+    # the temporary table only lives as long as the session, and never holds rows across transactions:
+    # under autocommit the COPY would be emptied before the INSERT, so the writers stage and insert in one transaction
+    cursor.execute('SELECT to_regclass(%s)', ['pg_temp.%s' % (DATAVALUE_STAGING_TABLE,)])
+    if cursor.fetchone()[0] is not None:
+        return
+    cursor.execute(
+        'CREATE TEMPORARY TABLE %s ON COMMIT DELETE ROWS AS SELECT %s FROM %s WITH NO DATA' % (
+            DATAVALUE_STAGING_TABLE, ', '.join(DATAVALUE_COPY_COLUMNS), DataValue._meta.db_table
+        )
+    )
+    # numbers the rows in COPY order, so of several staged values with the same key the last one wins
+    cursor.execute('ALTER TABLE %s ADD COLUMN staged_order BIGSERIAL' % (DATAVALUE_STAGING_TABLE,))
+
+def copy_to_staging(cursor, value_batch):
+    buf = io.StringIO(''.join(datavalue_copy_rows(value_batch)))
+    copy_sql = 'COPY %s (%s) FROM STDIN' % (DATAVALUE_STAGING_TABLE, ', '.join(DATAVALUE_COPY_COLUMNS))
+    cursor.copy_expert(copy_sql, buf)
+
+def write_values_orm(value_batch):
+    DataValue.objects.bulk_create([DataValue(**dict(zip(DATAVALUE_ROW_COLUMNS, row))) for row in value_batch])
+    return WriteCounts(len(value_batch), 0, 0, 0)
+
+def write_values_copy(value_batch):
+    """
+    Stream a batch of data value rows into the staging table with COPY,
+    then move them into cannula_datavalue with a single INSERT ... SELECT
+    """
+    cols_str = ', '.join(DATAVALUE_COPY_COLUMNS)
+    with transaction.atomic():
+        cursor = connection.cursor()
+        create_staging_table(cursor)
+        copy_to_staging(cursor, value_batch)
+        cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s' % (DataValue._meta.db_table, cols_str, cols_str, DATAVALUE_STAGING_TABLE))
+        num_inserted = cursor.rowcount
+        cursor.execute('TRUNCATE %s' % (DATAVALUE_STAGING_TABLE,))
+    return WriteCounts(num_inserted, 0, 0, 0)
+
+def write_values_upsert(value_batch):
+    """
+    Stage a batch of data value rows with COPY, then insert the new ones and
+    update the ones whose value differs. Values already there are moved to the
+    batch's source document even when unchanged, so deleting the document they
+    were first loaded from does not delete them. Of values with the same key
+    in one batch the last one is written, the others are counted as duplicates
+    """
+    cols_str = ', '.join(DATAVALUE_COPY_COLUMNS)
+    update_str = ', '.join('%s = EXCLUDED.%s' % (col, col) for col in ('numeric_value', 'site_str', 'source_doc_id'))
+    # ON CONFLICT cannot touch the same row twice in one statement, so keep one staged row per key
+    # every part of the statement sees the table as it was before, so previous holds the values being replaced
+    # (xmax = 0) is only true for freshly inserted rows, which separates inserts from updates
+    upsert_sql = '''
+        WITH staged AS (
+            SELECT DISTINCT ON (%(key)s) %(cols)s FROM %(staging)s
+            ORDER BY %(key)s, staged_order DESC
+        ), previous AS (
+            SELECT id, numeric_value FROM %(table)s
+            WHERE (%(key)s) IN (SELECT %(key)s FROM staged)
+        ), upserted AS (
+            INSERT INTO %(table)s (%(cols)s)
+            SELECT %(cols)s FROM staged
+            ON CONFLICT (%(key)s)
+            DO UPDATE SET %(update)s
+            WHERE %(table)s.numeric_value IS DISTINCT FROM EXCLUDED.numeric_value OR %(table)s.source_doc_id IS DISTINCT FROM EXCLUDED.source_doc_id
+            RETURNING id, numeric_value, (xmax = 0) AS inserted
+        )
+        SELECT
+            COUNT(*) FILTER (WHERE upserted.inserted),
+            COUNT(*) FILTER (WHERE NOT upserted.inserted AND upserted.numeric_value IS DISTINCT FROM previous.numeric_value),
+            (SELECT COUNT(*) FROM staged)
+        FROM upserted LEFT JOIN previous ON previous.id = upserted.id
+    ''' % {
+        'table': DataValue._meta.db_table,
+        'cols': cols_str,
+        'key': datavalue_conflict_key(),
+        'staging': DATAVALUE_STAGING_TABLE,
+        'update': update_str,
+    }
+    with transaction.atomic():
+        cursor = connection.cursor()
+        create_staging_table(cursor)
+        copy_to_staging(cursor, value_batch)
+        cursor.execute(upsert_sql)
+        num_inserted, num_updated, num_staged = cursor.fetchone()
+        cursor.execute('TRUNCATE %s' % (DATAVALUE_STAGING_TABLE,))
+    return WriteCounts(num_inserted, num_updated, num_staged - num_inserted - num_updated, len(value_batch) - num_staged)
+
+VALUE_WRITERS = {
+    'ORM': write_values_orm,
+    'COPY': write_values_copy,
+    'UPSERT': write_values_upsert,
+}
+
+def write_batch(write_values, source_doc, value_batch):
+    counts = write_values(value_batch) if value_batch else WriteCounts(0, 0, 0, 0)
+    source_doc.record_checkpoint(value_batch.checkpoint)
+    return counts
+
+def load_document_values(source_doc, load_method='ORM', progress=None, commit_batches=False, workers=1, batch_size=None, timer=None):
+    """
+    Parse the data values in a source document and write them to the
+    database, batch by batch, using the chosen load method. If given, progress
+    is called with the running LoadStats after every batch. With commit_batches
+    each batch (of settings.INGESTION_CHUNK_SIZE values, unless batch_size is
+    given) is written in its own transaction, along with a checkpoint of the
+    worksheet rows it completes, so progress is visible to other connections
+    while the load runs and a failed load picks up where it stopped when it is
+    run again. workers > 1 parses the worksheets in that many parallel processes.
+    The time and queries of each stage are recorded in timer (a StageTimer)
+    and returned in LoadStats.stages. Once all values are written the
+    AggregateValues they count towards, and the results of the validation
+    rules over their data elements, are refreshed.
+
+    A document identical to one already loaded is skipped without opening it
+    """
+    write_values = VALUE_WRITERS[load_method]
+    if batch_size is None:
+        batch_size = getattr(settings, 'INGESTION_CHUNK_SIZE', 5000)
+    if timer is None:
+        timer = StageTimer()
+
+    duplicate = source_doc.loaded_duplicate()
+    if duplicate:
+        logger.info('%s: skipped, same contents as %s', source_doc, duplicate)
+        source_doc.mark_values_loaded()
+        return LoadStats(load_method, 0, 0, 0, 0, 0, 0.0, None, [])
+
+    start_time = time.perf_counter()
+    num_values = num_inserted = num_updated = num_unchanged = num_duplicates = 0
+    with record_queries():
+        for value_batch in load_excel_to_datavalues(source_doc, batch_size=batch_size, workers=workers, timer=timer):
+            with timer.stage('write'):
+                if commit_batches:
+                    with transaction.atomic():
+                        counts = write_batch(write_values, source_doc, value_batch)
+                else:
+                    counts = write_batch(write_values, source_doc, value_batch)
+            num_values += len(value_batch)
+            num_inserted += counts.inserted
+            num_updated += counts.updated
+            num_unchanged += counts.unchanged
+            num_duplicates += counts.duplicates
+            if progress:
+                seconds = time.perf_counter() - start_time
+                progress(LoadStats(load_method, num_values, num_inserted, num_updated, num_unchanged, num_duplicates, seconds, num_values / seconds if seconds > 0 else None, timer.timings()))
+    seconds = time.perf_counter() - start_time
+    source_doc.mark_values_loaded()
+    data_element_ids, iso_periods = aggregate_slices(source_doc.data_values.all())
+    with timer.stage('aggregates'):
+        refresh_aggregates(data_element_ids, iso_periods)
+    with timer.stage('validations'):
+        refresh_validation_results(data_element_ids)
+
+    values_per_second = num_values / seconds if seconds > 0 else None
+    stats = LoadStats(load_method, num_values, num_inserted, num_updated, num_unchanged, num_duplicates, seconds, values_per_second, timer.timings())
+    if num_duplicates:
+        logger.warning('%s: %d values repeat the key of a later value in the same batch, only the later one was written', source_doc, num_duplicates)
+    logger.info('%s: loaded %d values in %.2fs (%s, %.0f values/s, %d inserted, %d updated, %d unchanged)', source_doc, num_values, seconds, load_method, values_per_second or 0, num_inserted, num_updated, num_unchanged)
+    return stats
+
+def record_job_progress(job, stats):
+    job.rows_processed = stats.num_values
+    job.num_inserted, job.num_updated, job.num_unchanged = stats.num_inserted, stats.num_updated, stats.num_unchanged
+    job.rows_per_second = stats.values_per_second
+    job.save(update_fields=['rows_processed', 'num_inserted', 'num_updated', 'num_unchanged', 'rows_per_second'])
+
+def run_ingestion_job(job, workers=None):
+    """
+    Run a claimed IngestionJob to completion, recording progress on the job as
+    it goes. Values committed before a failure are kept: re-queue the document
+    to resume the load from its checkpoint
+    """
+    if workers is None:
+        workers = getattr(settings, 'INGESTION_PROCESSES', 1)
+    timer = StageTimer()
+    # another process (e.g. the admin) may have edited the lookup tables since the last job, and only clears its own caches
+    invalidate_header_cache()
+    ORG_UNIT_PATHS.clear() # warmed again by the load
+    try:
+        if job.job_type == 'VALUES':
+            with timer.stage('dimensions'):
+                resolve_workbook_dimensions(job.source_doc) # workers run side by side, create the rows they share in turns
+            stats = load_document_values(job.source_doc, load_method=job.load_method, progress=partial(record_job_progress, job), commit_batches=True, workers=workers, timer=timer)
+            record_job_progress(job, stats)
+        elif job.job_type == 'VALIDATIONS':
+            with transaction.atomic():
+                load_excel_to_validations(job.source_doc)
+        job.state = 'DONE'
+    except Exception as e:
+        logger.exception('ingestion job %d failed', job.id)
+        # rows created in a rolled back transaction may be cached
+        invalidate_header_cache()
+        invalidate_period_cache()
+        ORG_UNIT_PATHS.clear()
+        job.state = 'FAILED'
+        job.error = '%s: %s' % (e.__class__.__name__, e)
+    job.stage_timings = timer.to_json() # kept for failed loads too, they show where the time went up to the failure
+    job.finished_at = timezone.now()
+    job.save()
+    return job
@@ -0,0 +1,96 @@
+from django.db import connection
+
+import json
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+StageTiming = namedtuple('StageTiming', ['stage', 'seconds', 'calls', 'queries'])
+
+def last_query():
+    """The most recently logged query, marking where to start counting from (see queries_since())"""
+    return connection.queries_log[-1] if connection.queries_log else None
+
+def queries_since(marker):
+    """
+    Number of queries logged after marker (see last_query()). The log keeps
+    only the last 9000 queries, so if marker has dropped out of it the count
+    is that of the whole log
+    """
+    num_queries = 0
+    for query in reversed(connection.queries_log):
+        if query is marker:
+            break
+        num_queries += 1
+    return num_queries
+
+class StageTimer():
+    """
+    Accumulates the wall time, number of calls and number of database queries
+    of each stage of an ingestion, in the order the stages are first seen
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def add(self, stage, seconds, calls=1, queries=0):
+        totals = self.stages.get(stage)
+        if totals is None:
+            totals = self.stages[stage] = [0.0, 0, 0]
+        totals[0] += seconds
+        totals[1] += calls
+        totals[2] += queries
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Time the enclosed block, counting its queries if they are being recorded
+        (see record_queries()). The log is left alone, so an enclosing stage
+        still counts the queries of the stages nested in it
+        """
+        marker = last_query()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start_time, queries=queries_since(marker))
+
+    def timed_iter(self, stage, iterable):
+        """Generator passing on the items of iterable, timing how long each takes to produce"""
+        it = iter(iterable)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start_time, calls=0)
+                return
+            self.add(stage, time.perf_counter() - start_time)
+            yield item
+
+    def timings(self):
+        return [StageTiming(stage, seconds, calls, queries) for stage, (seconds, calls, queries) in self.stages.items()]
+
+    def to_json(self):
+        return json.dumps([t._asdict() for t in self.timings()])
+
+    @staticmethod
+    def timings_from_json(timings_json):
+        return [StageTiming(**t) for t in json.loads(timings_json)] if timings_json else []
+
+@contextmanager
+def record_queries():
+    """
+    Have the connection log queries (as it does with DEBUG on), so StageTimer
+    can count them. Only the last 9000 are kept: a stage running more than
+    that per call is counted as 9000
+    """
+    was_logged, was_forced = connection.queries_logged, connection.force_debug_cursor
+    connection.force_debug_cursor = True
+    try:
+        yield
+    finally:
+        connection.force_debug_cursor = was_forced
+        if not was_logged:
+            # only drop the queries this context logged, not a log DEBUG (or the caller) keeps
+            connection.queries_log.clear()
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import re
+import random
+import timeit
+
+from cannula.models import CATEGORIES, CATEGORY_REGEX, CATEGORY_MATCHER
+
+SAMPLE_DE_NAMES = (
+    '105-4 Number of Individuals who received HIV test results',
+    '105-1.3 OPD Malaria (Total)',
+    '106a Cohort  All patients 12 months',
+    '105-5 Number of Males Circumcised by Age group and Technique Facility, Device Based (DC)',
+    '105-7.3 Lab Malaria RDTs Number Done',
+)
+
+def make_headers(num_headers):
+    headers = list()
+    for _ in range(num_headers):
+        de_name = random.choice(SAMPLE_DE_NAMES)
+        categs = random.sample(CATEGORIES, random.randint(0, 2))
+        headers.append(' '.join([de_name] + categs))
+    return headers
+
+def regex_split(header):
+    return tuple(filter(None, re.split(CATEGORY_REGEX, header)))
+
+class Command(BaseCommand):
+    help = 'Compare the speed of splitting column headers with CategoryMatcher against the CATEGORY_REGEX split'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--headers', type=int, default=1000, help='Number of synthetic headers to split')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        headers = make_headers(options['headers'])
+
+        for h in headers:
+            if regex_split(h) != CATEGORY_MATCHER.split(h):
+                raise CommandError('CategoryMatcher disagrees with CATEGORY_REGEX on %r' % (h,))
+
+        regex_secs = min(timeit.repeat(lambda: [regex_split(h) for h in headers], number=1, repeat=options['repeat']))
+        matcher_secs = min(timeit.repeat(lambda: CATEGORY_MATCHER.split_all(headers), number=1, repeat=options['repeat']))
+
+        self.stdout.write('%d headers, %d categories' % (len(headers), len(CATEGORIES)))
+        self.stdout.write('CATEGORY_REGEX:  %8.2f us/header' % (regex_secs * 1e6 / len(headers),))
+        self.stdout.write('CategoryMatcher: %8.2f us/header (%.1fx)' % (matcher_secs * 1e6 / len(headers), regex_secs / matcher_secs))
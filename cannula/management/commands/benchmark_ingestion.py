@@ -0,0 +1,152 @@
+from django.core.management.base import BaseCommand
+from django.core.files import File
+from django.db import transaction
+
+import os
+import json
+import time
+import tempfile
+import datetime
+import subprocess
+
+from cannula.models import SourceDocument, ORG_UNIT_PATHS, invalidate_header_cache, invalidate_period_cache, resolve_workbook_dimensions, load_excel_to_datavalues, data_worksheets, clean_header_names, parse_worksheet_rows
+from cannula.ingest import VALUE_WRITERS
+from cannula.instrument import StageTimer, record_queries
+from cannula.synthetic import DEFAULT_SHAPE, WorkbookShape, make_synthetic_workbook
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def stage_result(seconds, num_values):
+    return {'seconds': round(seconds, 4), 'values_per_second': round(num_values / seconds) if seconds > 0 else None}
+
+def time_parse(file_path):
+    """Parse every worksheet without touching the database, returns (seconds, number of values)"""
+    import openpyxl
+
+    start_time = time.perf_counter()
+    num_values = 0
+    wb = openpyxl.load_workbook(file_path, read_only=True)
+    for ws in data_worksheets(wb):
+        ws_rows = ws.iter_rows()
+        header_row = next(ws_rows, None)
+        if header_row is None:
+            continue
+        header_names = clean_header_names([cell.value for cell in header_row])
+        for _, _, values in parse_worksheet_rows(ws_rows, len(header_names)):
+            num_values += len(values)
+    return time.perf_counter() - start_time, num_values
+
+def time_load(source_doc, load_method, repeat_upsert=False):
+    """
+    Time building the DataValue instances and writing them with one of the
+    VALUE_WRITERS, separately. Returns a dict of stage results, and the
+    finer grained StageTimer timings of building the values
+    """
+    write_values = VALUE_WRITERS[load_method]
+    build_seconds = write_seconds = rewrite_seconds = 0.0
+    num_values = 0
+    timer = StageTimer()
+
+    start_time = time.perf_counter()
+    for value_batch in load_excel_to_datavalues(source_doc, timer=timer):
+        write_start = time.perf_counter()
+        build_seconds += write_start - start_time
+        write_values(value_batch)
+        write_end = time.perf_counter()
+        write_seconds += write_end - write_start
+        if repeat_upsert:
+            # writing the same values again measures a re-load where nothing changed
+            write_values(value_batch)
+            rewrite_seconds += time.perf_counter() - write_end
+        num_values += len(value_batch)
+        start_time = time.perf_counter()
+
+    results = {
+        'build': stage_result(build_seconds, num_values),
+        'write_%s' % (load_method.lower(),): stage_result(write_seconds, num_values),
+    }
+    if repeat_upsert:
+        results['rewrite_%s_unchanged' % (load_method.lower(),)] = stage_result(rewrite_seconds, num_values)
+    return results, timer.timings()
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic HMIS workbook, time its ingestion stage by stage and append the results to a JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--districts', type=int, default=DEFAULT_SHAPE.districts)
+        parser.add_argument('--subcounties', type=int, default=DEFAULT_SHAPE.subcounties, help='Per district')
+        parser.add_argument('--facilities', type=int, default=DEFAULT_SHAPE.facilities, help='Per subcounty')
+        parser.add_argument('--months', type=int, default=DEFAULT_SHAPE.months)
+        parser.add_argument('--data-elements', type=int, default=DEFAULT_SHAPE.data_elements, help='Most have several disaggregation columns')
+        parser.add_argument('--sheets', type=int, default=DEFAULT_SHAPE.sheets)
+        parser.add_argument('--fill-ratio', type=float, default=DEFAULT_SHAPE.fill_ratio, help='Share of value cells that are not empty')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--methods', nargs='+', default=sorted(VALUE_WRITERS.keys()), choices=sorted(VALUE_WRITERS.keys()))
+        parser.add_argument('--output', default='ingestion_benchmark.json', help='JSON file the results are appended to')
+        parser.add_argument('--generate-only', metavar='PATH', help='Just write the synthetic workbook to PATH')
+
+    def handle(self, *args, **options):
+        shape = WorkbookShape(options['districts'], options['subcounties'], options['facilities'], options['months'], options['data_elements'], options['sheets'], options['fill_ratio'])
+
+        if options['generate_only']:
+            num_values = make_synthetic_workbook(options['generate_only'], shape, seed=options['seed'])
+            self.stdout.write('Wrote %s: %d values' % (options['generate_only'], num_values))
+            return
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'synthetic.xlsx')
+            start_time = time.perf_counter()
+            num_values = make_synthetic_workbook(file_path, shape, seed=options['seed'])
+            self.stdout.write('Generated %d values in %.1fs' % (num_values, time.perf_counter() - start_time))
+
+            stages = dict()
+            parse_seconds, num_parsed = time_parse(file_path)
+            stages['parse'] = stage_result(parse_seconds, num_parsed)
+
+            # nothing the benchmark writes is kept: every method runs in a transaction that is rolled back
+            for load_method in options['methods']:
+                invalidate_header_cache()
+                invalidate_period_cache()
+                ORG_UNIT_PATHS.clear()
+                with transaction.atomic():
+                    with open(file_path, 'rb') as f:
+                        source_doc = SourceDocument(file=File(f, name='synthetic.xlsx'))
+                        source_doc.save()
+                    try:
+                        start_time = time.perf_counter()
+                        resolve_workbook_dimensions(source_doc)
+                        stages['dimensions'] = stage_result(time.perf_counter() - start_time, num_values)
+                        with record_queries():
+                            load_results, build_timings = time_load(source_doc, load_method, repeat_upsert=(load_method == 'UPSERT'))
+                        stages.update(load_results)
+                    finally:
+                        source_doc.file.delete(save=False)
+                        transaction.set_rollback(True)
+            invalidate_header_cache()
+            invalidate_period_cache()
+            ORG_UNIT_PATHS.clear()
+
+        result = {
+            'commit': git_commit(),
+            'run_at': datetime.datetime.now().isoformat(),
+            'shape': shape._asdict(),
+            'seed': options['seed'],
+            'num_values': num_values,
+            'stages': stages,
+            'build_stages': [t._asdict() for t in build_timings],
+        }
+        for stage, stage_stats in sorted(stages.items()):
+            self.stdout.write('%-28s %8.3fs %10s values/s' % (stage, stage_stats['seconds'], stage_stats['values_per_second']))
+
+        results = list()
+        if os.path.exists(options['output']):
+            with open(options['output']) as f:
+                results = json.load(f)
+        results.append(result)
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write('Results appended to %s' % (options['output'],))
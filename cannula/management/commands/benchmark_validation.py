@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+import time
+
+from cannula.models import Period, ValidationRule, checkable_rules, check_validation_rules, iso_period_ordinal
+
+class Command(BaseCommand):
+    help = 'Time checking the validation rules for a period: the per-rule SQL views, the single pass SQL engine and the NumPy evaluator'
+
+    def add_arguments(self, parser):
+        parser.add_argument('period', help='ISO 8601 period, e.g. 2017-Q3')
+        parser.add_argument('--repeat', type=int, default=100, help='Times to repeat the NumPy evaluation, to time it more precisely')
+        parser.add_argument('--skip-views', action='store_true', help='Do not time the per-rule views (they read all periods)')
+
+    def handle(self, *args, **options):
+        from cannula.ruleeval import PeriodMatrix, compile_rules
+
+        try:
+            iso_period_ordinal(options['period'])
+        except (ValueError, IndexError):
+            raise CommandError('Not an ISO 8601 period: %s' % (options['period'],))
+        period = Period.from_iso(options['period']) # outside the rolled back transaction, as it is cached
+        rules = ValidationRule.objects.all()
+        checked_rules = checkable_rules(rules)
+        de_ids = sorted(set(de.id for rule, data_elements in checked_rules for de in data_elements))
+        results = list()
+
+        if not options['skip_views']:
+            cursor = connection.cursor()
+            start_time = time.perf_counter()
+            for rule, data_elements in checked_rules:
+                cursor.execute('SELECT * FROM %s' % (rule.view_name(),))
+                cursor.fetchall()
+            results.append(('sql_views', time.perf_counter() - start_time))
+
+        # nothing the benchmark writes is kept
+        with transaction.atomic():
+            start_time = time.perf_counter()
+            check_validation_rules(options['period'], rules, engine='SQL')
+            results.append(('sql_batch', time.perf_counter() - start_time))
+            start_time = time.perf_counter()
+            check_validation_rules(options['period'], rules, engine='NUMPY')
+            results.append(('numpy_batch', time.perf_counter() - start_time))
+            transaction.set_rollback(True)
+
+        start_time = time.perf_counter()
+        matrix = PeriodMatrix.load(de_ids, period)
+        results.append(('numpy_load', time.perf_counter() - start_time))
+        start_time = time.perf_counter()
+        compiled_rules = compile_rules(checked_rules)
+        results.append(('numpy_compile', time.perf_counter() - start_time))
+        start_time = time.perf_counter()
+        for _ in range(options['repeat']):
+            for compiled_rule in compiled_rules:
+                compiled_rule.evaluate(matrix)
+        results.append(('numpy_evaluate', (time.perf_counter() - start_time) / options['repeat']))
+
+        self.stdout.write('%d rules, %d data elements, %d org units' % (len(checked_rules), len(de_ids), len(matrix.org_unit_ids)))
+        for stage, seconds in results:
+            per_rule = seconds / len(checked_rules) if checked_rules else 0
+            self.stdout.write('%-16s %10.4fs %12.1fus/rule' % (stage, seconds, per_rule * 1e6))
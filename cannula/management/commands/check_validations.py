@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import time
+
+from cannula.models import ValidationRule, check_validation_rules, iso_period_ordinal
+
+class Command(BaseCommand):
+    help = 'Check the validation rules against the values of some periods, recording the violations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('periods', nargs='+', help='ISO 8601 periods, e.g. 2017-Q3 2017-10')
+        parser.add_argument('--rules', nargs='+', help='Names of the rules to check (default: all)')
+        parser.add_argument('--engine', choices=['SQL', 'NUMPY'], default='SQL', help='Evaluate the rules in PostgreSQL, or as NumPy array operations')
+
+    def handle(self, *args, **options):
+        for iso_period in options['periods']:
+            try:
+                iso_period_ordinal(iso_period)
+            except (ValueError, IndexError):
+                raise CommandError('Not an ISO 8601 period: %s' % (iso_period,))
+
+        rules = ValidationRule.objects.all()
+        if options['rules']:
+            rules = rules.filter(name__in=options['rules'])
+        for iso_period in options['periods']:
+            start_time = time.perf_counter()
+            num_rules, num_violations = check_validation_rules(iso_period, rules, engine=options['engine'])
+            self.stdout.write('%s: %d rules checked, %d violations in %.1fs' % (iso_period, num_rules, num_violations, time.perf_counter() - start_time))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from cannula import partitions
+
+class Command(BaseCommand):
+    help = 'Manage the year partitions of cannula_datavalue (see settings.DATAVALUE_PARTITIONED)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'convert', 'create', 'detach', 'attach'])
+        parser.add_argument('years', nargs='*', type=int)
+        parser.add_argument('--ahead', type=int, default=0, help='With create: also create the partitions of this many years after the current one')
+        parser.add_argument('--table', help='With attach: the table to attach (default: the one detach left behind)')
+
+    def handle(self, *args, **options):
+        action, years = options['action'], options['years']
+        cursor = connection.cursor()
+
+        if action == 'convert':
+            if partitions.is_partitioned(cursor):
+                raise CommandError('%s is already partitioned' % (partitions.DATAVALUE_TABLE,))
+            try:
+                with transaction.atomic():
+                    partitions.convert_to_partitioned(cursor)
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write('Converted %s, set DATAVALUE_PARTITIONED = True in the settings' % (partitions.DATAVALUE_TABLE,))
+        elif not partitions.is_partitioned(cursor):
+            raise CommandError('%s is not partitioned, convert it first' % (partitions.DATAVALUE_TABLE,))
+        elif action == 'create':
+            this_year = timezone.now().year
+            years = sorted(set(years) | set(range(this_year, this_year + options['ahead'] + 1) if options['ahead'] else ()))
+            if not years:
+                raise CommandError('Give the years to create partitions for, and/or --ahead')
+            for year in years:
+                partitions.create_partition(year, cursor)
+                self.stdout.write('Created %s' % (partitions.partition_name(year),))
+        elif action in ('detach', 'attach'):
+            if len(years) != 1:
+                raise CommandError('Give one year to %s' % (action,))
+            if action == 'detach':
+                partitions.detach_partition(years[0], cursor)
+                self.stdout.write('Detached %s, its values are no longer visible' % (partitions.partition_name(years[0]),))
+            else:
+                partitions.attach_partition(years[0], options['table'], cursor)
+                self.stdout.write('Attached %s' % (options['table'] or partitions.partition_name(years[0]),))
+
+        for table_name, bound in partitions.list_partitions(cursor):
+            self.stdout.write('%-32s %s' % (table_name, bound))
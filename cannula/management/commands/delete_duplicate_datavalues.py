@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+# the values sharing a data element, category combo, org unit and period (NULLs equal), but for the most recently loaded (highest id) one
+DUPLICATES_SQL = '''
+SELECT id FROM (
+    SELECT id, ROW_NUMBER() OVER (
+        PARTITION BY data_element_id, category_combo_id, org_unit_id, COALESCE(year, ''), COALESCE(quarter, ''), COALESCE(month, '')
+        ORDER BY id DESC
+    ) AS row_num
+    FROM cannula_datavalue
+) AS q_duplicates
+WHERE row_num > 1
+'''
+
+class Command(BaseCommand):
+    help = 'Delete the DataValues that repeat the data element, category combo, org unit and period of a more recently loaded one (migration 0012 refuses to run while there are any)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help='Delete them, rather than only listing them')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute('''
+                SELECT id, data_element_id, category_combo_id, org_unit_id, year, quarter, month, numeric_value, source_doc_id
+                FROM cannula_datavalue WHERE id IN (%s) ORDER BY id
+            ''' % (DUPLICATES_SQL,))
+            duplicates = cursor.fetchall()
+            for row in duplicates:
+                self.stdout.write('id %d: data element %s, category combo %s, org unit %s, period %s/%s/%s, value %s, source document %s' % row)
+            if options['delete'] and duplicates:
+                cursor.execute('DELETE FROM cannula_datavalue WHERE id IN (%s)' % (DUPLICATES_SQL,))
+                self.stdout.write('Deleted %d duplicate values' % (cursor.rowcount,))
+            else:
+                self.stdout.write('%d duplicate values, run with --delete to delete them' % (len(duplicates),))
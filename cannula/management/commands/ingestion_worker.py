@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+import time
+
+from cannula.models import IngestionJob, ORG_UNIT_PATHS
+from cannula.ingest import run_ingestion_job
+
+class Command(BaseCommand):
+    help = 'Run queued ingestion jobs (loading of source documents) in a worker process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to wait between checks of an empty queue')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--processes', type=int, default=None, help='Parse worksheets in this many parallel processes (default: settings.INGESTION_PROCESSES or 1)')
+        parser.add_argument('--requeue-interrupted', action='store_true', help='Queue again the jobs left running by a worker that was stopped, they resume from their checkpoint (only when no other worker is running)')
+
+    def handle(self, *args, **options):
+        if options['requeue_interrupted']:
+            num_requeued = IngestionJob.objects.filter(state='RUNNING').update(state='QUEUED', started_at=None)
+            self.stdout.write('Re-queued %d interrupted jobs' % (num_requeued,))
+        ORG_UNIT_PATHS.warm()
+        while True:
+            job = IngestionJob.claim_next()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write('Running %s' % (job,))
+            run_ingestion_job(job, workers=options['processes'])
+            self.stdout.write('Finished %s: %d rows (%.0f rows/s)' % (job, job.rows_processed, job.rows_per_second or 0))
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.files import File
+from django.db import connection, connections, transaction
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cannula.models import SourceDocument, ORG_UNIT_PATHS, invalidate_header_cache, invalidate_period_cache, resolve_workbook_dimensions
+from cannula.ingest import LOAD_METHODS, load_document_values
+
+def load_document_task(doc_id, load_method, chunked=False, chunk_size=None):
+    """Load one source document (in a worker process), returns (doc_id, LoadStats or None, error or None)"""
+    try:
+        doc = SourceDocument.objects.get(id=doc_id)
+        resolve_workbook_dimensions(doc)
+        if chunked:
+            stats = load_document_values(doc, load_method=load_method, commit_batches=True, batch_size=chunk_size)
+        else:
+            with transaction.atomic():
+                stats = load_document_values(doc, load_method=load_method, batch_size=chunk_size)
+        return doc_id, stats, None
+    except Exception as e:
+        # the worker process goes on to other documents, don't leave rolled back rows in its caches
+        invalidate_header_cache()
+        invalidate_period_cache()
+        ORG_UNIT_PATHS.clear()
+        return doc_id, None, '%s: %s' % (e.__class__.__name__, e)
+    finally:
+        connection.close()
+
+class Command(BaseCommand):
+    help = 'Load the data values of many source documents (by id, or every workbook in a directory) concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('doc_ids', nargs='*', type=int, help='Ids of existing source documents')
+        parser.add_argument('--dir', help='Upload and load every .xlsx workbook in this directory')
+        parser.add_argument('--method', default='COPY', choices=[m for m, desc in LOAD_METHODS])
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of documents loaded at the same time')
+        parser.add_argument('--chunked', action='store_true', help='Commit every chunk of values instead of a transaction per document, a failed document resumes from its checkpoint when loaded again')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Values written per chunk (default: settings.INGESTION_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        doc_ids = list(options['doc_ids'])
+        if options['dir']:
+            for filename in sorted(os.listdir(options['dir'])):
+                if not filename.lower().endswith('.xlsx'):
+                    continue
+                with open(os.path.join(options['dir'], filename), 'rb') as f:
+                    doc = SourceDocument(file=File(f, name=filename))
+                    doc.save()
+                doc_ids.append(doc.id)
+        if not doc_ids:
+            raise CommandError('Give some source document ids and/or a --dir of workbooks')
+
+        doc_names = dict(SourceDocument.objects.filter(id__in=doc_ids).values_list('id', 'orig_filename'))
+
+        # each worker process opens its own database connection, don't hand ours down to them
+        for conn in connections.all():
+            conn.close()
+
+        start_time = time.perf_counter()
+        results = list()
+        with ProcessPoolExecutor(max_workers=options['concurrency']) as executor:
+            futures = [executor.submit(load_document_task, doc_id, options['method'], options['chunked'], options['chunk_size']) for doc_id in doc_ids]
+            for future in as_completed(futures):
+                doc_id, stats, error = future.result()
+                results.append((doc_id, stats, error))
+                if error:
+                    self.stderr.write('FAILED %s (id %d): %s' % (doc_names.get(doc_id), doc_id, error))
+                else:
+                    self.stdout.write('%s (id %d): %d values in %.1fs (%.0f values/s)' % (doc_names.get(doc_id), doc_id, stats.num_values, stats.seconds, stats.values_per_second or 0))
+                    if options['verbosity'] > 1:
+                        for timing in stats.stages:
+                            self.stdout.write('    %-18s %8.3fs %10d calls %6d queries' % timing)
+        elapsed = time.perf_counter() - start_time
+
+        loaded = [stats for doc_id, stats, error in results if stats]
+        failed = [(doc_id, error) for doc_id, stats, error in results if error]
+        total_values = sum(stats.num_values for stats in loaded)
+        self.stdout.write('Loaded %d of %d documents, %d values in %.1fs (%.0f values/s overall)' % (len(loaded), len(results), total_values, elapsed, total_values / elapsed if elapsed > 0 else 0))
+        if failed:
+            self.stdout.write('Failed documents:')
+            for doc_id, error in failed:
+                self.stdout.write('  %s (id %d): %s' % (doc_names.get(doc_id), doc_id, error))
+            raise CommandError('%d of %d documents failed to load' % (len(failed), len(results)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+import time
+
+from cannula.models import AggregateValue, DataValue, aggregate_slices, refresh_aggregates, refresh_validation_results
+
+class Command(BaseCommand):
+    help = 'Recompute the AggregateValues behind the dashboards and the validation rule results from the DataValues (all of them, or those of some source documents)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source_doc_ids', nargs='*', type=int, help='Only the slices the values of these source documents count towards')
+
+    def handle(self, *args, **options):
+        start_time = time.perf_counter()
+        if options['source_doc_ids']:
+            data_element_ids, iso_periods = aggregate_slices(DataValue.objects.filter(source_doc_id__in=options['source_doc_ids']))
+            refresh_aggregates(data_element_ids, iso_periods)
+            refresh_validation_results(data_element_ids)
+        else:
+            refresh_aggregates()
+            refresh_validation_results()
+        self.stdout.write('Refreshed in %.1fs, %d aggregate values' % (time.perf_counter() - start_time, AggregateValue.objects.count()))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# unique_together does not catch duplicates when month/quarter are NULL (NULLs
+# never compare equal), so also index the period columns with NULLs folded to ''
+# this index is the conflict target for upserts in cannula.ingest
+# duplicates unique_together let through would fail the index; they are values
+# people loaded, so rather than pick which to keep the migration stops and lists
+# them (see the delete_duplicate_datavalues command)
+FIND_DUPLICATES_SQL = '''
+SELECT data_element_id, category_combo_id, org_unit_id, year, quarter, month, COUNT(*)
+FROM cannula_datavalue
+GROUP BY data_element_id, category_combo_id, org_unit_id, year, quarter, month
+HAVING COUNT(*) > 1
+ORDER BY data_element_id, category_combo_id, org_unit_id, year, quarter, month
+LIMIT 50
+'''
+CREATE_INDEX_SQL = '''
+CREATE UNIQUE INDEX cannula_datavalue_period_uniq ON cannula_datavalue
+(data_element_id, category_combo_id, org_unit_id, COALESCE(year, ''), COALESCE(quarter, ''), COALESCE(month, ''))
+'''
+DROP_INDEX_SQL = 'DROP INDEX IF EXISTS cannula_datavalue_period_uniq'
+
+def check_no_duplicates(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(FIND_DUPLICATES_SQL)
+        duplicates = cursor.fetchall()
+    if duplicates:
+        raise RuntimeError(
+            'cannula_datavalue has values with the same data element, category combo, org unit and period, '
+            'remove them (e.g. with manage.py delete_duplicate_datavalues --delete) and migrate again:\n%s' % (
+                '\n'.join('data element %s, category combo %s, org unit %s, period %s/%s/%s: %d values' % row for row in duplicates),
+            )
+        )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0010_auto_20180114_0801'),
+        ('cannula', '0011_auto_20180202_1331'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_no_duplicates, migrations.RunPython.noop),
+        migrations.RunSQL(CREATE_INDEX_SQL, DROP_INDEX_SQL),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0012_datavalue_period_unique_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', primary_key=True, auto_created=True)),
+                ('job_type', models.CharField(choices=[('VALUES', 'Load data values'), ('VALIDATIONS', 'Load validation rules')], max_length=16, default='VALUES')),
+                ('load_method', models.CharField(choices=[('ORM', 'Django bulk_create()'), ('COPY', 'PostgreSQL COPY (via staging table)'), ('UPSERT', 'Insert or update existing values (re-load corrections)')], max_length=8, default='ORM')),
+                ('state', models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], max_length=8, default='QUEUED', db_index=True)),
+                ('rows_processed', models.IntegerField(default=0)),
+                ('num_inserted', models.IntegerField(default=0)),
+                ('num_updated', models.IntegerField(default=0)),
+                ('num_unchanged', models.IntegerField(default=0)),
+                ('rows_per_second', models.FloatField(null=True, blank=True)),
+                ('error', models.TextField(null=True, blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True, blank=True)),
+                ('finished_at', models.DateTimeField(null=True, blank=True)),
+                ('source_doc', models.ForeignKey(related_name='ingestion_jobs', to='cannula.SourceDocument')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
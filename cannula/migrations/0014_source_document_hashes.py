@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0013_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourcedocument',
+            name='content_hash',
+            field=models.CharField(max_length=64, blank=True, null=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='SourceWorksheet',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', primary_key=True, auto_created=True)),
+                ('name', models.CharField(max_length=128)),
+                ('content_hash', models.CharField(max_length=64, db_index=True)),
+                ('values_loaded_at', models.DateTimeField(blank=True, null=True)),
+                ('source_doc', models.ForeignKey(related_name='worksheets', to='cannula.SourceDocument')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='sourceworksheet',
+            unique_together=set([('source_doc', 'name')]),
+        ),
+    ]
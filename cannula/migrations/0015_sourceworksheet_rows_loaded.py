@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0014_source_document_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourceworksheet',
+            name='rows_loaded',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+def create_periods(apps, schema_editor):
+    from cannula.models import iso_period_ordinal, iso_period_parent
+
+    Period = apps.get_model('cannula', 'Period')
+    DataValue = apps.get_model('cannula', 'DataValue')
+
+    def period_for(iso_period):
+        parent_iso = iso_period_parent(iso_period)
+        parent = period_for(parent_iso) if parent_iso else None
+        period_type, ordinal, months = iso_period_ordinal(iso_period)
+        period, created = Period.objects.get_or_create(iso=iso_period, defaults={'period_type': period_type, 'ordinal': ordinal, 'parent': parent})
+        return period
+
+    period_triples = DataValue.objects.order_by().values_list('year', 'quarter', 'month').distinct()
+    for iso_year, iso_quarter, iso_month in period_triples:
+        iso_period = iso_month or iso_quarter or iso_year
+        if iso_period:
+            DataValue.objects.filter(year=iso_year, quarter=iso_quarter, month=iso_month).update(period=period_for(iso_period))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0016_ingestionjob_stage_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Period',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', primary_key=True, auto_created=True)),
+                ('iso', models.CharField(max_length=7, unique=True)),
+                ('period_type', models.CharField(choices=[('MONTH', 'Month'), ('QUARTER', 'Quarter'), ('YEAR', 'Year')], max_length=8)),
+                ('ordinal', models.IntegerField()),
+                ('parent', models.ForeignKey(blank=True, null=True, related_name='children', to='cannula.Period')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='period',
+            index_together=set([('ordinal', 'period_type')]),
+        ),
+        migrations.AddField(
+            model_name='datavalue',
+            name='period',
+            field=models.ForeignKey(blank=True, null=True, related_name='data_values', to='cannula.Period'),
+        ),
+        migrations.RunPython(create_periods, migrations.RunPython.noop),
+    ]
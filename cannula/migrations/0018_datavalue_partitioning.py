@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+# partitioning is optional: with settings.DATAVALUE_PARTITIONED off this does
+# nothing, and the table can be converted later (manage.py datavalue_partitions convert)
+# the SQL is cannula.partitions.convert_to_partitioned() as of this migration, with
+# the table's foreign keys at this point
+DATAVALUE_TABLE = 'cannula_datavalue'
+OLD_TABLE = 'cannula_datavalue_unpartitioned'
+DATAVALUE_FOREIGN_KEYS = (
+    ('data_element_id', 'cannula_dataelement'),
+    ('category_combo_id', 'cannula_categorycombo'),
+    ('org_unit_id', 'cannula_orgunit'),
+    ('period_id', 'cannula_period'),
+    ('source_doc_id', 'cannula_sourcedocument'),
+)
+
+def partition_datavalues(apps, schema_editor):
+    if not getattr(settings, 'DATAVALUE_PARTITIONED', False):
+        return
+    cursor = schema_editor.connection.cursor()
+    cursor.execute('SELECT COUNT(*) FROM pg_partitioned_table WHERE partrelid = %s::regclass', [DATAVALUE_TABLE])
+    if cursor.fetchone()[0] > 0:
+        return # already partitioned
+    # the unique index below goes over period_id, which would not cover values without a period
+    cursor.execute('SELECT COUNT(*) FROM %s WHERE period_id IS NULL' % (DATAVALUE_TABLE,))
+    num_undated = cursor.fetchone()[0]
+    if num_undated:
+        raise RuntimeError('%d data values have no period, delete them (or give them one) and migrate again' % (num_undated,))
+
+    cursor.execute('ALTER TABLE %s RENAME TO %s' % (DATAVALUE_TABLE, OLD_TABLE))
+    cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY LIST (year)' % (DATAVALUE_TABLE, OLD_TABLE))
+    cursor.execute('ALTER TABLE %s ALTER COLUMN period_id SET NOT NULL' % (DATAVALUE_TABLE,))
+    cursor.execute('ALTER SEQUENCE %s_id_seq OWNED BY %s.id' % (DATAVALUE_TABLE, DATAVALUE_TABLE))
+
+    cursor.execute('CREATE TABLE %s_ydefault PARTITION OF %s DEFAULT' % (DATAVALUE_TABLE, DATAVALUE_TABLE))
+    cursor.execute('SELECT DISTINCT year FROM %s WHERE year IS NOT NULL' % (OLD_TABLE,))
+    for (year,) in cursor.fetchall():
+        cursor.execute("CREATE TABLE %s_y%d PARTITION OF %s FOR VALUES IN ('%d')" % (DATAVALUE_TABLE, int(year), DATAVALUE_TABLE, int(year)))
+    cursor.execute('INSERT INTO %s SELECT * FROM %s' % (DATAVALUE_TABLE, OLD_TABLE))
+    cursor.execute('DROP TABLE %s' % (OLD_TABLE,))
+
+    for column in ['id'] + [column for column, to_table in DATAVALUE_FOREIGN_KEYS]:
+        cursor.execute('CREATE INDEX %s_%s ON %s (%s)' % (DATAVALUE_TABLE, column, DATAVALUE_TABLE, column))
+    cursor.execute('CREATE UNIQUE INDEX %s_period_part_uniq ON %s (data_element_id, category_combo_id, org_unit_id, period_id, year)' % (DATAVALUE_TABLE, DATAVALUE_TABLE))
+    for column, to_table in DATAVALUE_FOREIGN_KEYS:
+        cursor.execute('ALTER TABLE %s ADD FOREIGN KEY (%s) REFERENCES %s (id) DEFERRABLE INITIALLY DEFERRED' % (DATAVALUE_TABLE, column, to_table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0017_period'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_datavalues, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+LEVEL_NAME_FIELDS = ('country_name', 'district_name', 'subcounty_name', 'facility_name')
+
+FILL_LEVEL_NAME_SQL = '''
+UPDATE cannula_orgunit AS ou SET {field} = (
+    SELECT anc.name FROM cannula_orgunit AS anc
+    WHERE anc.tree_id = ou.tree_id AND anc.level = {level} AND anc.lft <= ou.lft AND anc.rght >= ou.rght
+)
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0018_datavalue_partitioning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orgunit',
+            name=field_name,
+            field=models.CharField(max_length=64, blank=True, null=True, editable=False),
+        ) for field_name in LEVEL_NAME_FIELDS
+    ] + [
+        migrations.RunSQL(FILL_LEVEL_NAME_SQL.format(field=field_name, level=level), migrations.RunSQL.noop) for level, field_name in enumerate(LEVEL_NAME_FIELDS)
+    ]
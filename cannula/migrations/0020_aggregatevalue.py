@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# same as models.AGGREGATE_VALUES_SQL, over all the values
+FILL_AGGREGATES_SQL = '''
+INSERT INTO cannula_aggregatevalue (data_element_id, category_combo_id, org_unit_id, period_id, numeric_sum, values_count)
+SELECT dv.data_element_id, dv.category_combo_id, anc.id, p.id, SUM(dv.numeric_value), COUNT(dv.numeric_value)
+FROM cannula_datavalue dv
+JOIN cannula_period p ON p.iso = dv.quarter OR p.iso = dv.year
+JOIN cannula_orgunit ou ON ou.id = dv.org_unit_id
+JOIN cannula_orgunit anc ON anc.tree_id = ou.tree_id AND anc.lft <= ou.lft AND anc.rght >= ou.rght
+GROUP BY dv.data_element_id, dv.category_combo_id, anc.id, p.id
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0019_orgunit_level_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregateValue',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', primary_key=True, auto_created=True)),
+                ('numeric_sum', models.DecimalField(max_digits=21, decimal_places=4)),
+                ('values_count', models.IntegerField()),
+                ('category_combo', models.ForeignKey(related_name='aggregate_values', to='cannula.CategoryCombo')),
+                ('data_element', models.ForeignKey(related_name='aggregate_values', to='cannula.DataElement')),
+                ('org_unit', models.ForeignKey(related_name='aggregate_values', to='cannula.OrgUnit')),
+                ('period', models.ForeignKey(related_name='aggregate_values', to='cannula.Period')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='aggregatevalue',
+            unique_together=set([('data_element', 'category_combo', 'org_unit', 'period')]),
+        ),
+        migrations.RunSQL(FILL_AGGREGATES_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+def fill_lookup_keys(apps, schema_editor):
+    from cannula.models import data_element_key
+
+    DataElement = apps.get_model('cannula', 'DataElement')
+    for de in DataElement.objects.all():
+        de.name_key = data_element_key(de.name)
+        de.alias_key = data_element_key(de.alias) if de.alias else None
+        de.save(update_fields=['name_key', 'alias_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0020_aggregatevalue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataelement',
+            name='name_key',
+            field=models.CharField(max_length=128, db_index=True, editable=False, default=''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='dataelement',
+            name='alias_key',
+            field=models.CharField(max_length=128, blank=True, null=True, db_index=True, editable=False),
+        ),
+        migrations.RunPython(fill_lookup_keys, migrations.RunPython.noop),
+    ]
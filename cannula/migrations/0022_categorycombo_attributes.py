@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+def fill_attributes(apps, schema_editor):
+    from cannula.models import category_attributes
+
+    CategoryCombo = apps.get_model('cannula', 'CategoryCombo')
+    for cat_combo in CategoryCombo.objects.prefetch_related('categories'):
+        attributes = category_attributes([c.name for c in cat_combo.categories.all()])
+        if any(attributes.values()):
+            CategoryCombo.objects.filter(id=cat_combo.id).update(**attributes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0021_dataelement_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categorycombo',
+            name='sex',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Male'), (2, 'Female')], blank=True, null=True, db_index=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='categorycombo',
+            name='age_band',
+            field=models.PositiveSmallIntegerField(choices=[(1, '<15'), (2, '15+')], blank=True, null=True, db_index=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='categorycombo',
+            name='cohort_outcome',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Alive on ART'), (2, 'Died'), (3, 'Lost to follow-up'), (4, 'Started on ART'), (5, 'Stopped'), (6, 'Transferred in'), (7, 'Transferred out')], blank=True, null=True, db_index=True, editable=False),
+        ),
+        migrations.RunPython(fill_attributes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+def materialise_results(apps, schema_editor):
+    ValidationRule = apps.get_model('cannula', 'ValidationRule')
+    cursor = schema_editor.connection.cursor()
+    for rule_id in ValidationRule.objects.values_list('id', flat=True):
+        cursor.execute('SELECT to_regclass(%s)', ['vw_validation_%d' % (rule_id,)])
+        if cursor.fetchone()[0] is not None:
+            cursor.execute('CREATE MATERIALIZED VIEW mvw_validation_%d AS SELECT * FROM vw_validation_%d' % (rule_id, rule_id))
+
+def drop_results(apps, schema_editor):
+    ValidationRule = apps.get_model('cannula', 'ValidationRule')
+    cursor = schema_editor.connection.cursor()
+    for rule_id in ValidationRule.objects.values_list('id', flat=True):
+        cursor.execute('DROP MATERIALIZED VIEW IF EXISTS mvw_validation_%d' % (rule_id,))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0022_categorycombo_attributes'),
+    ]
+
+    operations = [
+        migrations.RunPython(materialise_results, drop_results),
+    ]
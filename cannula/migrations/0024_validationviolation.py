@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0023_validation_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValidationViolation',
+            fields=[
+                ('id', models.AutoField(serialize=False, verbose_name='ID', primary_key=True, auto_created=True)),
+                ('left_value', models.DecimalField(max_digits=21, decimal_places=4, blank=True, null=True)),
+                ('right_value', models.DecimalField(max_digits=21, decimal_places=4, blank=True, null=True)),
+                ('checked_at', models.DateTimeField()),
+                ('org_unit', models.ForeignKey(related_name='validation_violations', to='cannula.OrgUnit')),
+                ('period', models.ForeignKey(related_name='validation_violations', to='cannula.Period')),
+                ('rule', models.ForeignKey(related_name='violations', to='cannula.ValidationRule')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='validationviolation',
+            unique_together=set([('rule', 'org_unit', 'period')]),
+        ),
+    ]
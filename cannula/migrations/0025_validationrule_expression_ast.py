@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0024_validationviolation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='validationrule',
+            name='expression_ast',
+            field=models.TextField(blank=True, editable=False, default=''),
+            preserve_default=False,
+        ),
+    ]
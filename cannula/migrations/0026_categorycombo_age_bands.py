@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+def refill_attributes(apps, schema_editor):
+    from cannula.models import category_attributes
+
+    # 0022 gave an age band to more age categories than the dashboards split by
+    CategoryCombo = apps.get_model('cannula', 'CategoryCombo')
+    for cat_combo in CategoryCombo.objects.prefetch_related('categories'):
+        attributes = category_attributes([c.name for c in cat_combo.categories.all()])
+        if (cat_combo.sex, cat_combo.age_band, cat_combo.cohort_outcome) != (attributes['sex'], attributes['age_band'], attributes['cohort_outcome']):
+            CategoryCombo.objects.filter(id=cat_combo.id).update(**attributes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0025_validationrule_expression_ast'),
+    ]
+
+    operations = [
+        migrations.RunPython(refill_attributes, migrations.RunPython.noop),
+    ]
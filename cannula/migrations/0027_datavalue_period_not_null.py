@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+def iso_period_fields(iso_period):
+    """(period type, ordinal, parent ISO period) of an ISO 8601 period, as cannula.models had them at this migration"""
+    year = int(iso_period[:4])
+    if len(iso_period) == 4:
+        return 'YEAR', year*12, None
+    if iso_period[5] in 'Qq':
+        return 'QUARTER', year*12 + (int(iso_period[6])-1)*3, iso_period[:4]
+    month = int(iso_period[5:7])
+    return 'MONTH', year*12 + month-1, '%s-Q%d' % (iso_period[:4], (month-1)//3 + 1)
+
+def fill_periods(apps, schema_editor):
+    # values saved one at a time since 0017 may have been left without a period
+    Period = apps.get_model('cannula', 'Period')
+    DataValue = apps.get_model('cannula', 'DataValue')
+
+    def period_for(iso_period):
+        period_type, ordinal, parent_iso = iso_period_fields(iso_period)
+        parent = period_for(parent_iso) if parent_iso else None
+        period, created = Period.objects.get_or_create(iso=iso_period, defaults={'period_type': period_type, 'ordinal': ordinal, 'parent': parent})
+        return period
+
+    period_triples = DataValue.objects.filter(period=None).order_by().values_list('year', 'quarter', 'month').distinct()
+    for iso_year, iso_quarter, iso_month in period_triples:
+        iso_period = iso_month or iso_quarter or iso_year
+        if iso_period:
+            DataValue.objects.filter(period=None, year=iso_year, quarter=iso_quarter, month=iso_month).update(period=period_for(iso_period))
+    num_undated = DataValue.objects.filter(period=None).count()
+    if num_undated:
+        raise RuntimeError('%d data values have no month, quarter or year, delete them (or give them one) and migrate again' % (num_undated,))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cannula', '0026_categorycombo_age_bands'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_periods, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='datavalue',
+            name='period',
+            field=models.ForeignKey(related_name='data_values', to='cannula.Period'),
+        ),
+    ]
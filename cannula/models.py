@@ -1,6 +1,6 @@
 from django.db import models
 from django.db.models import Avg, Case, Count, F, Max, Min, Prefetch, Q, Sum, When
-from django.db.models.signals import post_init
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete
 from django.core.files.storage import FileSystemStorage
 from django.core.exceptions import ValidationError
 from django.conf import settings
@@ -8,13 +8,18 @@ from django.conf import settings
 import logging
 logger = logging.getLogger(__name__)
 
+import json
 import mimetypes
-from functools import lru_cache, partial
+import zipfile
+from functools import lru_cache
 from decimal import Decimal
 
 from mptt.models import MPTTModel, TreeForeignKey
+from mptt.signals import node_moved
 
-from . import grabbag
+from . import grabbag, ruleexpr
+from .contenthash import file_content_hash, worksheet_content_hashes
+from .instrument import StageTimer
 
 def make_random_filename(instance, filename):
     mt = mimetypes.guess_type(filename)
@@ -28,18 +33,106 @@ class SourceDocument(models.Model):
     orig_filename = models.CharField(max_length=128, blank=True, null=True)
     file = models.FileField(upload_to=make_random_filename, storage=fs)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True) # hex sha256 of the file
 
     def save(self, *args, **kwargs):
-        # store the original filename away for later
-        self.orig_filename = self.file.name
+        is_new = self.pk is None
+        if is_new:
+            # store the original filename away for later (after saving, file.name is the random one)
+            self.orig_filename = self.file.name
+            self.content_hash = file_content_hash(self.file.chunks())
         super(SourceDocument, self).save(*args, **kwargs)
+        if is_new:
+            self.record_worksheet_hashes()
+
+    def record_worksheet_hashes(self):
+        """(Re)compute the content hash of each worksheet in this document"""
+        self.worksheets.all().delete()
+        try:
+            sheet_hashes = worksheet_content_hashes(self.file.path)
+        except (zipfile.BadZipFile, KeyError):
+            return # not an .xlsx workbook
+        SourceWorksheet.objects.bulk_create(
+            SourceWorksheet(source_doc=self, name=ws_name, content_hash=ws_hash) for ws_name, ws_hash in sheet_hashes.items()
+        )
+
+    def loaded_duplicate(self):
+        """An earlier document with identical contents whose values are already loaded, or None"""
+        if not self.content_hash:
+            return None
+        duplicates = SourceDocument.objects.filter(content_hash=self.content_hash).exclude(id=self.id)
+        duplicates = duplicates.filter(worksheets__values_loaded_at__isnull=False).exclude(worksheets__values_loaded_at__isnull=True)
+        return duplicates.order_by('uploaded_at').first()
+
+    def loaded_worksheet_names(self):
+        """Names of this document's worksheets whose contents (here or in another document) are already loaded"""
+        if not self.content_hash:
+            # uploaded before hashes were recorded
+            self.content_hash = file_content_hash(self.file.chunks())
+            super(SourceDocument, self).save(update_fields=['content_hash'])
+            self.record_worksheet_hashes()
+        loaded_hashes = SourceWorksheet.objects.filter(values_loaded_at__isnull=False).values('content_hash')
+        return frozenset(self.worksheets.filter(content_hash__in=loaded_hashes).values_list('name', flat=True))
+
+    def mark_values_loaded(self):
+        from django.utils import timezone
+        self.worksheets.filter(values_loaded_at__isnull=True).update(values_loaded_at=timezone.now())
+
+    def worksheet_checkpoints(self):
+        """Dict of worksheet name to the number of its data rows already loaded, for unfinished worksheets"""
+        return dict(self.worksheets.filter(values_loaded_at__isnull=True, rows_loaded__gt=0).values_list('name', 'rows_loaded'))
+
+    def record_checkpoint(self, checkpoint):
+        """
+        Record how far loading has got, given a dict of worksheet name to a
+        (rows loaded, finished) pair. Call it in the transaction that writes
+        the values, so the checkpoint never gets ahead of them
+        """
+        from django.utils import timezone
+        for ws_name, (rows_loaded, finished) in checkpoint.items():
+            self.worksheets.filter(name=ws_name).update(rows_loaded=rows_loaded, values_loaded_at=timezone.now() if finished else None)
 
     def __str__(self):
         return '%s: %s' % (self.file, self.orig_filename)
 
+class SourceWorksheet(models.Model):
+    source_doc = models.ForeignKey(SourceDocument, related_name='worksheets')
+    name = models.CharField(max_length=128)
+    content_hash = models.CharField(max_length=64, db_index=True) # see contenthash.worksheet_content_hashes()
+    values_loaded_at = models.DateTimeField(blank=True, null=True)
+    rows_loaded = models.IntegerField(default=0) # checkpoint: data rows whose values are committed, while the load is unfinished
+
+    class Meta:
+        unique_together = (('source_doc', 'name'),)
+
+    def __str__(self):
+        return '%s: %s' % (self.source_doc, self.name)
+
+OU_LEVEL_NAMES = ('country', 'district', 'subcounty', 'facility') # by OrgUnit level
+OU_LEVEL_NAME_FIELDS = tuple('%s_name' % (level_name,) for level_name in OU_LEVEL_NAMES)
+
+# pg_advisory_xact_lock() key serialising the creation of OrgUnits and data elements by concurrent loads
+DIMENSIONS_LOCK_ID = 7305001
+
+def lock_dimensions():
+    """
+    Wait for the dimensions lock, held until the end of the current transaction:
+    OrgUnit.from_paths() and resolve_headers() take it before creating rows, so
+    concurrent loads take turns rather than creating the same rows twice
+    """
+    from django.db import connection
+
+    connection.cursor().execute('SELECT pg_advisory_xact_lock(%s)', [DIMENSIONS_LOCK_ID])
+
 class OrgUnit(MPTTModel):
     name = models.CharField(max_length=64)
     parent = TreeForeignKey('self', null=True, blank=True, related_name='children', db_index=True)
+    # names of the ancestor (or this unit itself) at each level, NULL below this unit's level
+    # they spare queries the parent__parent__name self joins, kept up to date on tree changes
+    country_name = models.CharField(max_length=64, blank=True, null=True, editable=False)
+    district_name = models.CharField(max_length=64, blank=True, null=True, editable=False)
+    subcounty_name = models.CharField(max_length=64, blank=True, null=True, editable=False)
+    facility_name = models.CharField(max_length=64, blank=True, null=True, editable=False)
 
     class MPTTMeta:
         order_insertion_by = ['name']
@@ -65,21 +158,238 @@ class OrgUnit(MPTTModel):
         return current_node
 
     @classmethod
-    @lru_cache(maxsize=None)
     def from_path_recurse(cls, *path_parts):
+        ou_id = cls.id_from_path_recurse(*path_parts)
+        return None if ou_id is None else cls.objects.get(id=ou_id)
+
+    @classmethod
+    def id_from_path_recurse(cls, *path_parts):
+        """The id of the OrgUnit at a path, creating missing nodes. Paths in ORG_UNIT_PATHS take no query"""
         if len(path_parts) == 0:
             return None
+        ou_id = ORG_UNIT_PATHS.get(path_parts)
+        if ou_id is not None:
+            return ou_id
         *parent_path, node_name = path_parts
         if len(parent_path) == 0:
             ou, created = cls.objects.get_or_create(name=node_name, parent=None)
         else:
-            ou_parent = cls.from_path_recurse(*parent_path)
-            ou, created = cls.objects.get_or_create(name=node_name, parent=ou_parent)
-        return ou
+            parent_id = cls.id_from_path_recurse(*parent_path)
+            ou, created = cls.objects.get_or_create(name=node_name, parent_id=parent_id)
+        ORG_UNIT_PATHS.put(path_parts, ou.id)
+        return ou.id
+
+    @classmethod
+    def from_paths(cls, paths):
+        """
+        Bulk form of from_path_recurse(): return a dict mapping each path (a
+        tuple of names, from the root down) to an OrgUnit id, answered from
+        ORG_UNIT_PATHS when possible. Missing nodes are created with one insert per tree level and
+        the MPTT fields are rebuilt once at the end, instead of shifting lft/rght
+        across the tree for every inserted node
+        """
+        from django.db import transaction
+
+        paths = set(paths)
+        cached_ids = dict((p, ORG_UNIT_PATHS.get(p)) for p in paths)
+        if all(ou_id is not None for ou_id in cached_ids.values()):
+            return cached_ids
+
+        all_paths = set()
+        for path in paths:
+            all_paths.update(tuple(path[:depth]) for depth in range(1, len(path)+1))
+        max_depth = max(map(len, all_paths)) if all_paths else 0
+
+        path_ids = dict()
+        nodes_created = False
+        with transaction.atomic():
+            lock_dimensions() # another load may be creating the same nodes, look for them once it is done
+            for depth in range(1, max_depth+1):
+                level_paths = [p for p in all_paths if len(p) == depth]
+                parent_ids = set(path_ids[p[:-1]] for p in level_paths) if depth > 1 else set([None])
+                names = set(p[-1] for p in level_paths)
+
+                def existing_nodes():
+                    qs = models.QuerySet(cls).filter(name__in=names)
+                    if depth == 1:
+                        qs = qs.filter(parent=None)
+                    else:
+                        qs = qs.filter(parent_id__in=parent_ids)
+                    return dict(((parent_id, name), ou_id) for ou_id, parent_id, name in qs.values_list('id', 'parent_id', 'name'))
+
+                node_ids = existing_nodes()
+                node_keys = dict((p, (path_ids.get(p[:-1]), p[-1])) for p in level_paths)
+                missing_keys = set(k for k in node_keys.values() if k not in node_ids)
+                if missing_keys:
+                    # placeholder tree fields, filled in by bulk_rebuild() below
+                    new_nodes = (cls(name=name, parent_id=parent_id, lft=0, rght=0, tree_id=0, level=depth-1) for parent_id, name in missing_keys)
+                    models.QuerySet(cls).bulk_create(new_nodes)
+                    node_ids = existing_nodes()
+                    nodes_created = True
+
+                for p, k in node_keys.items():
+                    path_ids[p] = node_ids[k]
+
+            if nodes_created:
+                cls.bulk_rebuild()
+
+        ORG_UNIT_PATHS.update(path_ids.items())
+        return path_ids
+
+    @classmethod
+    def bulk_rebuild(cls):
+        """
+        Recompute the MPTT fields of every tree in memory and write back the
+        changed rows in chunks, rather than with the per node queries made by
+        OrgUnit.objects.rebuild()
+        """
+        from collections import defaultdict
+        from django.db import connection
+
+        num_levels = len(OU_LEVEL_NAME_FIELDS)
+        # siblings (and roots) are kept in the same order as order_insertion_by
+        children = defaultdict(list)
+        names = dict()
+        current_fields = dict()
+        for ou_id, parent_id, name, lft, rght, tree_id, level, *level_names in models.QuerySet(cls).order_by('name', 'id').values_list('id', 'parent_id', 'name', 'lft', 'rght', 'tree_id', 'level', *OU_LEVEL_NAME_FIELDS):
+            children[parent_id].append(ou_id)
+            names[ou_id] = name
+            current_fields[ou_id] = (lft, rght, tree_id, level) + tuple(level_names)
+
+        new_fields = dict()
+        for tree_id, root_id in enumerate(children[None], start=1):
+            # iterative depth-first walk, numbering lft on the way down and rght on the way up
+            lfts = {root_id: 1}
+            counter = 2
+            stack = [(root_id, 0, iter(children[root_id]))]
+            while stack:
+                ou_id, level, child_iter = stack[-1]
+                child_id = next(child_iter, None)
+                if child_id is None:
+                    # the stack holds this unit's ancestors, and the unit itself
+                    level_names = tuple(names[s_id] for s_id, _, _ in stack[:num_levels])
+                    level_names += (None,) * (num_levels - len(level_names))
+                    stack.pop()
+                    new_fields[ou_id] = (lfts.pop(ou_id), counter, tree_id, level) + level_names
+                else:
+                    lfts[child_id] = counter
+                    stack.append((child_id, level+1, iter(children[child_id])))
+                counter += 1
+
+        changed_rows = [(ou_id,)+fields for ou_id, fields in new_fields.items() if current_fields[ou_id] != fields]
+        cursor = connection.cursor()
+        CHUNK_SIZE = 1000
+        columns = ('lft', 'rght', 'tree_id', 'level') + OU_LEVEL_NAME_FIELDS
+        for i in range(0, len(changed_rows), CHUNK_SIZE):
+            chunk = changed_rows[i:i+CHUNK_SIZE]
+            # the casts type the name columns even when a whole chunk has NULL for one
+            update_sql = 'UPDATE %s AS ou SET %s FROM (VALUES %s) AS v(id, %s) WHERE ou.id = v.id' % (
+                cls._meta.db_table,
+                ', '.join('%s = v.%s' % (col, col) for col in columns),
+                ', '.join(['(%s, %s, %s, %s, %s' + ', %s::varchar' * num_levels + ')'] * len(chunk)),
+                ', '.join(columns),
+            )
+            cursor.execute(update_sql, [f for row in chunk for f in row])
+
+    def update_level_names(self):
+        """
+        Bring the per-level ancestor names of this unit and its descendants up
+        to date, after it has been renamed or moved
+        """
+        from django.db import connection
+
+        cursor = connection.cursor()
+        for level, field_name in enumerate(OU_LEVEL_NAME_FIELDS):
+            # the ancestor (or self) at this level is the node of that level whose lft/rght enclose ours
+            update_sql = '''
+                UPDATE {table} AS ou SET {field} = (
+                    SELECT anc.name FROM {table} AS anc
+                    WHERE anc.tree_id = ou.tree_id AND anc.level = %s AND anc.lft <= ou.lft AND anc.rght >= ou.rght
+                )
+                WHERE ou.tree_id = %s AND ou.lft >= %s AND ou.rght <= %s
+            '''.format(table=self._meta.db_table, field=field_name)
+            cursor.execute(update_sql, [level, self.tree_id, self.lft, self.rght])
 
     def __str__(self):
         return '%s [parent_id: %s]' % (self.name, str(self.parent_id),)
 
+class LruIdCache():
+    """
+    Bounded (least recently used), thread-safe cache of lookup key => ids.
+    clear() takes (and ignores) signal arguments, so it can be connected to
+    the post_save/post_delete signals of the models the ids belong to
+    """
+    def __init__(self, maxsize):
+        import threading
+        from collections import OrderedDict
+
+        self.maxsize = maxsize
+        self.key_ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.key_ids)
+
+    def get(self, key):
+        with self.lock:
+            ids = self.key_ids.get(key)
+            if ids is not None:
+                self.key_ids.move_to_end(key)
+            return ids
+
+    def put(self, key, ids):
+        self.update(((key, ids),))
+
+    def update(self, key_ids):
+        with self.lock:
+            for key, ids in key_ids:
+                self.key_ids[key] = ids
+                self.key_ids.move_to_end(key)
+            while len(self.key_ids) > self.maxsize:
+                self.key_ids.popitem(last=False)
+
+    def clear(self, *args, **kwargs):
+        with self.lock:
+            self.key_ids.clear()
+
+class OrgUnitPathCache(LruIdCache):
+    """
+    Cache of OrgUnit path tuple => OrgUnit id. It holds ids rather than model
+    instances, so entries can't go stale when the tree fields change, and it
+    is cleared whenever an OrgUnit is saved or deleted (or an ingestion fails,
+    in case new nodes were rolled back). The signals only reach the process
+    making the change, so ingestion jobs also start from a cleared cache (see
+    ingest.run_ingestion_job())
+    """
+    def __init__(self, maxsize=50000):
+        super(OrgUnitPathCache, self).__init__(maxsize)
+
+    def warm(self):
+        """Load the path of every OrgUnit in the tree, with a single query"""
+        node_paths = dict()
+        # ordering by level means a node's parent always has its path worked out already
+        for ou_id, parent_id, name in OrgUnit.objects.order_by('level', 'id').values_list('id', 'parent_id', 'name'):
+            if parent_id is None:
+                node_paths[ou_id] = (name,)
+            else:
+                node_paths[ou_id] = node_paths[parent_id] + (name,)
+        self.update((path, ou_id) for ou_id, path in node_paths.items())
+
+ORG_UNIT_PATHS = OrgUnitPathCache(maxsize=getattr(settings, 'ORG_UNIT_PATH_CACHE_SIZE', 50000))
+post_save.connect(ORG_UNIT_PATHS.clear, sender=OrgUnit)
+post_delete.connect(ORG_UNIT_PATHS.clear, sender=OrgUnit)
+
+def update_org_unit_level_names(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.update_level_names()
+
+post_save.connect(update_org_unit_level_names, sender=OrgUnit)
+node_moved.connect(update_org_unit_level_names, sender=OrgUnit)
+
+def data_element_key(name):
+    """Lookup key of a data element name or alias: names and aliases match ignoring case"""
+    return name.upper()
+
 class DataElement(models.Model):
     VALUE_TYPES = (
         ('NUMBER', 'Number'),
@@ -103,20 +413,25 @@ class DataElement(models.Model):
     value_min = models.DecimalField(max_digits=17, decimal_places=4, verbose_name='Minimum Value', blank=True, null=True)
     value_max = models.DecimalField(max_digits=17, decimal_places=4, verbose_name='Maximum Value', blank=True, null=True)
     aggregation_method = models.CharField(max_length=8, choices=AGG_METHODS)
+    name_key = models.CharField(max_length=128, db_index=True, editable=False) # see data_element_key()
+    alias_key = models.CharField(max_length=128, blank=True, null=True, db_index=True, editable=False)
 
     def validate_unique(self, exclude=None):
         super(DataElement, self).validate_unique(exclude=exclude)
 
         # name already exists as an alias
-        if DataElement.objects.filter(Q(alias__iexact=self.name), ~Q(id=self.id)).exists():
+        if DataElement.objects.filter(Q(alias_key=data_element_key(self.name)), ~Q(id=self.id)).exists():
             raise ValidationError({'name': 'Name already used as an alias: \'%s\'' % (self.name,)})
         if self.alias:
             # alias already exists as a name/alias
-            if DataElement.objects.filter(Q(name__iexact=self.alias)|Q(alias__iexact=self.alias), ~Q(id=self.id)).exists():
+            alias_key = data_element_key(self.alias)
+            if DataElement.objects.filter(Q(name_key=alias_key)|Q(alias_key=alias_key), ~Q(id=self.id)).exists():
                 raise ValidationError({'alias': 'Alias already used as a name/alias: \'%s\'' % (self.alias,)})
 
     def save(self, *args, **kwargs):
         self.validate_unique()
+        self.name_key = data_element_key(self.name)
+        self.alias_key = data_element_key(self.alias) if self.alias else None
         super(DataElement, self).save(*args, **kwargs)
 
     def __repr__(self):
@@ -135,15 +450,34 @@ class Category(models.Model):
         return self.name
 
 class CategoryCombo(models.Model):
+    # attributes of the categories in a combo, see category_attributes()
+    MALE, FEMALE = 1, 2
+    SEXES = ((MALE, 'Male'), (FEMALE, 'Female'))
+    UNDER_15, FROM_15 = 1, 2
+    AGE_BANDS = ((UNDER_15, '<15'), (FROM_15, '15+'))
+    ALIVE, DIED, LOST, STARTED, STOPPED, TRANSFERRED_IN, TRANSFERRED_OUT = range(1, 8)
+    COHORT_OUTCOMES = (
+        (ALIVE, 'Alive on ART'),
+        (DIED, 'Died'),
+        (LOST, 'Lost to follow-up'),
+        (STARTED, 'Started on ART'),
+        (STOPPED, 'Stopped'),
+        (TRANSFERRED_IN, 'Transferred in'),
+        (TRANSFERRED_OUT, 'Transferred out'),
+    )
+
     name = models.CharField(max_length=512)
     categories = models.ManyToManyField(Category)
+    sex = models.PositiveSmallIntegerField(choices=SEXES, blank=True, null=True, db_index=True, editable=False)
+    age_band = models.PositiveSmallIntegerField(choices=AGE_BANDS, blank=True, null=True, db_index=True, editable=False)
+    cohort_outcome = models.PositiveSmallIntegerField(choices=COHORT_OUTCOMES, blank=True, null=True, db_index=True, editable=False)
 
     @classmethod
     def from_cat_names(cls, cat_names):
         sorted_names = sorted(cat_names) #TODO: sort based on the name of the classification the Category belongs to
         cat_list = [Category.objects.get_or_create(name=cat_name)[0] for cat_name in sorted_names]
         cc_name = '(%s)' % ', '.join(sorted_names)
-        cat_combo, created = cls.objects.get_or_create(name=cc_name)
+        cat_combo, created = cls.objects.get_or_create(name=cc_name, defaults=category_attributes(sorted_names))
         if created:
             for categ in cat_list:
                 cat_combo.categories.add(categ)
@@ -204,62 +538,360 @@ CATEGORIES = [
 
 import re
 SEP_REGEX = '[\s,]+' # one or more of these characters in sequence
+# the regex forms are only kept as the reference for CategoryMatcher (see manage.py benchmark_category_matcher)
 CATEGORY_REGEX = '|'.join('%s?(%s)' % (SEP_REGEX, re.escape(categ)) for categ in CATEGORIES)
 SEXLESS_CATEGORY_REGEX = '|'.join('%s?(%s)' % (SEP_REGEX, re.escape(categ)) for categ in CATEGORIES[2:]) #TODO: even more horrible a hack
 
+from .catmatch import CategoryMatcher
+CATEGORY_MATCHER = CategoryMatcher(CATEGORIES)
+SEXLESS_CATEGORY_MATCHER = CategoryMatcher(CATEGORIES[2:])
+CATEGORY_SET = frozenset(CATEGORIES)
+
+# the CategoryCombo attributes each category implies
+# age bands only for the HTS age categories the dashboards split by, other age categories have none
+CATEGORY_SEXES = {
+    'Male': CategoryCombo.MALE,
+    'Female': CategoryCombo.FEMALE,
+}
+CATEGORY_AGE_BANDS = {
+    '18 Mths-<5 Years': CategoryCombo.UNDER_15,
+    '5-<10 Years': CategoryCombo.UNDER_15,
+    '10-<15 Years': CategoryCombo.UNDER_15,
+    '15-<19 Years': CategoryCombo.FROM_15,
+    '19-<49 Years': CategoryCombo.FROM_15,
+    '>49 Years': CategoryCombo.FROM_15,
+}
+CATEGORY_COHORT_OUTCOMES = {
+    'Alive on ART in Cohort': CategoryCombo.ALIVE,
+    'Died': CategoryCombo.DIED,
+    'Lost  to Followup': CategoryCombo.LOST,
+    'Lost': CategoryCombo.LOST,
+    'Started on ART-Cohort': CategoryCombo.STARTED,
+    'Stopped': CategoryCombo.STOPPED,
+    'Transfered In': CategoryCombo.TRANSFERRED_IN,
+    'Transferred Out': CategoryCombo.TRANSFERRED_OUT,
+}
+
+def category_attributes(cat_names):
+    """
+    The sex, age_band and cohort_outcome field values of a CategoryCombo with
+    the given categories, as a dict (None where no category says)
+
+    >>> category_attributes(['Female', '5-<10 Years']) == {'sex': CategoryCombo.FEMALE, 'age_band': CategoryCombo.UNDER_15, 'cohort_outcome': None}
+    True
+    >>> category_attributes(['Male', '<15'])['age_band'] is None # not one of the age categories the HTS dashboards split by
+    True
+    """
+    def first_match(attr_map):
+        return next((attr_map[c] for c in cat_names if c in attr_map), None)
+    return {
+        'sex': first_match(CATEGORY_SEXES),
+        'age_band': first_match(CATEGORY_AGE_BANDS),
+        'cohort_outcome': first_match(CATEGORY_COHORT_OUTCOMES),
+    }
+
 ICKY_CATEGS = (
     'Number of Male',
     'Male partners',
 )
+ICKY_CATEGS_UPPER = tuple(s.upper() for s in ICKY_CATEGS)
 
-def unpack_data_element(de_long):
-    if any([de_long.upper().find(s.upper()) >=0 for s in ICKY_CATEGS]):
-        m = re.split(SEXLESS_CATEGORY_REGEX, de_long)
+def parse_data_element(de_long):
+    """
+    Split a (long) data element column header into the data element name and
+    the list of category names it is disaggregated by
+    """
+    de_long_upper = de_long.upper()
+    if any(s in de_long_upper for s in ICKY_CATEGS_UPPER):
+        m = SEXLESS_CATEGORY_MATCHER.split(de_long)
     else:
-        m = re.split(CATEGORY_REGEX, de_long)
-    # squash list of matches by removing blank and None entries (and False and numeric zeroes)
-    de_name, *category_list = tuple(filter(None, m))
+        m = CATEGORY_MATCHER.split(de_long)
+    de_name, *category_list = m
     cat_str = ', '.join(category_list)
 
     # deals with cases where the data element name includes a subcategory ('105-2.1a Male partners received HIV test results in eMTCT')
     # and matches multiple subcategories ('Lost' and 'Lost  to Followup' in '106a Cohort  All patients 12 months Lost  to Followup')
     #TODO: reimplement this, it is a really ugly hack
-    if any([cat not in CATEGORIES for cat in category_list]):
+    if any([cat not in CATEGORY_SET for cat in category_list]):
         cat_str = ' '.join(category_list)
-        if cat_str not in CATEGORIES:
+        if cat_str not in CATEGORY_SET:
             de_name = de_long
             cat_str = ''
 
+    return de_name, category_list
+
+def parse_data_elements(headers):
+    """Batch form of parse_data_element(), for a whole header row"""
+    return [parse_data_element(h) for h in headers]
+
+def unpack_data_element(de_long):
+    de_name, category_list = parse_data_element(de_long)
     de_instance, created = DataElement.objects.get_or_create(name=de_name, value_type='NUMBER', value_min=None, value_max=None, aggregation_method='SUM')
     if len(category_list):
         return (de_instance, CategoryCombo.from_cat_names(category_list))
     else:
         return (de_instance, None)
 
+def cat_combo_name(cat_names):
+    return '(%s)' % ', '.join(sorted(cat_names))
+
+# process-wide cache of column header => (data element id, category combo id), see resolve_headers()
+# cleared on changes made by this process only, so long-running workers clear it before each job
+HEADER_CACHE = LruIdCache(maxsize=getattr(settings, 'HEADER_CACHE_SIZE', 20000))
+
+def invalidate_header_cache(*args, **kwargs):
+    HEADER_CACHE.clear()
+
+def resolve_headers(headers):
+    """
+    Resolve a sequence of column headers to (data element id, category combo id)
+    pairs (the category combo id is None when there is no disaggregation),
+    creating any missing data elements, categories and category combos with a
+    handful of set-based queries rather than a get_or_create per header
+    """
+    from django.db import transaction
+
+    headers = tuple(headers)
+    # resolve from this local copy, entries may be evicted or cleared (by another thread's signals) meanwhile
+    header_ids = dict()
+    for h in set(headers):
+        ids = HEADER_CACHE.get(h)
+        if ids is not None:
+            header_ids[h] = ids
+    uncached_headers = set(headers).difference(header_ids)
+    new_headers = dict(zip(uncached_headers, parse_data_elements(uncached_headers)))
+
+    if new_headers:
+        with transaction.atomic():
+            lock_dimensions() # query the lookup tables once no other load is creating rows in them
+            de_names = set(de_name for de_name, cat_names in new_headers.values())
+            de_ids = dict(DataElement.objects.filter(name__in=de_names).values_list('name', 'id'))
+            missing_de_names = de_names.difference(de_ids)
+            if missing_de_names:
+                # same guard as DataElement.validate_unique(), which bulk_create() skips
+                alias = DataElement.objects.filter(alias_key__in=[data_element_key(n) for n in missing_de_names]).values_list('alias', flat=True).first()
+                if alias is not None:
+                    raise ValidationError({'name': 'Name already used as an alias: \'%s\'' % (alias,)})
+                DataElement.objects.bulk_create(DataElement(name=de_name, name_key=data_element_key(de_name), value_type='NUMBER', value_min=None, value_max=None, aggregation_method='SUM') for de_name in missing_de_names)
+                invalidate_rule_expr_cache() # bulk_create() sends no post_save
+                de_ids.update(DataElement.objects.filter(name__in=missing_de_names).values_list('name', 'id'))
+
+            combo_cats = {cat_combo_name(cat_names): cat_names for de_name, cat_names in new_headers.values() if cat_names}
+            cc_ids = dict()
+            if combo_cats:
+                cat_names = set(c for names in combo_cats.values() for c in names)
+                cat_ids = dict(Category.objects.filter(name__in=cat_names).values_list('name', 'id'))
+                missing_cat_names = cat_names.difference(cat_ids)
+                if missing_cat_names:
+                    Category.objects.bulk_create(Category(name=c) for c in missing_cat_names)
+                    cat_ids.update(Category.objects.filter(name__in=missing_cat_names).values_list('name', 'id'))
+
+                for cc_name, cc_id in CategoryCombo.objects.filter(name__in=combo_cats.keys()).values_list('name', 'id'):
+                    cc_ids.setdefault(cc_name, cc_id) # names are not unique, keep the first (as get_or_create would)
+                missing_cc_names = set(combo_cats).difference(cc_ids)
+                if missing_cc_names:
+                    CategoryCombo.objects.bulk_create(CategoryCombo(name=cc_name, **category_attributes(combo_cats[cc_name])) for cc_name in missing_cc_names)
+                    new_cc_ids = dict(CategoryCombo.objects.filter(name__in=missing_cc_names).values_list('name', 'id'))
+                    CatComboCategory = CategoryCombo.categories.through
+                    CatComboCategory.objects.bulk_create(
+                        CatComboCategory(categorycombo_id=new_cc_ids[cc_name], category_id=cat_ids[c])
+                        for cc_name in missing_cc_names for c in set(combo_cats[cc_name])
+                    )
+                    cc_ids.update(new_cc_ids)
+
+            for h, (de_name, cat_names) in new_headers.items():
+                header_ids[h] = (de_ids[de_name], cc_ids[cat_combo_name(cat_names)] if cat_names else None)
+        HEADER_CACHE.update((h, header_ids[h]) for h in new_headers)
+
+    return tuple(header_ids[h] for h in headers)
+
+# any change to the lookup tables may leave cached ids stale
+for sender in (DataElement, Category, CategoryCombo):
+    post_save.connect(invalidate_header_cache, sender=sender)
+    post_delete.connect(invalidate_header_cache, sender=sender)
+
+DATA_ELEMENT_IDS = dict() # lookup key (see data_element_key()) -> ids of the data elements with that name or alias
+
+def invalidate_data_element_ids(*args, **kwargs):
+    DATA_ELEMENT_IDS.clear()
+
+post_save.connect(invalidate_data_element_ids, sender=DataElement)
+post_delete.connect(invalidate_data_element_ids, sender=DataElement)
+
+def resolve_data_element_ids(names):
+    """
+    Ids of the data elements with any of the given names or aliases (ignoring
+    case). Names are looked up once per process, unknown names are looked up
+    again every time (another process may be creating them)
+    """
+    keys = set(data_element_key(name) for name in names)
+    missing_keys = keys.difference(DATA_ELEMENT_IDS)
+    if missing_keys:
+        qs = DataElement.objects.filter(Q(name_key__in=missing_keys)|Q(alias_key__in=missing_keys))
+        for de_id, name_key, alias_key in qs.values_list('id', 'name_key', 'alias_key'):
+            for key in (name_key, alias_key):
+                if key in missing_keys:
+                    DATA_ELEMENT_IDS[key] = DATA_ELEMENT_IDS.get(key, ()) + (de_id,)
+    return [de_id for key in keys for de_id in DATA_ELEMENT_IDS.get(key, ())]
+
+@lru_cache(maxsize=1)
+def data_element_name_matcher():
+    """NameMatcher of the names and aliases of all data elements to their ids, for parsing rule expressions"""
+    names_ids = list()
+    for de_id, name, alias in DataElement.objects.order_by('id').values_list('id', 'name', 'alias'):
+        names_ids.append((name, de_id))
+        if alias:
+            names_ids.append((alias, de_id))
+    return ruleexpr.NameMatcher(names_ids)
+
+@lru_cache(maxsize=1024)
+def cached_rule_expr(expr):
+    return ruleexpr.parse(expr, data_element_name_matcher())
+
+def parse_rule_expr(expr):
+    """
+    Parse a validation rule expression into an AST (see ruleexpr), raising
+    ValueError if it is not valid. The data element names are matched with a
+    NameMatcher built once, and expressions parsed once, per process
+    """
+    try:
+        return cached_rule_expr(expr)
+    except ValueError:
+        # another process may have created the data elements since the matcher was built
+        invalidate_rule_expr_cache()
+        return cached_rule_expr(expr)
+
+def invalidate_rule_expr_cache(*args, **kwargs):
+    data_element_name_matcher.cache_clear()
+    cached_rule_expr.cache_clear()
+
+post_save.connect(invalidate_rule_expr_cache, sender=DataElement)
+post_delete.connect(invalidate_rule_expr_cache, sender=DataElement)
+
+def iso_period_ordinal(iso_period):
+    """
+    Return the period type of an ISO 8601 period, the ordinal of its first
+    month (counted from January of year 0) and its length in months
+
+    >>> iso_period_ordinal('2017-09'), iso_period_ordinal('2017-Q3'), iso_period_ordinal('2017')
+    (('MONTH', 24212, 1), ('QUARTER', 24210, 3), ('YEAR', 24204, 12))
+
+    """
+    year = int(iso_period[:4])
+    if len(iso_period) == 4:
+        return 'YEAR', year*12, 12
+    if iso_period[5] in 'Qq':
+        return 'QUARTER', year*12 + (int(iso_period[6])-1)*3, 3
+    return 'MONTH', year*12 + int(iso_period[5:7])-1, 1
+
+def iso_period_parent(iso_period):
+    """The ISO 8601 period one level up (month -> quarter -> year), or None for a year"""
+    period_type, ordinal, months = iso_period_ordinal(iso_period)
+    if period_type == 'MONTH':
+        return '%s-Q%d' % (iso_period[:4], (ordinal % 12)//3 + 1)
+    if period_type == 'QUARTER':
+        return iso_period[:4]
+    return None
+
+class Period(models.Model):
+    """
+    A month, quarter or year. Periods are ordered by an integer ordinal (that
+    of their first month), so period ranges and roll-ups (a period and the
+    periods within it) are integer range comparisons
+    """
+    PERIOD_TYPES = (
+        ('MONTH', 'Month'),
+        ('QUARTER', 'Quarter'),
+        ('YEAR', 'Year'),
+    )
+    MONTHS = {'MONTH': 1, 'QUARTER': 3, 'YEAR': 12}
+
+    iso = models.CharField(max_length=7, unique=True) # ISO 8601 format '2017-09', '2017-Q3' or '2017'
+    period_type = models.CharField(max_length=8, choices=PERIOD_TYPES)
+    ordinal = models.IntegerField() # see iso_period_ordinal()
+    parent = models.ForeignKey('self', blank=True, null=True, related_name='children')
+
+    class Meta:
+        index_together = (('ordinal', 'period_type'),)
+
+    @property
+    def months(self):
+        return self.MONTHS[self.period_type]
+
+    @property
+    def end_ordinal(self):
+        """Ordinal of the first month after this period"""
+        return self.ordinal + self.months
+
+    @classmethod
+    def from_iso(cls, iso_period):
+        """
+        Get (creating it and its parents if needed) the Period for an ISO 8601
+        period. Inside a transaction the row may yet be rolled back, so it is
+        only cached once committed (see cache_committed())
+        """
+        period = PERIOD_CACHE.get(iso_period)
+        if period is None:
+            parent_iso = iso_period_parent(iso_period)
+            parent = cls.from_iso(parent_iso) if parent_iso else None
+            period_type, ordinal, months = iso_period_ordinal(iso_period)
+            period, created = cls.objects.get_or_create(iso=iso_period, defaults={'period_type': period_type, 'ordinal': ordinal, 'parent': parent})
+            cls.cache_committed([period])
+        return period
+
+    @classmethod
+    def cache_committed(cls, periods):
+        """Cache Periods got inside a transaction once it has committed, does nothing while one is still open"""
+        from django.db import connection
+
+        if not connection.in_atomic_block:
+            PERIOD_CACHE.update((p.iso, p) for p in periods)
+
+    @classmethod
+    def from_iso_periods(cls, iso_periods):
+        """Period for a (year, quarter, month) tuple as returned by extract_periods(), the most specific one given"""
+        iso_year, iso_quarter, iso_month = iso_periods
+        return cls.from_iso(iso_month or iso_quarter or iso_year)
+
+    def __str__(self):
+        return self.iso
+
+# process-wide cache of ISO 8601 period => Period, holding committed rows only (see Period.from_iso())
+PERIOD_CACHE = dict()
+
+def invalidate_period_cache(*args, **kwargs):
+    PERIOD_CACHE.clear()
+
+post_delete.connect(invalidate_period_cache, sender=Period)
+
 class DataValueQuerySet(models.QuerySet):
     """Convenience queryset methods for handling datavalues"""
     def what(self, *names):
-        de_filters = None
-        if names:
-            for de in names:
-                if de is None:
-                    continue # skip any names/uids with value of None
-                if de_filters:
-                    de_filters = de_filters | Q(data_element__name__iexact=de) | Q(data_element__alias__iexact=de)
-                else:
-                    de_filters = Q(data_element__name__iexact=de) | Q(data_element__alias__iexact=de)
+        names = [de for de in names if de is not None] # skip any names/uids with value of None
 
         qs = self.annotate(de_name=F('data_element__name'))
         qs = qs.annotate(de_uid=F('data_element__dhis2_uid'))
-        if de_filters:
-            qs = qs.filter(de_filters)
+        if names:
+            # resolved to ids up front, so the filter is on the (indexed) foreign key
+            qs = qs.filter(data_element_id__in=resolve_data_element_ids(names))
         return qs
 
     def where(self):
         raise NotImplementedError()
 
-    def when(self):
-        raise NotImplementedError()
+    def when(self, start_period, end_period=None):
+        """
+        Filter to values for periods within the ISO 8601 periods start_period
+        to end_period (inclusive, default: just start_period), leaving out
+        values for periods longer than start_period: when('2017-Q1') matches
+        monthly and quarterly values, like filter(quarter='2017-Q1') does
+        """
+        start_type, start_ordinal, start_months = iso_period_ordinal(start_period)
+        end_type, end_ordinal, end_months = iso_period_ordinal(end_period or start_period)
+        period_types = [p_type for p_type, months in Period.MONTHS.items() if months <= start_months]
+        # the (redundant) filter on year lets a table partitioned by year skip the other years
+        years = ['%d' % (y,) for y in range(start_ordinal // 12, (end_ordinal + end_months - 1) // 12 + 1)]
+        return self.filter(year__in=years, period__ordinal__gte=start_ordinal, period__ordinal__lt=end_ordinal+end_months, period__period_type__in=period_types)
 
 class DataValueManager(models.Manager):
     """Attach our custom queryset methods to the model manager"""
@@ -272,8 +904,8 @@ class DataValueManager(models.Manager):
     def where(self):
         raise NotImplementedError()
 
-    def when(self):
-        raise NotImplementedError()
+    def when(self, start_period, end_period=None):
+        return self.get_queryset().when(start_period, end_period)
 
 def get_default_category_combo():
     return CategoryCombo.objects.get(id=1)
@@ -287,6 +919,7 @@ class DataValue(models.Model):
     month = models.CharField(max_length=7, blank=True, null=True) # ISO 8601 format '2017-09'
     quarter = models.CharField(max_length=7, blank=True, null=True) # ISO 8601 format '2017-Q3'
     year = models.CharField(max_length=4, blank=True, null=True) # ISO 8601 format '2017'
+    period = models.ForeignKey(Period, related_name='data_values') # the most specific of month, quarter and year
     source_doc = models.ForeignKey(SourceDocument, related_name='data_values')
 
     objects = DataValueManager() # override the default manager
@@ -294,71 +927,438 @@ class DataValue(models.Model):
     class Meta():
         unique_together = (('data_element', 'category_combo', 'org_unit', 'year', 'quarter', 'month'),)
 
+    def save(self, *args, **kwargs):
+        # the loaders set period_id on the rows they write, a value saved on its own gets it here
+        if self.period_id is None and (self.month or self.quarter or self.year):
+            self.period = Period.from_iso_periods((self.year, self.quarter, self.month))
+        super(DataValue, self).save(*args, **kwargs)
+
     def __repr__(self):
         return 'DataValue<%s [%s], %s, %s, %d>' % (str(self.data_element), self.category_combo, self.site_str,  next(filter(None, (self.month, self.quarter, self.year))), self.numeric_value,)
 
     def __str__(self):
         return '%s [%s], %s, %s, %d' % (str(self.data_element), self.category_combo, self.site_str.split(' => ')[-1],  next(filter(None, (self.month, self.quarter, self.year))), self.numeric_value,)
 
+class AggregateValueQuerySet(DataValueQuerySet):
+    """what() as for DataValue, when() picks the quarterly or yearly aggregates"""
+    def when(self, start_period, end_period=None):
+        """
+        Filter to the aggregates for the quarters (or years, if start_period is
+        a year) start_period to end_period (inclusive, default: just
+        start_period). The aggregate for a quarter sums its monthly and
+        quarterly values, like DataValue.objects.when('2017-Q1') matches them
+        """
+        start_type, start_ordinal, start_months = iso_period_ordinal(start_period)
+        end_type, end_ordinal, end_months = iso_period_ordinal(end_period or start_period)
+        return self.filter(period__period_type=start_type, period__ordinal__gte=start_ordinal, period__ordinal__lt=end_ordinal+end_months)
+
+class AggregateValueManager(DataValueManager):
+    def get_queryset(self):
+        return AggregateValueQuerySet(self.model, using=self._db)
+
+class AggregateValue(models.Model):
+    """
+    The sum and count of the DataValues of a data element and category combo
+    for a quarter or a year, at an org unit and everything under it. Kept up
+    to date by refresh_aggregates() as source documents are loaded and
+    deleted, so the dashboards do not re-aggregate the raw values
+    """
+    data_element = models.ForeignKey(DataElement, related_name='aggregate_values')
+    category_combo = models.ForeignKey(CategoryCombo, related_name='aggregate_values')
+    org_unit = models.ForeignKey(OrgUnit, related_name='aggregate_values')
+    period = models.ForeignKey(Period, related_name='aggregate_values') # a quarter or a year
+    numeric_sum = models.DecimalField(max_digits=21, decimal_places=4)
+    values_count = models.IntegerField()
+
+    objects = AggregateValueManager()
+
+    class Meta:
+        unique_together = (('data_element', 'category_combo', 'org_unit', 'period'),)
+
+    def __str__(self):
+        return '%s [%s], %s, %s, %s' % (self.data_element, self.category_combo, self.org_unit, self.period, self.numeric_sum)
+
+AGGREGATES_LOCK_ID = 7305002
+
+# every value counts towards its quarter (if it has one) and its year, at its org unit and each of its ancestors
+AGGREGATE_VALUES_SQL = '''
+INSERT INTO cannula_aggregatevalue (data_element_id, category_combo_id, org_unit_id, period_id, numeric_sum, values_count)
+SELECT dv.data_element_id, dv.category_combo_id, anc.id, p.id, SUM(dv.numeric_value), COUNT(dv.numeric_value)
+FROM cannula_datavalue dv
+JOIN cannula_period p ON p.iso = dv.quarter OR p.iso = dv.year
+JOIN cannula_orgunit ou ON ou.id = dv.org_unit_id
+JOIN cannula_orgunit anc ON anc.tree_id = ou.tree_id AND anc.lft <= ou.lft AND anc.rght >= ou.rght
+WHERE {filters}
+GROUP BY dv.data_element_id, dv.category_combo_id, anc.id, p.id
+'''
+
+def aggregate_slices(data_values):
+    """The (data element ids, ISO quarters and years) the values of a DataValue queryset count towards"""
+    data_element_ids, iso_periods = set(), set()
+    for de_id, iso_quarter, iso_year in data_values.order_by().values_list('data_element_id', 'quarter', 'year').distinct():
+        data_element_ids.add(de_id)
+        iso_periods.update(filter(None, (iso_quarter, iso_year)))
+    return data_element_ids, iso_periods
+
+def refresh_aggregates(data_element_ids=None, iso_periods=None):
+    """
+    Recompute the AggregateValues of the given data elements for the given
+    ISO quarters and years (default: all of them) from the DataValues. Run it
+    for the slices (see aggregate_slices()) a load or a delete touched, so
+    only those are recomputed. Concurrent refreshes take turns
+    """
+    from django.db import connection, transaction
+
+    filters, params = ['TRUE'], list()
+    if data_element_ids is not None:
+        filters.append('dv.data_element_id = ANY(%s)')
+        params.append(list(data_element_ids))
+    if iso_periods is not None:
+        # the (redundant) filter on year lets a table partitioned by year skip the other years
+        filters.append('p.iso = ANY(%s) AND dv.year = ANY(%s)')
+        params.extend([list(iso_periods), list(set(iso[:4] for iso in iso_periods))])
+    if not all(params):
+        return # an empty slice
+
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [AGGREGATES_LOCK_ID])
+        stale = AggregateValue.objects.all()
+        if data_element_ids is not None:
+            stale = stale.filter(data_element_id__in=data_element_ids)
+        if iso_periods is not None:
+            stale = stale.filter(period__iso__in=iso_periods)
+        stale.delete()
+        cursor.execute(AGGREGATE_VALUES_SQL.format(filters=' AND '.join(filters)), params)
+
+def stash_deleted_document_slices(sender, instance, **kwargs):
+    instance._aggregate_slices = aggregate_slices(instance.data_values.all())
+
+def refresh_deleted_document_aggregates(sender, instance, **kwargs):
+    refresh_aggregates(*instance._aggregate_slices)
+
+def refresh_moved_org_unit_aggregates(sender, instance, **kwargs):
+    data_element_ids, iso_periods = aggregate_slices(DataValue.objects.filter(org_unit__in=instance.get_descendants(include_self=True)))
+    refresh_aggregates(data_element_ids, iso_periods)
+    refresh_validation_results(data_element_ids)
+
+pre_delete.connect(stash_deleted_document_slices, sender=SourceDocument)
+post_delete.connect(refresh_deleted_document_aggregates, sender=SourceDocument)
+node_moved.connect(refresh_moved_org_unit_aggregates, sender=OrgUnit)
+
+class IngestionJob(models.Model):
+    """A request to load a source document, picked up by the ingestion worker (manage.py ingestion_worker)"""
+    JOB_TYPES = (
+        ('VALUES', 'Load data values'),
+        ('VALIDATIONS', 'Load validation rules'),
+    )
+    LOAD_METHODS = (
+        ('ORM', 'Django bulk_create()'),
+        ('COPY', 'PostgreSQL COPY (via staging table)'),
+        ('UPSERT', 'Insert or update existing values (re-load corrections)'),
+    )
+    STATES = (
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+
+    source_doc = models.ForeignKey(SourceDocument, related_name='ingestion_jobs')
+    job_type = models.CharField(max_length=16, choices=JOB_TYPES, default='VALUES')
+    load_method = models.CharField(max_length=8, choices=LOAD_METHODS, default='ORM')
+    state = models.CharField(max_length=8, choices=STATES, default='QUEUED', db_index=True)
+    rows_processed = models.IntegerField(default=0)
+    num_inserted = models.IntegerField(default=0)
+    num_updated = models.IntegerField(default=0)
+    num_unchanged = models.IntegerField(default=0)
+    rows_per_second = models.FloatField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    stage_timings = models.TextField(blank=True, null=True) # JSON, see StageTimer.to_json()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Atomically mark the oldest queued job as running and return it (or None
+        if the queue is empty). SKIP LOCKED lets several workers share the queue
+        """
+        from django.db import connection
+        from django.utils import timezone
+
+        claim_sql = '''
+            UPDATE {table} SET state = 'RUNNING', started_at = %s
+            WHERE id = (
+                SELECT id FROM {table} WHERE state = 'QUEUED'
+                ORDER BY created_at, id LIMIT 1 FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+        '''.format(table=cls._meta.db_table)
+        cursor = connection.cursor()
+        cursor.execute(claim_sql, [timezone.now()])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return cls.objects.get(id=row[0])
+
+    def is_finished(self):
+        return self.state in ('DONE', 'FAILED')
+
+    def timings(self):
+        """List of StageTiming tuples recorded by the load, slowest first"""
+        return sorted(StageTimer.timings_from_json(self.stage_timings), key=lambda t: t.seconds, reverse=True)
+
+    def __str__(self):
+        return '%s job for %s [%s]' % (self.job_type, self.source_doc.orig_filename, self.state)
+
 @lru_cache(maxsize=16) # memoize to reduce cost of "parsing"
 def extract_periods(period_str):
     from .grabbag import period_to_dates, dates_to_iso_periods
     dates = period_to_dates(period_str)
     return dates_to_iso_periods(*dates)
 
-def load_excel_to_datavalues(source_doc, max_sheets=4):
-    from collections import defaultdict
-    import re
-    import calendar
-    import openpyxl
+DE_COLUMN_START = 4 # 0-based index of first dataelement column in worksheet
 
-    MONTH_REGEX = r'[\s]*(%s) [0-9]{4}[\s]*' % ('|'.join(calendar.month_name[1:]),)
-    MONTH_PREFIX_REGEX = r'^[\s]*(%s) ([0-9]{4})?[\s]*' % ('|'.join(calendar.month_name[1:]),)
+import calendar
+MONTH_PREFIX_REGEX = r'^[\s]*(%s) ([0-9]{4})?[\s]*' % ('|'.join(calendar.month_name[1:]),)
 
-    DE_COLUMN_START = 4 # 0-based index of first dataelement column in worksheet
+def data_worksheet_names(wb, max_sheets=4, skip_sheets=frozenset()):
+    return [ws_name for ws_name in wb.get_sheet_names()[:max_sheets] if ws_name not in ['Validations'] and ws_name not in skip_sheets] #['Step1', 'Targets']
 
-    wb = openpyxl.load_workbook(source_doc.file.path)
-    logger.debug(wb.get_sheet_names())
+def data_worksheets(wb, max_sheets=4, skip_sheets=frozenset()):
+    for ws_name in data_worksheet_names(wb, max_sheets, skip_sheets):
+        logger.debug(ws_name)
+        yield wb[ws_name]
+
+def clean_header_names(headers):
+    # discard the month (and space) prefix on the data element names
+    return [re.sub(MONTH_PREFIX_REGEX, '', h) for h in headers[DE_COLUMN_START:] if h is not None]
+
+def row_period_location(row):
+    """
+    Return the period and the location path (prefixed with the name of the root
+    OrgUnit) from the leading columns of a worksheet row, or None if either is missing
+    """
+    period, *location_parts = [c.value for c in row[:DE_COLUMN_START]]
+    if not period or not any(location_parts):
+        return None # ignore rows where period or location is missing
+    return period, ('Uganda', *filter(None, location_parts)) # turn to tuple and prepend name of root OrgUnit
 
-    wb_loc_values = defaultdict(list) # when a new key is encountered return a new empty list
+def parse_worksheet_rows(ws_rows, num_columns, timer=None):
+    """
+    Generator that turns worksheet data rows into (iso periods, location path,
+    values) tuples, where values holds a (column index, Decimal) pair for every
+    non-empty cell in the first num_columns data element columns (the index
+    counts from the first data element column). The time spent reading rows,
+    extracting periods and converting values is added to timer, if given
+    """
+    from time import perf_counter
 
-    for ws_name in wb.get_sheet_names()[:max_sheets]: #['Step1', 'Targets']:
-        if ws_name in ['Validations']:
+    if timer is None:
+        timer = StageTimer()
+    for row in timer.timed_iter('read_rows', ws_rows):
+        period_location = row_period_location(row)
+        if period_location is None:
             continue
-        ws = wb[ws_name]
-        logger.debug((ws_name, ws.max_row, ws.max_column))
+        period, location_parts = period_location
+        start_time = perf_counter()
+        iso_periods = extract_periods(str(period).strip())
+        periods_time = perf_counter()
+        cell_values = ((i, c.value) for i, c in enumerate(row[DE_COLUMN_START:DE_COLUMN_START+num_columns]))
+        # skip empty values
+        values = tuple((i, Decimal(v)) for i, v in cell_values if not (v is None or (isinstance(v, str) and v.strip() == '')))
+        timer.add('periods', periods_time - start_time)
+        timer.add('values', perf_counter() - periods_time, calls=len(values))
+        yield iso_periods, location_parts, values
+
+def parse_worksheet(file_path, ws_name):
+    """
+    Parse a whole worksheet without touching the database, so it can run in a
+    worker process. Returns the cleaned up data element headers and the list of
+    parsed data rows, or None for an empty worksheet
+    """
+    import openpyxl
 
-        headers = [cell.value for cell in ws.rows[0]]
-        # discard the month (and space) prefix on the data element names
-        clean_headers = (re.sub(MONTH_PREFIX_REGEX, '', h) for h in headers[DE_COLUMN_START:] if h is not None)
-        data_elements = tuple(unpack_data_element(de) for de in clean_headers)
+    wb = openpyxl.load_workbook(file_path, read_only=True)
+    ws_rows = wb[ws_name].iter_rows()
+    header_row = next(ws_rows, None)
+    if header_row is None:
+        return None
+    header_names = clean_header_names([cell.value for cell in header_row])
+    return header_names, list(parse_worksheet_rows(ws_rows, len(header_names)))
 
+def workbook_location_paths(wb, max_sheets=4, skip_sheets=frozenset(), periods=None):
+    """
+    Collect the distinct location paths of all the data rows in a workbook,
+    and their distinct period strings into the periods set, if given
+    """
+    location_paths = set()
+    for ws in data_worksheets(wb, max_sheets, skip_sheets):
+        ws_rows = ws.iter_rows()
+        next(ws_rows, None) # skip header row
+        for row in ws_rows:
+            period_location = row_period_location(row)
+            if period_location:
+                location_paths.add(period_location[1])
+                if periods is not None:
+                    periods.add(period_location[0])
+    return location_paths
+
+def resolve_workbook_dimensions(source_doc, max_sheets=4):
+    """
+    Resolve (creating where missing) the OrgUnits, Periods, data elements and
+    category combos a workbook refers to, in a short transaction of its own.
+    Concurrent loads take turns through an advisory lock rather than racing to
+    create the same rows, and the results stay in ORG_UNIT_PATHS, PERIOD_CACHE
+    and HEADER_CACHE for the value load that follows
+    """
+    import openpyxl
+    from django.db import transaction
+
+    skip_sheets = source_doc.loaded_worksheet_names()
+    wb = openpyxl.load_workbook(source_doc.file.path, read_only=True)
+    sheet_headers = list()
+    for ws in data_worksheets(wb, max_sheets, skip_sheets):
+        header_row = next(ws.iter_rows(), None)
+        if header_row is not None:
+            sheet_headers.append(clean_header_names([cell.value for cell in header_row]))
+    periods = set()
+    location_paths = workbook_location_paths(wb, max_sheets, skip_sheets, periods)
+    iso_periods = set(filter(None, (extract_periods(str(period).strip()) for period in periods)))
+
+    with transaction.atomic():
+        lock_dimensions() # held across all the dimensions, from_paths() and resolve_headers() take it again
+        OrgUnit.from_paths(location_paths)
+        periods = [Period.from_iso_periods(period_tuple) for period_tuple in iso_periods]
+        for header_names in sheet_headers:
+            resolve_headers(header_names)
+    Period.cache_committed(periods) # no longer inside this transaction, unless the caller's own is still open
+
+# the fields of a data value row, in the order load_excel_to_datavalues() puts them in its tuples
+DATAVALUE_ROW_COLUMNS = (
+    'data_element_id',
+    'category_combo_id',
+    'numeric_value',
+    'site_str',
+    'org_unit_id',
+    'month',
+    'quarter',
+    'year',
+    'period_id',
+    'source_doc_id',
+)
 
-        for row in ws.rows[1:]: # skip header row
-            period, *location_parts = [c.value for c in row[:DE_COLUMN_START]]
-            if not period or not any(location_parts):
-                continue # ignore rows where period or location is missing
-            iso_year, iso_quarter, iso_month = extract_periods(str(period).strip())
-            location_parts = ('Uganda', *filter(None, location_parts)) # turn to tuple and prepend name of root OrgUnit
-            current_ou = OrgUnit.from_path_recurse(*location_parts)
+class ValueBatch(list):
+    """
+    A list of data value rows (tuples of DATAVALUE_ROW_COLUMNS), that also
+    carries the checkpoint to record once they are written: a dict of
+    worksheet name to (data rows done, finished)
+    """
+    def __init__(self, *args):
+        super(ValueBatch, self).__init__(*args)
+        self.checkpoint = dict()
+
+def load_excel_to_datavalues(source_doc, max_sheets=4, batch_size=5000, workers=1, timer=None):
+    """
+    Generator that reads the worksheets of a source document row by row and
+    yields lists of data value rows, with at most batch_size values per list
+    (a site's values can be split across two batches). The rows are plain
+    tuples of DATAVALUE_ROW_COLUMNS, that share the per-site fields, rather
+    than DataValue instances: these are only built at write time, if at all.
+
+    With workers > 1 the worksheets are parsed in parallel, in a pool of that
+    many processes, and each parsed worksheet is held (in compact form) until
+    its values have been yielded.
+
+    Worksheets with the same contents as one already loaded (from this or an
+    earlier upload) are skipped, and a load interrupted part way through a
+    worksheet resumes after the rows its checkpoint counts as loaded (see
+    ValueBatch). Batches always end on a row boundary.
+
+    The time (and queries) each stage takes is added to timer, if given
+    """
+    import openpyxl
+    from itertools import islice
+    from time import perf_counter
+
+    if timer is None:
+        timer = StageTimer()
+
+    skip_sheets = source_doc.loaded_worksheet_names()
+    # read-only mode streams the rows from the file instead of building every cell up front
+    wb = openpyxl.load_workbook(source_doc.file.path, read_only=True)
+    logger.debug(wb.get_sheet_names())
+    if skip_sheets:
+        logger.info('%s: skipping already loaded worksheets %s', source_doc, ', '.join(sorted(skip_sheets)))
+    checkpoints = source_doc.worksheet_checkpoints()
+    if checkpoints:
+        logger.info('%s: resuming from checkpoint %s', source_doc, checkpoints)
+
+    if len(ORG_UNIT_PATHS) == 0:
+        ORG_UNIT_PATHS.warm()
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from itertools import repeat
+
+        ws_names = data_worksheet_names(wb, max_sheets, skip_sheets)
+        with timer.stage('parse_parallel'), ProcessPoolExecutor(max_workers=min(workers, len(ws_names) or 1)) as executor:
+            parsed_sheets = [(ws_name,) + ws for ws_name, ws in zip(ws_names, executor.map(parse_worksheet, repeat(source_doc.file.path), ws_names)) if ws is not None]
+        location_paths = set(location_parts for ws_name, header_names, ws_rows in parsed_sheets for _, location_parts, _ in ws_rows)
+    else:
+        def iter_parsed_sheets():
+            for ws in data_worksheets(wb, max_sheets, skip_sheets):
+                ws_rows = ws.iter_rows()
+                header_row = next(ws_rows, None)
+                if header_row is None:
+                    continue # ignore empty worksheets
+                header_names = clean_header_names([cell.value for cell in header_row])
+                yield ws.title, header_names, parse_worksheet_rows(ws_rows, len(header_names), timer)
+
+        parsed_sheets = iter_parsed_sheets()
+        # a first pass over the location columns lets us create all the missing OrgUnits in one go
+        with timer.stage('location_prepass'):
+            location_paths = workbook_location_paths(wb, max_sheets, skip_sheets)
+
+    with timer.stage('org_units'):
+        location_ou_ids = OrgUnit.from_paths(location_paths)
+
+    default_cc_id = DataValue._meta.get_field('category_combo').get_default()
+    period_ids = dict()
+    batch_values = ValueBatch()
+
+    for ws_name, header_names, ws_rows in parsed_sheets:
+        with timer.stage('headers'):
+            data_elements = tuple((de_id, cc_id or default_cc_id) for de_id, cc_id in resolve_headers(header_names))
+        rows_done = checkpoints.get(ws_name, 0)
+
+        for (iso_year, iso_quarter, iso_month), location_parts, values in islice(ws_rows, rows_done, None):
+            build_start = perf_counter()
             location = ' => '.join(location_parts)
-            logger.debug((period, location))
-
-            site_val_cells = row[DE_COLUMN_START:]
-            site_values = zip(data_elements, (c.value for c in site_val_cells))
-            dv_construct = partial(DataValue, site_str=location, org_unit=current_ou, month=iso_month, quarter=iso_quarter, year=iso_year, source_doc=source_doc)
-            data_values = list()
-            for (de, cc), dv in site_values:
-                if dv is None or (isinstance(dv, str) and dv.strip() == ''):
-                    continue # skip rows with empty values
-                if cc:
-                    data_values.append(dv_construct(data_element=de, category_combo=cc, numeric_value=Decimal(dv)))
-                else:
-                    data_values.append(dv_construct(data_element=de, numeric_value=Decimal(dv)))
+            logger.debug((iso_year, iso_quarter, iso_month, location))
 
-            wb_loc_values[location].extend(data_values)
+            period_id = period_ids.get((iso_year, iso_quarter, iso_month))
+            if period_id is None:
+                period_id = period_ids[(iso_year, iso_quarter, iso_month)] = Period.from_iso_periods((iso_year, iso_quarter, iso_month)).id
+            row_site = (location, location_ou_ids[location_parts], iso_month, iso_quarter, iso_year, period_id, source_doc.id)
+            batch_values.extend(data_elements[i] + (dv,) + row_site for i, dv in values)
+            timer.add('build', perf_counter() - build_start, calls=len(values))
+            rows_done += 1
 
-    return dict(wb_loc_values) # convert back to a normal dict for our callers
+            if len(batch_values) >= batch_size:
+                batch_values.checkpoint[ws_name] = (rows_done, False)
+                yield batch_values
+                batch_values = ValueBatch()
+
+        batch_values.checkpoint[ws_name] = (rows_done, True)
+
+    if batch_values or batch_values.checkpoint:
+        yield batch_values
 
 def de_pivot_col(de):
     return 'DE_%d' % (de.id,)
@@ -369,17 +1369,6 @@ def pivot_clause(data_elements):
 def validation_expr(left, right, operator):
     pass
 
-def validation_expr_elements(expr):
-    names = list()
-    for de_tup in DataElement.objects.all().values_list('name', 'alias'):
-        names.extend(de_tup)
-    names = filter(None, names)
-    sorted_names = list(sorted(names, reverse=True)) # sort puts longest matches first
-    DE_REGEX = '|'.join('%s' % (re.escape(de_name),) for de_name in sorted_names)
-    m = re.findall(DE_REGEX, expr, flags=re.IGNORECASE)
-    print(m)
-    return tuple(filter(None, m))
-
 def load_excel_to_validations(source_doc):
     import openpyxl
 
@@ -393,24 +1382,33 @@ def load_excel_to_validations(source_doc):
         ws = wb[ws_name]
         logger.debug((ws_name, ws.max_row, ws.max_column))
 
-        
+        invalidate_rule_expr_cache() # match the data element names and aliases as they are now
         for row in ws.rows[1:]: # skip header row
             validation_name, l_exp, op, r_exp, *_ = [c.value for c in row]
             if not l_exp or not op or not r_exp:
                 continue # ignore rows where any part of the rule is missing
-            print(validation_name, l_exp, op, r_exp)
-            l_element_names = validation_expr_elements(l_exp)
-            r_element_names = validation_expr_elements(r_exp)
-            element_names = l_element_names + r_element_names
+            logger.debug((validation_name, l_exp, op, r_exp))
             bad_rules = ['Mal_1', 'Mal_6', 'Mal_7', 'Mal_11']
-            if len(element_names) > 0 and len(l_element_names) > 0 and len(r_element_names) > 0 and validation_name not in bad_rules: #TODO: exclude dodgy rule for demo
-                try:
-                    vr = ValidationRule.objects.get(name=validation_name)
-                    vr.left_expr, vr.right_expr, vr.operator = l_exp, r_exp, op
-                except ValidationRule.DoesNotExist as e:
-                    vr = ValidationRule(name=validation_name, left_expr=l_exp, right_expr=r_exp, operator=op)
-                vr.save()
-                print(vr.view_name())
+            if validation_name in bad_rules: #TODO: exclude dodgy rule for demo
+                continue
+            try:
+                l_ast, r_ast = parse_rule_expr(l_exp), parse_rule_expr(r_exp)
+            except ValueError as e:
+                logger.warning('%s: cannot parse %s %s %s (%s)', validation_name, l_exp, op, r_exp, e)
+                continue
+            if not ruleexpr.data_element_ids(l_ast) or not ruleexpr.data_element_ids(r_ast):
+                continue # both sides must refer to data elements
+            try:
+                vr = ValidationRule.objects.get(name=validation_name)
+                vr.left_expr, vr.right_expr, vr.operator = l_exp, r_exp, op
+            except ValidationRule.DoesNotExist as e:
+                vr = ValidationRule(name=validation_name, left_expr=l_exp, right_expr=r_exp, operator=op)
+            try:
+                vr.save() # the expressions are parsed already, save() reuses them
+            except ValidationError as e:
+                logger.warning('%s: cannot save %s (%s)', validation_name, vr.expression(), e)
+                continue
+            logger.debug(vr.view_name())
 
     return
 
@@ -429,18 +1427,14 @@ def load_excel_to_validations(source_doc):
     calc_query = mk_calculation_sql(calc_exprs, de_meta_list, [], ou_level, search_periods, month_multiple)
     print(calc_query)
 
-def mk_validation_rule_sql(rule_expr, data_elements):
-    de_meta_list = query_de_meta(data_elements)
+def mk_validation_rule_sql(left_ast, operator, right_ast):
+    """SQL of a validation rule's view, from its parsed expressions (see ValidationRule.parsed_expressions())"""
+    de_meta_list = query_de_meta_ids(ruleexpr.data_element_ids(left_ast) | ruleexpr.data_element_ids(right_ast))
     ou_level = min(map(lambda x: x.ou_level, de_meta_list))
     month_multiple = max(map(lambda x: x.month_multiple, de_meta_list))
+    rule_sql = '%s %s %s' % (ruleexpr.to_sql(left_ast), RULE_OPERATORS[operator.strip()], ruleexpr.to_sql(right_ast))
 
-    subst_rule_expr = rule_expr
-    for de_meta in sorted(de_meta_list, key=lambda x: x.name, reverse=True):
-        subst_rule_expr = re.sub('(?i)' + re.escape(de_meta.name), 'DE_%d' % (de_meta.id,), subst_rule_expr)
-        if de_meta.alias:
-            subst_rule_expr = re.sub('(?i)' + re.escape(de_meta.alias), 'DE_%d' % (de_meta.id,), subst_rule_expr)
-
-    return mk_calculation_sql([(subst_rule_expr, [])], de_meta_list, [], ou_level, [], month_multiple)
+    return mk_calculation_sql([(rule_sql, [])], de_meta_list, [], ou_level, [], month_multiple)
 
 def query_de_meta(de_names):
     """
@@ -448,14 +1442,18 @@ def query_de_meta(de_names):
     tuples containing the name, id, highest orgunit level it is collected at,
     and the largest period type it is collected for (as a multiple of month)
     """
-    from functools import reduce
+    if len(de_names) == 0:
+        return tuple()
+    return query_de_meta_ids(resolve_data_element_ids(de_names))
+
+def query_de_meta_ids(de_ids):
+    """As query_de_meta(), given dataelement ids"""
     from collections import namedtuple
 
-    if len(de_names) == 0:
+    if len(de_ids) == 0:
         return tuple()
     
-    q_objs = reduce(lambda x, y: x | y, (Q(alias__iexact=de_name)|Q(name__iexact=de_name) for de_name in de_names))
-    qs = DataElement.objects.filter(q_objs)
+    qs = DataElement.objects.filter(id__in=de_ids)
     qs = qs.annotate(ou_level=Min(F('data_values__org_unit__level')))
     qs = qs.annotate(month_multiple=Min(Case(When(data_values__month__isnull=False, then=1), When(data_values__quarter__isnull=False, then=4), When(data_values__year__isnull=False, then=12), default=None, output_field=models.IntegerField())))
     qs = qs.order_by('name', 'id', 'ou_level', 'month_multiple')
@@ -464,7 +1462,7 @@ def query_de_meta(de_names):
     return tuple(DataElementMeta(**v) for v in qs.values('name', 'alias', 'id', 'ou_level', 'month_multiple'))
 
 def fields_for_ou_level(ou_level):
-    return ('country', 'district', 'subcounty', 'facility')[:ou_level+1]
+    return OU_LEVEL_NAMES[:ou_level+1]
 
 def fields_for_month_multiple(month_mul):
     return ('year', 'quarter', 'month')[:(12, 3, 1).index(month_mul)+1]
@@ -475,18 +1473,35 @@ def gen_pairs(iterable):
     for item1 in iterable:
         yield (item1, next(item2_iter))
 
-def mk_de_group_sql(de_meta_list, all_fields, ou_level):
+def period_ordinal_range(period_list):
+    """The (first, after last) month ordinals spanned by a list of period strings, or None"""
+    bounds = list()
+    for p in period_list:
+        iso_periods = grabbag.dates_to_iso_periods(*grabbag.period_to_dates(p))
+        if iso_periods:
+            period_type, ordinal, months = iso_period_ordinal(next(filter(None, reversed(iso_periods))))
+            bounds.append((ordinal, ordinal+months))
+    if not bounds:
+        return None
+    return min(lo for lo, hi in bounds), max(hi for lo, hi in bounds)
+
+def mk_de_group_sql(de_meta_list, all_fields, ou_level, period_range=None):
     select_clause = ' '.join(['SELECT', ', '.join(all_fields)])
     
-    _tables = ['cannula_datavalue dv', 'cannula_orgunit ou', 'cannula_dataelement de'] + ['cannula_orgunit ou%d' % i for i in range(ou_level+1)]
+    _tables = ['cannula_datavalue dv', 'cannula_orgunit ou', 'cannula_dataelement de']
+    if period_range:
+        _tables.append('cannula_period pd')
     from_clause = ' '.join(['FROM', ', '.join(_tables)])
 
     join_filter_subclause = ' AND '.join(('dv.org_unit_id=ou.id', 'dv.data_element_id=de.id'))
-    ou_traversals = ['ou0.parent_id IS NULL'] + ['ou%d.parent_id=ou%d.id' % (c, p) for p,c in gen_pairs(range(ou_level+1))]
-    ou_traversals.append('ou.id = ou%d.id' % (ou_level,))
+    # the ancestor names come from the per-level columns of the value's org unit, no walk up the tree
+    ou_level_filter = 'ou.level = %d' % (ou_level,)
     de_filters = ['de.name=\'%s\'' % (de_m.name,) for de_m in de_meta_list] #TODO: switch to data element IDs/UIDs/CODEs to avoid SQL injection
     de_filter_clause = '(%s)' % ('\nOR '.join(de_filters),)
-    where_parts = [join_filter_subclause, *ou_traversals, de_filter_clause]
+    where_parts = [join_filter_subclause, ou_level_filter, de_filter_clause]
+    if period_range:
+        # only read the values of the periods asked for, by period ordinal
+        where_parts.append('dv.period_id=pd.id AND pd.ordinal >= %d AND pd.ordinal < %d' % period_range)
     where_clause = 'WHERE ' + ('\nAND '.join(where_parts))
 
     return '\n'.join([select_clause, from_clause, where_clause])
@@ -498,12 +1513,12 @@ def mk_union_sql(de_meta_list, ou_list, ou_level, period_list, period_month_mult
     period_fields = fields_for_month_multiple(period_month_multiple)
     print(ou_fields, period_fields)
 
-    hier_ou_pairs = tuple(('ou%d' % (i,), f) for i, f in enumerate(ou_fields))
-    hier_ou_fields = tuple('%s.name as %s' % (code, desc) for code, desc in hier_ou_pairs)
+    hier_ou_fields = tuple('ou.%s as %s' % (name_field, desc) for name_field, desc in zip(OU_LEVEL_NAME_FIELDS, ou_fields))
 
     placeholder_fields = ', '.join(['NULL as %s' % (f,) for f in (period_fields + ou_fields)])
     union_parts = ['SELECT %s, NULL as de_name, NULL as numeric_value FROM cannula_datavalue dv' % (placeholder_fields,)]
 
+    period_range = period_ordinal_range(period_list)
     grouped_de_metas = groupby(de_meta_list, lambda x: (x.ou_level, x.month_multiple))
     for g in grouped_de_metas:
         g_ident, g_seq = g
@@ -515,14 +1530,16 @@ def mk_union_sql(de_meta_list, ou_list, ou_level, period_list, period_month_mult
             my_periods = [tuple(filter(None, grabbag.dates_to_iso_periods(*grabbag.period_to_dates(p)))) for p in period_list]
             my_periods = [tuple('\'%s\'' % (p,) for p in p_tup) for p_tup in my_periods] #TODO: do proper db quoting
             print(my_periods)
+            # values of these data elements are for longer periods, that start before the range asked for
+            my_period_range = period_range and (period_range[0] - period_range[0] % (12 if g_month_multiple >= 12 else 3), period_range[1])
             for p_tup in my_periods:
                 all_fields = my_period_fields + p_tup[len(my_period_fields):] + hier_ou_fields + ('de.name as de_name' , 'numeric_value')
-                group_select = mk_de_group_sql(g_seq, all_fields, g_ou_level)
+                group_select = mk_de_group_sql(g_seq, all_fields, g_ou_level, my_period_range)
                 union_parts.append(group_select)
         else:
             my_period_fields = period_fields
             all_fields = my_period_fields + hier_ou_fields + ('de.name as de_name' , 'numeric_value')
-            group_select = mk_de_group_sql(g_seq, all_fields, g_ou_level)
+            group_select = mk_de_group_sql(g_seq, all_fields, g_ou_level, period_range)
             union_parts.append(group_select)
 
     return '\nUNION ALL\n'.join(union_parts)
@@ -606,9 +1623,10 @@ def mk_calculation_sql(calculations, de_meta_list, ou_list, ou_level, period_lis
 
 class ValidationRule(models.Model):
     name = models.CharField(max_length=128, unique=True)
-    left_expr = models.CharField(max_length=256) #TODO: store the cleaned up expression with symbolic data element names
+    left_expr = models.CharField(max_length=256)
     right_expr = models.CharField(max_length=256)
     operator = models.CharField(max_length=2) #TODO: make this a choice field
+    expression_ast = models.TextField(blank=True, editable=False) # JSON, see parsed_expressions()
     #TODO: add a description/comments field ?
 
     data_elements = models.ManyToManyField(DataElement)
@@ -619,34 +1637,228 @@ class ValidationRule(models.Model):
     def view_name(self):
         return 'vw_validation_%d' % (self.id,)
 
-    def save(self, *args, **kwargs):
+    def results_view_name(self):
+        """The materialised view holding the results of view_name(), see refresh_results()"""
+        return 'mvw_validation_%d' % (self.id,)
+
+    def create_views(self, sql):
         from django.db import connection
 
-        super(ValidationRule, self).save(*args, **kwargs)
-        
-        # parse and collect data element names
-        l_element_names = validation_expr_elements(self.left_expr)
-        r_element_names = validation_expr_elements(self.right_expr)
-        element_names = l_element_names + r_element_names
-        
-        # modify list of data elements
-        new_meta_list = query_de_meta(element_names)
-        curr_meta_list = query_de_meta(self.data_elements.all().values_list('name'))
-        for de_meta in curr_meta_list: # remove, if not in new list
-            if de_meta not in new_meta_list:
-                self.data_elements.remove(DataElement.objects.get(id=de_meta.id))
-        for de_meta in new_meta_list: # add, if not in current list
-            if de_meta not in curr_meta_list:
-                self.data_elements.add(DataElement.objects.get(id=de_meta.id))
+        cursor = connection.cursor()
+        # the columns follow the data elements of the rule, so the views are recreated rather than replaced
+        cursor.execute('DROP MATERIALIZED VIEW IF EXISTS %s' % (self.results_view_name(),))
+        cursor.execute('DROP VIEW IF EXISTS %s' % (self.view_name(),))
+        cursor.execute('CREATE VIEW %s AS\n%s' % (self.view_name(), sql))
+        cursor.execute('CREATE MATERIALIZED VIEW %s AS SELECT * FROM %s' % (self.results_view_name(), self.view_name()))
+
+    def refresh_results(self):
+        """Recompute the stored results, creating the views of a rule that has none (migration 0023 skips those)"""
+        from django.db import connection
 
+        cursor = connection.cursor()
+        cursor.execute('SELECT to_regclass(%s)', [self.results_view_name()])
+        if cursor.fetchone()[0] is None:
+            left_ast, right_ast = self.parsed_expressions()
+            self.create_views(mk_validation_rule_sql(left_ast, self.operator, right_ast)) # also computes the results
+            return
+        cursor.execute('REFRESH MATERIALIZED VIEW %s' % (self.results_view_name(),))
+
+    def parse_expressions(self):
+        """Parse the left and right expressions (see parse_rule_expr()), raising ValidationError if the rule is not valid"""
+        errors = dict()
+        parsed = dict()
+        for field in ('left_expr', 'right_expr'):
+            try:
+                parsed[field] = parse_rule_expr(getattr(self, field))
+            except ValueError as e:
+                errors[field] = str(e)
+        if self.operator.strip() not in RULE_OPERATORS:
+            errors['operator'] = 'Unknown operator: \'%s\'' % (self.operator,)
+        if not errors and not (ruleexpr.data_element_ids(parsed['left_expr']) | ruleexpr.data_element_ids(parsed['right_expr'])):
+            errors['left_expr'] = 'The rule refers to no data element'
+        if errors:
+            raise ValidationError(errors)
+        return parsed['left_expr'], parsed['right_expr']
+
+    def parsed_expressions(self):
+        """The (left, right) ASTs of the expressions (see ruleexpr), as parsed when the rule was saved"""
+        if not self.expression_ast: # saved before the expressions were stored parsed
+            return parse_rule_expr(self.left_expr), parse_rule_expr(self.right_expr)
+        parsed = json.loads(self.expression_ast)
+        return parsed['left'], parsed['right']
+
+    def clean(self):
+        self.parse_expressions()
+
+    def save(self, *args, **kwargs):
+        left_ast, right_ast = self.parse_expressions()
+        self.expression_ast = json.dumps({'left': left_ast, 'right': right_ast})
         super(ValidationRule, self).save(*args, **kwargs)
 
-        # create the view
-        sql = mk_validation_rule_sql(self.expression(), element_names)
-        view_sql = 'CREATE OR REPLACE VIEW %s AS\n%s' % (self.view_name(), sql)
-        cursor = connection.cursor()
-        cursor.execute(view_sql, [])
+        # modify list of data elements
+        de_ids = ruleexpr.data_element_ids(left_ast) | ruleexpr.data_element_ids(right_ast)
+        curr_de_ids = set(self.data_elements.values_list('id', flat=True))
+        if curr_de_ids - de_ids:
+            self.data_elements.remove(*(curr_de_ids - de_ids))
+        if de_ids - curr_de_ids:
+            self.data_elements.add(*(de_ids - curr_de_ids))
+
+        # create the views, which also computes the results
+        self.create_views(mk_validation_rule_sql(left_ast, self.operator, right_ast))
 
     def __str__(self):
         return self.name
-        
\ No newline at end of file
+
+def refresh_validation_results(data_element_ids=None):
+    """
+    Recompute the stored results of the validation rules over any of the
+    given data elements (default: all rules), e.g. after loading their values.
+    A rule whose results cannot be computed is logged and skipped: the values
+    are loaded by then, and the other rules still get refreshed
+    """
+    from django.db import transaction, DatabaseError
+
+    rules = ValidationRule.objects.all()
+    if data_element_ids is not None:
+        rules = rules.filter(data_elements__id__in=data_element_ids).distinct()
+    for rule in rules:
+        try:
+            with transaction.atomic():
+                rule.refresh_results()
+        except (DatabaseError, ValueError) as e:
+            logger.warning('%s: cannot refresh the results of %s (%s)', rule, rule.expression(), e)
+
+def refresh_deleted_document_validations(sender, instance, **kwargs):
+    data_element_ids, iso_periods = instance._aggregate_slices
+    refresh_validation_results(data_element_ids)
+
+post_delete.connect(refresh_deleted_document_validations, sender=SourceDocument)
+        
+class ValidationViolation(models.Model):
+    """A validation rule that does not hold for the values of an org unit for a period, see check_validation_rules()"""
+    rule = models.ForeignKey(ValidationRule, related_name='violations')
+    org_unit = models.ForeignKey(OrgUnit, related_name='validation_violations')
+    period = models.ForeignKey(Period, related_name='validation_violations')
+    left_value = models.DecimalField(max_digits=21, decimal_places=4, blank=True, null=True)
+    right_value = models.DecimalField(max_digits=21, decimal_places=4, blank=True, null=True)
+    checked_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = (('rule', 'org_unit', 'period'),)
+
+    def __str__(self):
+        return '%s: %s, %s (%s %s %s)' % (self.rule, self.org_unit, self.period, self.left_value, self.rule.operator, self.right_value)
+
+# rule operators, as SQL comparison operators
+RULE_OPERATORS = {
+    '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+    '=': '=', '==': '=', '!=': '<>', '<>': '<>',
+}
+
+# the values of the checked data elements for a period and the periods within it, see validation_value_params()
+VALIDATION_VALUES_WHERE = 'dv.data_element_id = ANY(%s) AND dv.year = ANY(%s) AND p.ordinal >= %s AND p.ordinal < %s AND p.period_type = ANY(%s)'
+
+VALIDATION_PIVOT_SQL = '''
+CREATE TEMPORARY TABLE validation_pivot ON COMMIT DROP AS
+SELECT dv.org_unit_id, {columns}
+FROM cannula_datavalue dv JOIN cannula_period p ON p.id = dv.period_id
+WHERE %s
+GROUP BY dv.org_unit_id
+''' % (VALIDATION_VALUES_WHERE,)
+
+VIOLATIONS_SQL = '''
+INSERT INTO cannula_validationviolation (rule_id, org_unit_id, period_id, left_value, right_value, checked_at)
+SELECT %s, org_unit_id, %s, left_value, right_value, %s
+FROM (SELECT org_unit_id, ({left}) AS left_value, ({right}) AS right_value FROM validation_pivot WHERE {reported}) AS q_rule
+WHERE NOT (left_value {operator} right_value)
+'''
+
+def validation_value_params(de_ids, period):
+    period_types = [p_type for p_type, months in Period.MONTHS.items() if months <= period.months]
+    # the (redundant) filter on year lets a table partitioned by year skip the other years
+    years = ['%d' % (y,) for y in range(period.ordinal // 12, (period.end_ordinal - 1) // 12 + 1)]
+    return [list(de_ids), years, period.ordinal, period.end_ordinal, period_types]
+
+def checkable_rules(rules):
+    """(rule, data elements) pairs of the rules that can be checked, logging the others"""
+    checked_rules = list()
+    for rule in rules.prefetch_related('data_elements'):
+        data_elements = list(rule.data_elements.all())
+        if not data_elements or rule.operator.strip() not in RULE_OPERATORS:
+            logger.warning('%s: cannot check %s', rule, rule.expression())
+            continue
+        try:
+            rule.parsed_expressions()
+        except ValueError as e:
+            logger.warning('%s: cannot check %s (%s)', rule, rule.expression(), e)
+            continue
+        checked_rules.append((rule, data_elements))
+    return checked_rules
+
+def check_validation_rules(iso_period, rules=None, engine='SQL'):
+    """
+    Check validation rules (default: all of them) against the values for an
+    ISO 8601 period (and the periods within it) of every org unit that
+    reports any of their data elements, recording a ValidationViolation for
+    each rule that does not hold. cannula_datavalue is read once, into a pivot
+    of all the rules' data elements per org unit, and each rule's parsed
+    expressions are evaluated against the pivot. With either engine a
+    division by zero leaves the rule undecided for that org unit.
+
+    With the SQL engine the pivot is a temporary table and each rule is an
+    INSERT ... SELECT from it (in a savepoint of its own, so a rule that fails
+    to evaluate is logged and skipped). With the NUMPY engine the pivot is a
+    matrix and the rules are array operations (see ruleeval). Returns the
+    number of rules checked and the number of violations found
+    """
+    from django.db import connection, transaction, DatabaseError
+    from django.utils import timezone
+
+    if rules is None:
+        rules = ValidationRule.objects.all()
+    checked_rules = checkable_rules(rules)
+    de_ids = sorted(set(de.id for rule, data_elements in checked_rules for de in data_elements))
+    if not de_ids:
+        return 0, 0
+
+    period = Period.from_iso(iso_period)
+    checked_at = timezone.now()
+    num_violations = 0
+    if engine == 'NUMPY':
+        from .ruleeval import PeriodMatrix, find_violations
+
+        matrix = PeriodMatrix.load(de_ids, period)
+        violations = [
+            ValidationViolation(rule=rule, org_unit_id=ou_id, period=period, left_value=left_value, right_value=right_value, checked_at=checked_at)
+            for rule, ou_id, left_value, right_value in find_violations(checked_rules, matrix)
+        ]
+        with transaction.atomic():
+            ValidationViolation.objects.filter(rule__in=[rule for rule, data_elements in checked_rules], period=period).delete()
+            ValidationViolation.objects.bulk_create(violations)
+        return len(checked_rules), len(violations)
+
+    # the sum of each data element, and whether it was reported at all
+    pivot_columns = ',\n'.join(
+        'SUM(CASE WHEN dv.data_element_id = %d THEN dv.numeric_value ELSE 0 END) AS DE_%d, COUNT(CASE WHEN dv.data_element_id = %d THEN 1 END) AS N_%d' % (de_id, de_id, de_id, de_id)
+        for de_id in de_ids
+    )
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute('DROP TABLE IF EXISTS validation_pivot') # left by an earlier check in the same transaction
+        cursor.execute(VALIDATION_PIVOT_SQL.format(columns=pivot_columns), validation_value_params(de_ids, period))
+        ValidationViolation.objects.filter(rule__in=[rule for rule, data_elements in checked_rules], period=period).delete()
+        for rule, data_elements in checked_rules:
+            left_ast, right_ast = rule.parsed_expressions()
+            rule_sql = VIOLATIONS_SQL.format(
+                left=ruleexpr.to_sql(left_ast),
+                right=ruleexpr.to_sql(right_ast),
+                operator=RULE_OPERATORS[rule.operator.strip()],
+                reported=' OR '.join('N_%d > 0' % (de.id,) for de in data_elements),
+            )
+            try:
+                with transaction.atomic():
+                    cursor.execute(rule_sql, [rule.id, period.id, checked_at])
+                    num_violations += cursor.rowcount
+            except DatabaseError as e:
+                logger.warning('%s: cannot check %s (%s)', rule, rule.expression(), e)
+    return len(checked_rules), num_violations
@@ -0,0 +1,88 @@
+"""
+Optional partitioning of cannula_datavalue by year (PostgreSQL 11+ declarative
+LIST partitioning on the year column), see settings.DATAVALUE_PARTITIONED and
+manage.py datavalue_partitions
+"""
+from django.db import connection
+
+from .models import DataValue
+
+DATAVALUE_TABLE = DataValue._meta.db_table
+DEFAULT_PARTITION = DATAVALUE_TABLE + '_ydefault' # rows with no (or no partition for their) year
+# replaces cannula_datavalue_period_uniq (see migration 0012): unique indexes on a partitioned
+# table must hold the partition key, and no expressions. period_id stands in for the period columns,
+# so it must be NOT NULL: NULLs never conflict, and values without a period would go unchecked
+PARTITIONED_UNIQUE_INDEX = DATAVALUE_TABLE + '_period_part_uniq'
+PARTITIONED_CONFLICT_KEY = 'data_element_id, category_combo_id, org_unit_id, period_id, year'
+
+def partition_name(year):
+    return '%s_y%d' % (DATAVALUE_TABLE, int(year))
+
+def is_partitioned(cursor=None):
+    cursor = cursor or connection.cursor()
+    cursor.execute('SELECT COUNT(*) FROM pg_partitioned_table WHERE partrelid = %s::regclass', [DATAVALUE_TABLE])
+    return cursor.fetchone()[0] > 0
+
+def list_partitions(cursor=None):
+    """Return a list of (partition table name, partition bound) of the attached partitions"""
+    cursor = cursor or connection.cursor()
+    cursor.execute('''
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    ''', [DATAVALUE_TABLE])
+    return cursor.fetchall()
+
+def create_partition(year, cursor=None):
+    """Create (if missing) the partition for the values of a year"""
+    cursor = cursor or connection.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES IN ('%d')" % (partition_name(year), DATAVALUE_TABLE, int(year)))
+
+def detach_partition(year, cursor=None):
+    """Detach the partition of a year, its values stay in a table of their own (drop or archive it at leisure)"""
+    cursor = cursor or connection.cursor()
+    cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (DATAVALUE_TABLE, partition_name(year)))
+
+def attach_partition(year, table_name=None, cursor=None):
+    """(Re-)attach a table holding the values of a year, by default the one detach_partition() left behind"""
+    cursor = cursor or connection.cursor()
+    cursor.execute("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES IN ('%d')" % (DATAVALUE_TABLE, table_name or partition_name(year), int(year)))
+
+def convert_to_partitioned(cursor=None):
+    """
+    Rebuild cannula_datavalue as a table partitioned by year, with a partition
+    for every year it holds values for plus a default partition. The values
+    are copied over, so run it in a transaction, at a quiet time. Raises
+    ValueError if any value has no period
+    """
+    cursor = cursor or connection.cursor()
+    old_table = DATAVALUE_TABLE + '_unpartitioned'
+    fk_fields = [f for f in DataValue._meta.fields if f.is_relation]
+
+    cursor.execute('SELECT COUNT(*) FROM %s WHERE period_id IS NULL' % (DATAVALUE_TABLE,))
+    num_undated = cursor.fetchone()[0]
+    if num_undated:
+        raise ValueError('%d values of %s have no period, the unique index over period_id would not cover them' % (num_undated, DATAVALUE_TABLE))
+
+    cursor.execute('ALTER TABLE %s RENAME TO %s' % (DATAVALUE_TABLE, old_table))
+    cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY LIST (year)' % (DATAVALUE_TABLE, old_table))
+    cursor.execute('ALTER TABLE %s ALTER COLUMN period_id SET NOT NULL' % (DATAVALUE_TABLE,))
+    # the id sequence would go with the old table
+    cursor.execute('ALTER SEQUENCE %s_id_seq OWNED BY %s.id' % (DATAVALUE_TABLE, DATAVALUE_TABLE))
+
+    cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (DEFAULT_PARTITION, DATAVALUE_TABLE))
+    cursor.execute('SELECT DISTINCT year FROM %s WHERE year IS NOT NULL' % (old_table,))
+    for (year,) in cursor.fetchall():
+        create_partition(year, cursor)
+    cursor.execute('INSERT INTO %s SELECT * FROM %s' % (DATAVALUE_TABLE, old_table))
+    cursor.execute('DROP TABLE %s' % (old_table,))
+
+    # partitioned indexes, each partition gets its own copy
+    for column in ['id'] + [f.column for f in fk_fields]:
+        cursor.execute('CREATE INDEX %s_%s ON %s (%s)' % (DATAVALUE_TABLE, column, DATAVALUE_TABLE, column))
+    cursor.execute('CREATE UNIQUE INDEX %s ON %s (%s)' % (PARTITIONED_UNIQUE_INDEX, DATAVALUE_TABLE, PARTITIONED_CONFLICT_KEY))
+    for f in fk_fields:
+        cursor.execute('ALTER TABLE %s ADD FOREIGN KEY (%s) REFERENCES %s (%s) DEFERRABLE INITIALLY DEFERRED' % (
+            DATAVALUE_TABLE, f.column, f.rel.to._meta.db_table, f.rel.get_related_field().column
+        ))
@@ -0,0 +1,153 @@
+"""
+Vectorised evaluation of validation rules: the values of a period are loaded
+into an (org unit x data element) matrix once, and each rule's parsed
+expressions (see ruleexpr) are compiled into NumPy array operations over its
+columns, so a rule is checked for every org unit at once (see
+check_validation_rules(engine='NUMPY'))
+
+The matrix holds float64s, where the SQL engine works in numeric: sums of
+whole numbers, and of fractions like 0.5 or 0.25, are exact in both, but
+other fractional values (0.1, or a division such as x / 3 * 3) may round
+differently, and a comparison for equality of them can come out differently
+in the two engines
+"""
+from django.db import connection
+
+import logging
+logger = logging.getLogger(__name__)
+
+from decimal import Decimal
+
+import numpy as np
+
+from .models import RULE_OPERATORS, VALIDATION_VALUES_WHERE, validation_value_params
+
+MATRIX_SQL = '''
+SELECT dv.org_unit_id, dv.data_element_id, SUM(dv.numeric_value), COUNT(dv.numeric_value)
+FROM cannula_datavalue dv JOIN cannula_period p ON p.id = dv.period_id
+WHERE %s
+GROUP BY dv.org_unit_id, dv.data_element_id
+''' % (VALIDATION_VALUES_WHERE,)
+
+class PeriodMatrix():
+    """
+    The sums of some data elements for a period, one row per org unit that
+    reports any of them and one column per data element (0 where an org unit
+    does not report the data element, as in the SQL pivots), along with
+    whether each was reported
+    """
+
+    def __init__(self, org_unit_ids, de_ids, values, reported):
+        self.org_unit_ids = org_unit_ids
+        self.columns = {de_id: i for i, de_id in enumerate(de_ids)}
+        self.values = values
+        self.reported = reported
+
+    @classmethod
+    def load(cls, de_ids, period):
+        cursor = connection.cursor()
+        cursor.execute(MATRIX_SQL, validation_value_params(de_ids, period))
+        rows = cursor.fetchall()
+        org_unit_ids = np.array(sorted(set(row[0] for row in rows)), dtype=np.int64)
+        shape = (len(org_unit_ids), len(de_ids))
+        matrix = cls(org_unit_ids, de_ids, np.zeros(shape), np.zeros(shape, dtype=bool))
+        rows_index = {ou_id: i for i, ou_id in enumerate(org_unit_ids.tolist())}
+        for ou_id, de_id, numeric_sum, values_count in rows:
+            matrix.values[rows_index[ou_id], matrix.columns[de_id]] = numeric_sum
+            matrix.reported[rows_index[ou_id], matrix.columns[de_id]] = values_count > 0
+        return matrix
+
+    def column(self, de_id):
+        return self.values[:, self.columns[de_id]]
+
+def safe_divide(numerator, denominator):
+    """Element-wise division, NaN (undecided) where the denominator is 0 or either side is NaN"""
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+    quotient = np.full(numerator.shape, np.nan)
+    np.divide(numerator, denominator, out=quotient, where=(denominator != 0))
+    return quotient
+
+BINARY_OPS = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': safe_divide,
+}
+# exact, as in SQL: a relative tolerance would make large counts that differ by 1 equal
+# (see the module docstring for where float64 and numeric can still disagree)
+COMPARISONS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '=': np.equal,
+    '<>': np.not_equal,
+}
+
+def compile_node(node):
+    """Compile an expression AST node (see ruleexpr) into a function of a PeriodMatrix, returning a column (or a scalar)"""
+    kind = node[0]
+    if kind in BINARY_OPS:
+        op, left, right = BINARY_OPS[kind], compile_node(node[1]), compile_node(node[2])
+        return lambda matrix: op(left(matrix), right(matrix))
+    if kind == 'neg':
+        operand = compile_node(node[1])
+        return lambda matrix: np.negative(operand(matrix))
+    if kind == 'de':
+        de_id = node[1]
+        return lambda matrix: matrix.column(de_id)
+    if kind == 'num':
+        number = float(node[1])
+        return lambda matrix: number
+    raise ValueError('Unsupported in a rule expression: %r' % (node,))
+
+class CompiledRule():
+    def __init__(self, rule, data_elements):
+        self.rule = rule
+        self.de_ids = [de.id for de in data_elements]
+        left_ast, right_ast = rule.parsed_expressions()
+        self.left = compile_node(left_ast)
+        self.right = compile_node(right_ast)
+        self.compare = COMPARISONS[RULE_OPERATORS[rule.operator.strip()]]
+
+    def evaluate(self, matrix):
+        """
+        Return the left and right values, and whether the rule holds, for each
+        org unit of the matrix that reports any of the rule's data elements
+        (as a row index array). Rows where either side is NaN are undecided:
+        they neither hold nor fail
+        """
+        num_rows = len(matrix.org_unit_ids)
+        rows = np.flatnonzero(matrix.reported[:, [matrix.columns[de_id] for de_id in self.de_ids]].any(axis=1))
+        left = np.broadcast_to(np.asarray(self.left(matrix), dtype=float), (num_rows,))[rows]
+        right = np.broadcast_to(np.asarray(self.right(matrix), dtype=float), (num_rows,))[rows]
+        decided = ~(np.isnan(left) | np.isnan(right))
+        holds = np.ones(len(rows), dtype=bool)
+        holds[decided] = self.compare(left[decided], right[decided])
+        return rows, left, right, holds
+
+def compile_rules(checked_rules):
+    """CompiledRules of (rule, data elements) pairs (see models.checkable_rules()), skipping those that do not compile"""
+    compiled_rules = list()
+    for rule, data_elements in checked_rules:
+        try:
+            compiled_rules.append(CompiledRule(rule, data_elements))
+        except ValueError as e:
+            logger.warning('%s: cannot check %s (%s)', rule, rule.expression(), e)
+    return compiled_rules
+
+# ValidationViolation.left_value/right_value: max_digits=21, decimal_places=4
+MAX_VIOLATION_VALUE = 10**17
+
+def decimal_or_none(value):
+    """A violation's value as a Decimal, or None where it is NaN, infinite or too large to record"""
+    if not np.isfinite(value) or abs(value) >= MAX_VIOLATION_VALUE:
+        return None
+    return Decimal(repr(float(value))).quantize(Decimal('0.0001'))
+
+def find_violations(checked_rules, matrix):
+    """Generate (rule, org unit id, left value, right value) for each org unit a rule fails for"""
+    for compiled_rule in compile_rules(checked_rules):
+        rows, left, right, holds = compiled_rule.evaluate(matrix)
+        for i in np.flatnonzero(~holds):
+            yield compiled_rule.rule, int(matrix.org_unit_ids[rows[i]]), decimal_or_none(left[i]), decimal_or_none(right[i])
@@ -0,0 +1,158 @@
+"""
+Validation rule expressions: arithmetic (+ - * / and brackets) over numbers
+and data element names or aliases. An expression is parsed once into a small
+AST of nested tuples, which is stored on the rule (as JSON) and compiled to
+SQL (see to_sql()) or to array operations (see ruleeval):
+
+    ('de', <data element id>)
+    ('num', <number>)
+    ('neg', <node>)
+    (<'+', '-', '*' or '/'>, <left node>, <right node>)
+"""
+import re
+
+NUMBER_REGEX = re.compile(r'[0-9]+(\.[0-9]*)?|\.[0-9]+')
+OPERATOR_CHARS = '+-*/()'
+
+class NameMatcher():
+    """
+    Finds the longest of a set of names (ignoring case) starting at a
+    position of a text, without a regex alternation of all the names. Like
+    catmatch.CategoryMatcher, the names are kept in a trie
+
+    >>> m = NameMatcher([('IPT1', 1), ('ipt1 total', 2)])
+    >>> m.match_at('x+IPT1 Total', 2), m.match_at('x+IPT1 Tot', 2), m.match_at('x+IPT1 Tot', 0)
+    ((2, 12), (1, 6), None)
+
+    """
+
+    def __init__(self, names_values):
+        # trie of nested dicts keyed by upper-cased characters, the None key holds the value of the name ending there
+        self.trie = dict()
+        for name, value in names_values:
+            node = self.trie
+            for c in name:
+                node = node.setdefault(c.upper(), dict())
+            node.setdefault(None, value)
+
+    def match_at(self, text, pos):
+        """Return (value, end) of the longest name starting at pos, or None"""
+        node = self.trie
+        best = None
+        for i in range(pos, len(text)):
+            node = node.get(text[i].upper())
+            if node is None:
+                break
+            if None in node:
+                best = (node[None], i+1)
+        return best
+
+def tokenize(expr, matcher):
+    """Generate the (kind, value) tokens of an expression, data element names are matched before numbers"""
+    i, expr_len = 0, len(expr)
+    while i < expr_len:
+        if expr[i].isspace():
+            i += 1
+            continue
+        de_match = matcher.match_at(expr, i)
+        if de_match:
+            de_id, i = de_match
+            yield ('de', de_id)
+            continue
+        num_match = NUMBER_REGEX.match(expr, i)
+        if num_match:
+            num_str = num_match.group(0)
+            yield ('num', float(num_str) if '.' in num_str else int(num_str))
+            i = num_match.end()
+            continue
+        if expr[i] in OPERATOR_CHARS:
+            yield (expr[i], None)
+            i += 1
+            continue
+        raise ValueError('Unknown data element or symbol at %d: \'%s\'' % (i, expr[i:i+32]))
+
+def parse(expr, matcher):
+    """
+    Parse an expression into an AST, raising ValueError if it is not valid
+
+    >>> m = NameMatcher([('IPT1', 1), ('IPT1 Total', 2), ('105-2.1 A6:First dose IPT (IPT1)', 3)])
+    >>> parse('ipt1 total*100 / (IPT1 + 2)', m)
+    ('/', ('*', ('de', 2), ('num', 100)), ('+', ('de', 1), ('num', 2)))
+    >>> parse('-105-2.1 A6:First dose IPT (IPT1) - 1.5', m)
+    ('-', ('neg', ('de', 3)), ('num', 1.5))
+
+    """
+    tokens = list(tokenize(expr, matcher))
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def take(kind=None):
+        nonlocal pos
+        if pos >= len(tokens) or (kind and tokens[pos][0] != kind):
+            raise ValueError('Expected %s in \'%s\'' % (kind or 'more', expr))
+        pos += 1
+        return tokens[pos-1]
+
+    def expression():
+        node = term()
+        while peek() in ('+', '-'):
+            node = (take()[0], node, term())
+        return node
+
+    def term():
+        node = factor()
+        while peek() in ('*', '/'):
+            node = (take()[0], node, factor())
+        return node
+
+    def factor():
+        kind = peek()
+        if kind == '-':
+            take()
+            return ('neg', factor())
+        if kind == '+':
+            take()
+            return factor()
+        if kind == '(':
+            take()
+            node = expression()
+            take(')')
+            return node
+        if kind in ('de', 'num'):
+            return take()
+        raise ValueError('Expected a data element, number or \'(\' in \'%s\'' % (expr,))
+
+    node = expression()
+    if pos != len(tokens):
+        raise ValueError('Unexpected \'%s\' in \'%s\'' % (tokens[pos][0], expr))
+    return node
+
+def data_element_ids(node):
+    """The ids of the data elements an AST refers to"""
+    if node[0] == 'de':
+        return {node[1]}
+    if node[0] == 'num':
+        return set()
+    return set().union(*(data_element_ids(child) for child in node[1:]))
+
+def to_sql(node):
+    """
+    SQL for an AST, over DE_<id> columns. A division by zero gives NULL (the
+    rule is undecided) rather than an error
+
+    >>> to_sql(('/', ('*', ('de', 2), ('num', 100)), ('neg', ('de', 1))))
+    '((DE_2 * 100.0) / NULLIF((-DE_1), 0))'
+
+    """
+    kind = node[0]
+    if kind == 'de':
+        return 'DE_%d' % (node[1],)
+    if kind == 'num':
+        return repr(float(node[1])) # numeric rather than integer arithmetic
+    if kind == 'neg':
+        return '(-%s)' % (to_sql(node[1]),)
+    if kind == '/':
+        return '(%s / NULLIF(%s, 0))' % (to_sql(node[1]), to_sql(node[2]))
+    return '(%s %s %s)' % (to_sql(node[1]), kind, to_sql(node[2]))
@@ -0,0 +1,87 @@
+"""
+Synthetic HMIS-shaped workbooks, for measuring ingestion speed
+"""
+import calendar
+import random
+from collections import namedtuple
+
+from . import grabbag
+
+WorkbookShape = namedtuple('WorkbookShape', ['districts', 'subcounties', 'facilities', 'months', 'data_elements', 'sheets', 'fill_ratio'])
+# per district / per subcounty counts, roughly those of the RHITES-EC region
+DEFAULT_SHAPE = WorkbookShape(districts=11, subcounties=12, facilities=6, months=3, data_elements=20, sheets=1, fill_ratio=0.6)
+
+HMIS_FORMS = ('105-1.3 OPD', '105-2.1 ANC', '105-4 HCT', '105-5 VMMC', '105-7.3 Lab', '106a Cohort')
+FACILITY_LEVELS = ('HC II', 'HC III', 'HC IV', 'Hospital')
+# disaggregations the way they appear together in HMIS data element names
+SEXES = ('Male', 'Female')
+AGE_GROUP_SETS = (
+    ('18 Mths-<5 Years', '5-<10 Years', '10-<15 Years', '15-<19 Years', '19-<49 Years', '>49 Years'),
+    ('0-28 Days', '29 Days-4 Years', '5-59 Years', '60andAbove Years'),
+    ('<15', '15+'),
+    (),
+)
+
+def make_location_paths(shape):
+    """Return a list of (district, subcounty, facility) name tuples"""
+    paths = list()
+    for _ in range(shape.districts):
+        district = '%s District' % (grabbag.make_random_code(6),)
+        for _ in range(shape.subcounties):
+            subcounty = '%s Subcounty' % (grabbag.make_random_code(6),)
+            for (first_name, last_name) in grabbag.gen_random_names(shape.facilities):
+                facility = '%s %s %s' % (last_name, grabbag.make_random_code(4), random.choice(FACILITY_LEVELS))
+                paths.append((district, subcounty, facility))
+    return paths
+
+def make_data_element_headers(num_data_elements):
+    """Return a list of data element column headers (without the month prefix), several per data element"""
+    headers = list()
+    for i in range(num_data_elements):
+        de_name = '%s %s %s' % (random.choice(HMIS_FORMS), grabbag.make_random_code(4), 'Number of Individuals' if i % 2 else 'Total')
+        age_groups = random.choice(AGE_GROUP_SETS)
+        if age_groups:
+            headers.extend('%s %s, %s' % (de_name, sex, age) for sex in SEXES for age in age_groups)
+        else:
+            headers.append(de_name)
+    return headers
+
+def make_periods(num_months, year=2017):
+    return ['%s %d' % (calendar.month_abbr[(m % 12) + 1], year + m // 12) for m in range(num_months)]
+
+def cell_value(fill_ratio):
+    if random.random() >= fill_ratio:
+        return random.choice((None, '', ' ')) # empty cells come in more than one form
+    return random.randint(0, 500)
+
+def make_synthetic_workbook(file_path, shape=DEFAULT_SHAPE, seed=0):
+    """
+    Write a workbook laid out like a DHIS2 pivot table export (period,
+    district, subcounty and facility columns, then one column per data
+    element/disaggregation) to file_path. The data element columns are split
+    between shape.sheets worksheets and a fill_ratio share of the value cells
+    hold a number. Returns the number of non-empty values written
+    """
+    import openpyxl
+
+    random.seed(seed)
+    location_paths = make_location_paths(shape)
+    headers = make_data_element_headers(shape.data_elements)
+    periods = make_periods(shape.months)
+    first_month = periods[0].split()[0]
+    month_name = calendar.month_name[list(calendar.month_abbr).index(first_month)]
+
+    wb = openpyxl.Workbook(write_only=True)
+    num_values = 0
+    sheet_size = -(-len(headers) // shape.sheets) # ceiling division
+    for sheet_num in range(shape.sheets):
+        sheet_headers = headers[sheet_num*sheet_size:(sheet_num+1)*sheet_size]
+        ws = wb.create_sheet(title='Step%d' % (sheet_num+1,))
+        ws.append(['Period', 'District', 'Subcounty', 'Facility'] + ['%s %s' % (month_name, h) for h in sheet_headers])
+        for period in periods:
+            for location_path in location_paths:
+                values = [cell_value(shape.fill_ratio) for _ in sheet_headers]
+                num_values += sum(1 for v in values if isinstance(v, int))
+                ws.append([period] + list(location_path) + values)
+    wb.save(file_path)
+    return num_values
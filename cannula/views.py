@@ -14,7 +14,7 @@ from itertools import groupby, tee, chain, product
 from . import dateutil, grabbag
 from .grabbag import default_zero, all_not_none
 
-from .models import DataElement, OrgUnit, DataValue, ValidationRule, SourceDocument
+from .models import DataElement, CategoryCombo, OrgUnit, DataValue, AggregateValue, ValidationRule, SourceDocument, IngestionJob
 from .forms import SourceDocumentForm, DataElementAliasForm
 
 @login_required
@@ -61,15 +61,15 @@ def ipt_quarterly(request, output_format='HTML'):
     period_desc = dateutil.DateSpan.fromquarter(filter_period).format()
 
     # get IPT1 and IPT2 without subcategory disaggregation
-    qs = DataValue.objects.what(*ipt_de_names).filter(quarter=filter_period)
+    qs = AggregateValue.objects.what(*ipt_de_names).when(filter_period).filter(org_unit__level=2)
     # use clearer aliases for the unwieldy names
-    qs = qs.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'))
-    qs = qs.annotate(period=F('quarter')) # TODO: review if this can still work with different periods
-    qs = qs.order_by('district', 'subcounty', 'de_name', 'period')
-    val_dicts = qs.values('district', 'subcounty', 'de_name', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs = qs.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'))
+    qs = qs.annotate(iso_period=F('period__iso'))
+    qs = qs.order_by('district', 'subcounty', 'de_name', 'iso_period')
+    val_dicts = qs.values('district', 'subcounty', 'de_name', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     
     # all subcounties (or equivalent)
-    qs_ou = OrgUnit.objects.filter(level=2).annotate(district=F('parent__name'), subcounty=F('name'))
+    qs_ou = OrgUnit.objects.filter(level=2).annotate(district=F('district_name'), subcounty=F('subcounty_name'))
     ou_list = qs_ou.values_list('district', 'subcounty')
 
     def val_fun(row, col):
@@ -82,13 +82,13 @@ def ipt_quarterly(request, output_format='HTML'):
     subcategory_names = tuple(qs_ipt_subcat)
 
     # get IPT2 with subcategory disaggregation
-    qs2 = DataValue.objects.what('105-2.1 A7:Second dose IPT (IPT2)').filter(quarter=filter_period)
+    qs2 = AggregateValue.objects.what('105-2.1 A7:Second dose IPT (IPT2)').when(filter_period).filter(org_unit__level=2)
     # use clearer aliases for the unwieldy names
-    qs2 = qs2.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'))
-    qs2 = qs2.annotate(period=F('quarter')) # TODO: review if this can still work with different periods
+    qs2 = qs2.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'))
+    qs2 = qs2.annotate(iso_period=F('period__iso'))
     qs2 = qs2.annotate(cat_combo=F('category_combo__name'))
-    qs2 = qs2.order_by('district', 'subcounty', 'de_name', 'period', 'cat_combo')
-    val_dicts2 = qs2.values('district', 'subcounty', 'de_name', 'period', 'cat_combo').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs2 = qs2.order_by('district', 'subcounty', 'de_name', 'iso_period', 'cat_combo')
+    val_dicts2 = qs2.values('district', 'subcounty', 'de_name', 'iso_period', 'cat_combo').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     def val_with_subcat_fun(row, col):
         district, subcounty = row
@@ -98,12 +98,12 @@ def ipt_quarterly(request, output_format='HTML'):
     val_dicts2 = list(gen_raster)
 
     # get expected pregnancies
-    qs3 = DataValue.objects.what('Expected Pregnancies')
+    qs3 = AggregateValue.objects.what('Expected Pregnancies').filter(period__period_type='YEAR', org_unit__level=2)
     # use clearer aliases for the unwieldy names
-    qs3 = qs3.annotate(district=F('org_unit__parent__name'), subcounty=F('org_unit__name'))
-    qs3 = qs3.annotate(period=F('year')) # TODO: review if this can still work with different periods
-    qs3 = qs3.order_by('district', 'subcounty', 'de_name', 'period')
-    val_dicts3 = qs3.values('district', 'subcounty', 'de_name', 'period').annotate(numeric_sum=(Sum('numeric_value')/4))
+    qs3 = qs3.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'))
+    qs3 = qs3.annotate(iso_period=F('period__iso'))
+    qs3 = qs3.order_by('district', 'subcounty', 'de_name', 'iso_period')
+    val_dicts3 = qs3.values('district', 'subcounty', 'de_name', 'iso_period').annotate(numeric_sum=(Sum('numeric_sum')/4))
 
     gen_raster = grabbag.rasterize(ou_list, ('Expected Pregnancies',), val_dicts3, lambda x: (x['district'], x['subcounty']), lambda x: x['de_name'], val_fun)
     val_dicts3 = list(gen_raster)
@@ -216,7 +216,7 @@ def malaria_compliance(request):
     this_year = this_day.year
     PREV_5YR_QTRS = ['%d-Q%d' % (y, q) for y in range(this_year, this_year-6, -1) for q in range(4, 0, -1)]
 
-    if 'start_period' in request.GET and request.GET['start_period'] in PREV_5YR_QTRS and 'end_period' in request.GET and request.GET['end_period']:
+    if 'start_period' in request.GET and request.GET['start_period'] in PREV_5YR_QTRS and 'end_period' in request.GET and request.GET['end_period'] in PREV_5YR_QTRS:
         start_quarter = request.GET['start_period']
         end_quarter = request.GET['end_period']
     else: # default to "immediate preceding quarter" and "this quarter"
@@ -236,23 +236,23 @@ def malaria_compliance(request):
         periods = periods[:1]
     
     # all facilities (or equivalent)
-    qs_ou = OrgUnit.objects.filter(level=3).annotate(district=F('parent__parent__name'), subcounty=F('parent__name'), facility=F('name'))
+    qs_ou = OrgUnit.objects.filter(level=3).annotate(district=F('district_name'), subcounty=F('subcounty_name'), facility=F('name'))
     ou_list = qs_ou.values_list('district', 'subcounty', 'facility')
 
     # get data values without subcategory disaggregation
-    qs = DataValue.objects.what(*cases_de_names)
-    qs = qs.filter(quarter__gte=start_quarter).filter(quarter__lte=end_quarter)
+    qs = AggregateValue.objects.what(*cases_de_names)
+    qs = qs.when(start_quarter, end_quarter).filter(org_unit__level=3)
     # use clearer aliases for the unwieldy names
-    qs = qs.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs = qs.annotate(period=F('quarter')) # TODO: review if this can still work with different periods
-    qs = qs.order_by('district', 'subcounty', 'facility', 'de_name', 'period')
-    val_dicts = qs.values('district', 'subcounty', 'facility', 'de_name', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs = qs.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs = qs.annotate(iso_period=F('period__iso'))
+    qs = qs.order_by('district', 'subcounty', 'facility', 'de_name', 'iso_period')
+    val_dicts = qs.values('district', 'subcounty', 'facility', 'de_name', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     def val_with_period_fun(row, col):
         district, subcounty, facility = row
         de_name, period = col
-        return { 'district': district, 'subcounty': subcounty, 'facility': facility, 'period': period, 'de_name': de_name, 'numeric_sum': None }
-    gen_raster = grabbag.rasterize(ou_list, tuple(product(cases_de_names, periods)), val_dicts, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['period']), val_with_period_fun)
+        return { 'district': district, 'subcounty': subcounty, 'facility': facility, 'iso_period': period, 'de_name': de_name, 'numeric_sum': None }
+    gen_raster = grabbag.rasterize(ou_list, tuple(product(cases_de_names, periods)), val_dicts, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['iso_period']), val_with_period_fun)
     val_dicts = gen_raster
 
     # combine the data and group by district and subcounty
@@ -265,9 +265,9 @@ def malaria_compliance(request):
         malaria_totals = dict()
         for val in other_vals:
             if val['de_name'] == cases_de_names[0]:
-                malaria_totals[val['period']] = val['numeric_sum']
+                malaria_totals[val['iso_period']] = val['numeric_sum']
             elif val['de_name'] == cases_de_names[1]:
-                total_cases = malaria_totals.get(val['period'], 0)
+                total_cases = malaria_totals.get(val['iso_period'], 0)
                 confirmed_cases = val['numeric_sum']
                 if confirmed_cases and total_cases and total_cases != 0:
                     confirmed_rate = confirmed_cases * 100 / total_cases
@@ -309,26 +309,30 @@ def data_workflow_new(request):
 
 @login_required
 def data_workflow_detail(request):
-    from .models import load_excel_to_datavalues, load_excel_to_validations
+    from .ingest import LOAD_METHODS
 
     if 'wf_id' in request.GET:
         src_doc_id = int(request.GET['wf_id'])
         src_doc = get_object_or_404(SourceDocument, id=src_doc_id)
 
         if request.method == 'POST':
+            # loading runs in the ingestion worker (manage.py ingestion_worker), not in this request
             if 'load_values' in request.POST:
-                all_values = load_excel_to_datavalues(src_doc)
-                for site_name, site_vals in all_values.items():
-                    DataValue.objects.bulk_create(site_vals)
+                load_method = request.POST.get('load_method', 'ORM')
+                if load_method not in dict(LOAD_METHODS):
+                    load_method = 'ORM'
+                IngestionJob.objects.create(source_doc=src_doc, job_type='VALUES', load_method=load_method)
             elif 'load_validations' in request.POST:
-                load_excel_to_validations(src_doc)
+                IngestionJob.objects.create(source_doc=src_doc, job_type='VALIDATIONS')
 
-            #TODO: redirect with to detail page?
+            return redirect('%s?wf_id=%d' % (reverse('data_workflow_detail'), src_doc_id))
 
         qs_vals = DataValue.objects.filter(source_doc__id=src_doc_id).values('id')
         doc_elements = DataElement.objects.filter(data_values__id__in=qs_vals).distinct('id')
         doc_rules = ValidationRule.objects.filter(data_elements__data_values__id__in=qs_vals).distinct('id')
         num_values = qs_vals.count()
+        doc_jobs = list(src_doc.ingestion_jobs.all()[:5])
+        timed_job = next((job for job in doc_jobs if job.stage_timings), None)
     else:
         raise Http404("Workflow does not exist or workflow id is missing/invalid")
 
@@ -337,10 +341,35 @@ def data_workflow_detail(request):
         'num_values': num_values,
         'data_elements': doc_elements,
         'validation_rules': doc_rules,
+        'load_methods': LOAD_METHODS,
+        'jobs': doc_jobs,
+        'jobs_pending': any(not job.is_finished() for job in doc_jobs),
+        'timed_job': timed_job,
+        'job_timings': timed_job.timings() if timed_job else [],
     }
 
     return render(request, 'cannula/data_workflow_detail.html', context)
 
+@login_required
+def ingestion_job_status(request):
+    from django.http import JsonResponse
+
+    job = get_object_or_404(IngestionJob, id=int(request.GET.get('job_id', 0)))
+    job_status = {
+        'id': job.id,
+        'job_type': job.job_type,
+        'load_method': job.load_method,
+        'state': job.state,
+        'finished': job.is_finished(),
+        'rows_processed': job.rows_processed,
+        'num_inserted': job.num_inserted,
+        'num_updated': job.num_updated,
+        'num_unchanged': job.num_unchanged,
+        'rows_per_second': job.rows_per_second,
+        'error': job.error,
+    }
+    return JsonResponse(job_status)
+
 @login_required
 def data_workflow_listing(request):
     # TODO: filter based on user who uploaded file?
@@ -366,7 +395,7 @@ def validation_rule(request):
     cursor = connection.cursor()
     vr_id = int(request.GET['id'])
     vr = ValidationRule.objects.get(id=vr_id)
-    cursor.execute('SELECT * FROM %s' % (vr.view_name(),))
+    cursor.execute('SELECT * FROM %s' % (vr.results_view_name(),)) # precomputed, see ValidationRule.refresh_results()
     columns = [col[0] for col in cursor.description]
     de_name_map = dict()
     for de_id, de_name in DataElement.objects.all().values_list('id', 'name'):
@@ -438,29 +467,27 @@ def hts_by_site(request):
     subcategory_names = ['(<15, Female)', '(<15, Male)', '(15+, Female)', '(15+, Male)']
     de_positivity_meta = list(product(hts_de_names, subcategory_names))
 
-    qs_positivity = DataValue.objects.what(*hts_de_names).filter(quarter=filter_period)
+    qs_positivity = AggregateValue.objects.what(*hts_de_names).when(filter_period).filter(org_unit__level=3)
 
-    cc_lt_15 = ['18 Mths-<5 Years', '5-<10 Years', '10-<15 Years']
-    cc_ge_15 = ['15-<19 Years', '19-<49 Years', '>49 Years']
-    #TODO: cc_lt_15_f = CategoryCombo.from_cat_names(['Female', '<15']) gives a CategoryCombo instance that makes the Case statement clearer/safer
+    # classify by the (precomputed) attributes of the category combos
+    qs_positivity = qs_positivity.exclude(category_combo__age_band=None)
     qs_positivity = qs_positivity.annotate(
         cat_combo=Case(
-            When(Q(category_combo__categories__name__in=cc_lt_15) & Q(category_combo__name__contains='Female'), then=Value(subcategory_names[0])),
-            When(Q(category_combo__categories__name__in=cc_lt_15) & ~Q(category_combo__name__contains='Female'), then=Value(subcategory_names[1])),
-            When(Q(category_combo__categories__name__in=cc_ge_15) & Q(category_combo__name__contains='Female'), then=Value(subcategory_names[2])),
-            When(Q(category_combo__categories__name__in=cc_ge_15) & ~Q(category_combo__name__contains='Female'), then=Value(subcategory_names[3])),
+            When(Q(category_combo__age_band=CategoryCombo.UNDER_15) & Q(category_combo__sex=CategoryCombo.FEMALE), then=Value(subcategory_names[0])),
+            When(Q(category_combo__age_band=CategoryCombo.UNDER_15) & ~Q(category_combo__sex=CategoryCombo.FEMALE), then=Value(subcategory_names[1])),
+            When(Q(category_combo__age_band=CategoryCombo.FROM_15) & Q(category_combo__sex=CategoryCombo.FEMALE), then=Value(subcategory_names[2])),
+            When(Q(category_combo__age_band=CategoryCombo.FROM_15) & ~Q(category_combo__sex=CategoryCombo.FEMALE), then=Value(subcategory_names[3])),
             default=None, output_field=CharField()
         )
     )
-    qs_positivity = qs_positivity.exclude(cat_combo__iexact=None)
 
-    qs_positivity = qs_positivity.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_positivity = qs_positivity.annotate(period=F('quarter'))
-    qs_positivity = qs_positivity.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_positivity = qs_positivity.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_positivity = qs_positivity.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_positivity = qs_positivity.annotate(iso_period=F('period__iso'))
+    qs_positivity = qs_positivity.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_positivity = qs_positivity.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     
     # # all facilities (or equivalent)
-    qs_ou = OrgUnit.objects.filter(level=3).annotate(district=F('parent__parent__name'), subcounty=F('parent__name'), facility=F('name'))
+    qs_ou = OrgUnit.objects.filter(level=3).annotate(district=F('district_name'), subcounty=F('subcounty_name'), facility=F('name'))
     ou_list = list(qs_ou.values_list('district', 'subcounty', 'facility'))
 
     def val_with_subcat_fun(row, col):
@@ -477,14 +504,14 @@ def hts_by_site(request):
     )
     de_pmtct_mother_meta = list(product(('Pregnant Women tested for HIV',), (None,)))
 
-    qs_pmtct_mother = DataValue.objects.what(*pmtct_mother_de_names).filter(quarter=filter_period)
+    qs_pmtct_mother = AggregateValue.objects.what(*pmtct_mother_de_names).when(filter_period).filter(org_unit__level=3)
     qs_pmtct_mother = qs_pmtct_mother.annotate(de_name=Value('Pregnant Women tested for HIV', output_field=CharField()))
     qs_pmtct_mother = qs_pmtct_mother.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_pmtct_mother = qs_pmtct_mother.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_pmtct_mother = qs_pmtct_mother.annotate(period=F('quarter'))
-    qs_pmtct_mother = qs_pmtct_mother.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_pmtct_mother = qs_pmtct_mother.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_pmtct_mother = qs_pmtct_mother.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_pmtct_mother = qs_pmtct_mother.annotate(iso_period=F('period__iso'))
+    qs_pmtct_mother = qs_pmtct_mother.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_pmtct_mother = qs_pmtct_mother.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_pmtct_mother_meta, val_pmtct_mother, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_pmtct_mother2 = list(gen_raster)
@@ -498,14 +525,14 @@ def hts_by_site(request):
     )
     de_pmtct_mother_pos_meta = list(product(('Pregnant Women testing HIV+',), (None,)))
 
-    qs_pmtct_mother_pos = DataValue.objects.what(*pmtct_mother_pos_de_names).filter(quarter=filter_period)
+    qs_pmtct_mother_pos = AggregateValue.objects.what(*pmtct_mother_pos_de_names).when(filter_period).filter(org_unit__level=3)
     qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(de_name=Value('Pregnant Women testing HIV+', output_field=CharField()))
     qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(period=F('quarter'))
-    qs_pmtct_mother_pos = qs_pmtct_mother_pos.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_pmtct_mother_pos = qs_pmtct_mother_pos.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(iso_period=F('period__iso'))
+    qs_pmtct_mother_pos = qs_pmtct_mother_pos.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_pmtct_mother_pos = qs_pmtct_mother_pos.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_pmtct_mother_pos_meta, val_pmtct_mother_pos, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_pmtct_mother_pos2 = list(gen_raster)
@@ -526,13 +553,13 @@ def hts_by_site(request):
     )
     de_pmtct_child_meta = list(product(pmtct_child_de_names, (None,)))
 
-    qs_pmtct_child = DataValue.objects.what(*pmtct_child_de_names).filter(quarter=filter_period)
+    qs_pmtct_child = AggregateValue.objects.what(*pmtct_child_de_names).when(filter_period).filter(org_unit__level=3)
     qs_pmtct_child = qs_pmtct_child.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_pmtct_child = qs_pmtct_child.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_pmtct_child = qs_pmtct_child.annotate(period=F('quarter'))
-    qs_pmtct_child = qs_pmtct_child.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_pmtct_child = qs_pmtct_child.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_pmtct_child = qs_pmtct_child.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_pmtct_child = qs_pmtct_child.annotate(iso_period=F('period__iso'))
+    qs_pmtct_child = qs_pmtct_child.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_pmtct_child = qs_pmtct_child.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_pmtct_child = list(val_pmtct_child)
 
     gen_raster = grabbag.rasterize(ou_list, de_pmtct_child_meta, val_pmtct_child, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -545,13 +572,13 @@ def hts_by_site(request):
     de_target_meta = list(product(target_de_names, subcategory_names))
 
     # targets are annual, so filter by year component of period and divide result by 4 to get quarter
-    qs_target = DataValue.objects.what(*target_de_names).filter(year=filter_period[:4])
+    qs_target = AggregateValue.objects.what(*target_de_names).when(filter_period[:4]).filter(org_unit__level=3)
 
     qs_target = qs_target.annotate(cat_combo=F('category_combo__name'))
-    qs_target = qs_target.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_target = qs_target.annotate(period=F('quarter'))
-    qs_target = qs_target.order_by('district', 'subcounty', 'facility', '-de_name', 'cat_combo', 'period') # note reversed order of data element names
-    val_target = qs_target.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value')/4)
+    qs_target = qs_target.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_target = qs_target.annotate(iso_period=F('period__iso'))
+    qs_target = qs_target.order_by('district', 'subcounty', 'facility', '-de_name', 'cat_combo', 'iso_period') # note reversed order of data element names
+    val_target = qs_target.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum')/4)
 
     gen_raster = grabbag.rasterize(ou_list, de_target_meta, val_target, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_target2 = list(gen_raster)
@@ -910,30 +937,28 @@ def hts_by_district(request):
     subcategory_names = ['(<15, Female)', '(<15, Male)', '(15+, Female)', '(15+, Male)']
     de_positivity_meta = list(product(hts_de_names, subcategory_names))
 
-    qs_positivity = DataValue.objects.what(*hts_de_names).filter(year=filter_period)
+    qs_positivity = AggregateValue.objects.what(*hts_de_names).when(filter_period).filter(org_unit__level=1)
 
-    cc_lt_15 = ['18 Mths-<5 Years', '5-<10 Years', '10-<15 Years']
-    cc_ge_15 = ['15-<19 Years', '19-<49 Years', '>49 Years']
-    #TODO: cc_lt_15_f = CategoryCombo.from_cat_names(['Female', '<15']) gives a CategoryCombo instance that makes the Case statement clearer/safer
+    # classify by the (precomputed) attributes of the category combos
+    qs_positivity = qs_positivity.exclude(category_combo__age_band=None)
     qs_positivity = qs_positivity.annotate(
         cat_combo=Case(
-            When(Q(category_combo__categories__name__in=cc_lt_15) & Q(category_combo__name__contains='Female'), then=Value(subcategory_names[0])),
-            When(Q(category_combo__categories__name__in=cc_lt_15) & ~Q(category_combo__name__contains='Female'), then=Value(subcategory_names[1])),
-            When(Q(category_combo__categories__name__in=cc_ge_15) & Q(category_combo__name__contains='Female'), then=Value(subcategory_names[2])),
-            When(Q(category_combo__categories__name__in=cc_ge_15) & ~Q(category_combo__name__contains='Female'), then=Value(subcategory_names[3])),
+            When(Q(category_combo__age_band=CategoryCombo.UNDER_15) & Q(category_combo__sex=CategoryCombo.FEMALE), then=Value(subcategory_names[0])),
+            When(Q(category_combo__age_band=CategoryCombo.UNDER_15) & ~Q(category_combo__sex=CategoryCombo.FEMALE), then=Value(subcategory_names[1])),
+            When(Q(category_combo__age_band=CategoryCombo.FROM_15) & Q(category_combo__sex=CategoryCombo.FEMALE), then=Value(subcategory_names[2])),
+            When(Q(category_combo__age_band=CategoryCombo.FROM_15) & ~Q(category_combo__sex=CategoryCombo.FEMALE), then=Value(subcategory_names[3])),
             default=None, output_field=CharField()
         )
     )
-    qs_positivity = qs_positivity.exclude(cat_combo__iexact=None)
 
-    qs_positivity = qs_positivity.annotate(district=F('org_unit__parent__parent__name'))
-    qs_positivity = qs_positivity.annotate(period=F('year'))
-    qs_positivity = qs_positivity.order_by('district', 'de_name', 'cat_combo', 'period')
-    val_positivity = qs_positivity.values('district', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_positivity = qs_positivity.annotate(district=F('org_unit__district_name'))
+    qs_positivity = qs_positivity.annotate(iso_period=F('period__iso'))
+    qs_positivity = qs_positivity.order_by('district', 'de_name', 'cat_combo', 'iso_period')
+    val_positivity = qs_positivity.values('district', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_positivity = list(val_positivity)
     
     # all districts (or equivalent)
-    qs_ou = OrgUnit.objects.filter(level=1).annotate(district=F('name'))
+    qs_ou = OrgUnit.objects.filter(level=1).annotate(district=F('district_name'))
     ou_list = list(v for v in qs_ou.values_list('district'))
 
     def val_with_subcat_fun(row, col):
@@ -950,14 +975,14 @@ def hts_by_district(request):
     )
     de_pmtct_mother_meta = list(product(('Pregnant Women tested for HIV',), (None,)))
 
-    qs_pmtct_mother = DataValue.objects.what(*pmtct_mother_de_names).filter(year=filter_period)
+    qs_pmtct_mother = AggregateValue.objects.what(*pmtct_mother_de_names).when(filter_period).filter(org_unit__level=1)
     qs_pmtct_mother = qs_pmtct_mother.annotate(de_name=Value('Pregnant Women tested for HIV', output_field=CharField()))
     qs_pmtct_mother = qs_pmtct_mother.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_pmtct_mother = qs_pmtct_mother.annotate(district=F('org_unit__parent__parent__name'))
-    qs_pmtct_mother = qs_pmtct_mother.annotate(period=F('year'))
-    qs_pmtct_mother = qs_pmtct_mother.order_by('district', 'de_name', 'cat_combo', 'period')
-    val_pmtct_mother = qs_pmtct_mother.values('district', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_pmtct_mother = qs_pmtct_mother.annotate(district=F('org_unit__district_name'))
+    qs_pmtct_mother = qs_pmtct_mother.annotate(iso_period=F('period__iso'))
+    qs_pmtct_mother = qs_pmtct_mother.order_by('district', 'de_name', 'cat_combo', 'iso_period')
+    val_pmtct_mother = qs_pmtct_mother.values('district', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_pmtct_mother_meta, val_pmtct_mother, lambda x: (x['district'],), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_pmtct_mother2 = list(gen_raster)
@@ -971,14 +996,14 @@ def hts_by_district(request):
     )
     de_pmtct_mother_pos_meta = list(product(('Pregnant Women testing HIV+',), (None,)))
 
-    qs_pmtct_mother_pos = DataValue.objects.what(*pmtct_mother_pos_de_names).filter(year=filter_period)
+    qs_pmtct_mother_pos = AggregateValue.objects.what(*pmtct_mother_pos_de_names).when(filter_period).filter(org_unit__level=1)
     qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(de_name=Value('Pregnant Women testing HIV+', output_field=CharField()))
     qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(district=F('org_unit__parent__parent__name'))
-    qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(period=F('year'))
-    qs_pmtct_mother_pos = qs_pmtct_mother_pos.order_by('district', 'de_name', 'cat_combo', 'period')
-    val_pmtct_mother_pos = qs_pmtct_mother_pos.values('district', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(district=F('org_unit__district_name'))
+    qs_pmtct_mother_pos = qs_pmtct_mother_pos.annotate(iso_period=F('period__iso'))
+    qs_pmtct_mother_pos = qs_pmtct_mother_pos.order_by('district', 'de_name', 'cat_combo', 'iso_period')
+    val_pmtct_mother_pos = qs_pmtct_mother_pos.values('district', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_pmtct_mother_pos_meta, val_pmtct_mother_pos, lambda x: (x['district'],), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_pmtct_mother_pos2 = list(gen_raster)
@@ -999,13 +1024,13 @@ def hts_by_district(request):
     )
     de_pmtct_child_meta = list(product(pmtct_child_de_names, (None,)))
 
-    qs_pmtct_child = DataValue.objects.what(*pmtct_child_de_names).filter(year=filter_period)
+    qs_pmtct_child = AggregateValue.objects.what(*pmtct_child_de_names).when(filter_period).filter(org_unit__level=1)
     qs_pmtct_child = qs_pmtct_child.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_pmtct_child = qs_pmtct_child.annotate(district=F('org_unit__parent__parent__name'))
-    qs_pmtct_child = qs_pmtct_child.annotate(period=F('year'))
-    qs_pmtct_child = qs_pmtct_child.order_by('district', 'de_name', 'cat_combo', 'period')
-    val_pmtct_child = qs_pmtct_child.values('district', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_pmtct_child = qs_pmtct_child.annotate(district=F('org_unit__district_name'))
+    qs_pmtct_child = qs_pmtct_child.annotate(iso_period=F('period__iso'))
+    qs_pmtct_child = qs_pmtct_child.order_by('district', 'de_name', 'cat_combo', 'iso_period')
+    val_pmtct_child = qs_pmtct_child.values('district', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_pmtct_child_meta, val_pmtct_child, lambda x: (x['district'],), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_pmtct_child2 = list(gen_raster)
@@ -1017,13 +1042,13 @@ def hts_by_district(request):
     de_target_meta = list(product(target_de_names, subcategory_names))
 
     # targets are annual, so filter by year component of period
-    qs_target = DataValue.objects.what(*target_de_names).filter(year=filter_period[:4])
+    qs_target = AggregateValue.objects.what(*target_de_names).when(filter_period[:4]).filter(org_unit__level=1)
 
     qs_target = qs_target.annotate(cat_combo=F('category_combo__name'))
-    qs_target = qs_target.annotate(district=F('org_unit__parent__parent__name'))
-    qs_target = qs_target.annotate(period=F('year'))
-    qs_target = qs_target.order_by('district', '-de_name', 'cat_combo', 'period') # note reversed order of data element names
-    val_target = qs_target.values('district', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_target = qs_target.annotate(district=F('org_unit__district_name'))
+    qs_target = qs_target.annotate(iso_period=F('period__iso'))
+    qs_target = qs_target.order_by('district', '-de_name', 'cat_combo', 'iso_period') # note reversed order of data element names
+    val_target = qs_target.values('district', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_target = list(val_target)
 
     gen_raster = grabbag.rasterize(ou_list, de_target_meta, val_target, lambda x: (x['district'],), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1328,7 +1353,7 @@ def vmmc_by_site(request):
     period_desc = dateutil.DateSpan.fromquarter(filter_period).format()
 
     # # all facilities (or equivalent)
-    qs_ou = OrgUnit.objects.filter(level=3).annotate(district=F('parent__parent__name'), subcounty=F('parent__name'), facility=F('name'))
+    qs_ou = OrgUnit.objects.filter(level=3).annotate(district=F('district_name'), subcounty=F('subcounty_name'), facility=F('name'))
     ou_list = list(qs_ou.values_list('district', 'subcounty', 'facility'))
 
     def val_with_subcat_fun(row, col):
@@ -1348,13 +1373,13 @@ def vmmc_by_site(request):
     )
     de_targets_meta = list(product(targets_de_names, (None,)))
 
-    qs_targets = DataValue.objects.what(*targets_de_names).filter(quarter=filter_period)
+    qs_targets = AggregateValue.objects.what(*targets_de_names).when(filter_period).filter(org_unit__level=3)
     qs_targets = qs_targets.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_targets = qs_targets.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_targets = qs_targets.annotate(period=F('quarter'))
-    qs_targets = qs_targets.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_targets = qs_targets.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_targets = qs_targets.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_targets = qs_targets.annotate(iso_period=F('period__iso'))
+    qs_targets = qs_targets.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_targets = qs_targets.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_targets = list(val_targets)
 
     gen_raster = grabbag.rasterize(ou_list, de_targets_meta, val_targets, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1372,13 +1397,13 @@ def vmmc_by_site(request):
     )
     de_method_meta = list(product(method_de_names, (None,)))
 
-    qs_method = DataValue.objects.what(*method_de_names).filter(quarter=filter_period)
+    qs_method = AggregateValue.objects.what(*method_de_names).when(filter_period).filter(org_unit__level=3)
     qs_method = qs_method.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_method = qs_method.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_method = qs_method.annotate(period=F('quarter'))
-    qs_method = qs_method.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_method = qs_method.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_method = qs_method.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_method = qs_method.annotate(iso_period=F('period__iso'))
+    qs_method = qs_method.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_method = qs_method.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_method_meta, val_method, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_method2 = list(gen_raster)
@@ -1393,13 +1418,13 @@ def vmmc_by_site(request):
     )
     de_hiv_meta = list(product(hiv_de_names, (None,)))
 
-    qs_hiv = DataValue.objects.what(*hiv_de_names).filter(quarter=filter_period)
+    qs_hiv = AggregateValue.objects.what(*hiv_de_names).when(filter_period).filter(org_unit__level=3)
     qs_hiv = qs_hiv.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_hiv = qs_hiv.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_hiv = qs_hiv.annotate(period=F('quarter'))
-    qs_hiv = qs_hiv.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_hiv = qs_hiv.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_hiv = qs_hiv.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_hiv = qs_hiv.annotate(iso_period=F('period__iso'))
+    qs_hiv = qs_hiv.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_hiv = qs_hiv.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_hiv_meta, val_hiv, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_hiv2 = list(gen_raster)
@@ -1421,16 +1446,16 @@ def vmmc_by_site(request):
     )
     de_location_meta = list(product(location_de_names2, (None,)))
 
-    qs_location = DataValue.objects.what(*location_de_names).filter(quarter=filter_period)
+    qs_location = AggregateValue.objects.what(*location_de_names).when(filter_period).filter(org_unit__level=3)
     qs_location = qs_location.annotate(cat_combo=Value(None, output_field=CharField()))
 
     # drop the technique section from the returned data element name
     qs_location = qs_location.annotate(de_name=Substr('data_element__name', 1, location_prefix_len))
 
-    qs_location = qs_location.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_location = qs_location.annotate(period=F('quarter'))
-    qs_location = qs_location.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_location = qs_location.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_location = qs_location.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_location = qs_location.annotate(iso_period=F('period__iso'))
+    qs_location = qs_location.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_location = qs_location.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_location_meta, val_location, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_location2 = list(gen_raster)
@@ -1447,13 +1472,13 @@ def vmmc_by_site(request):
     )
     de_followup_meta = list(product(followup_de_names, (None,)))
 
-    qs_followup = DataValue.objects.what(*followup_de_names).filter(quarter=filter_period)
+    qs_followup = AggregateValue.objects.what(*followup_de_names).when(filter_period).filter(org_unit__level=3)
     qs_followup = qs_followup.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_followup = qs_followup.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_followup = qs_followup.annotate(period=F('quarter'))
-    qs_followup = qs_followup.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_followup = qs_followup.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_followup = qs_followup.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_followup = qs_followup.annotate(iso_period=F('period__iso'))
+    qs_followup = qs_followup.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_followup = qs_followup.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_followup_meta, val_followup, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_followup2 = list(gen_raster)
@@ -1468,13 +1493,13 @@ def vmmc_by_site(request):
     )
     de_adverse_meta = list(product(adverse_de_names, (None,)))
 
-    qs_adverse = DataValue.objects.what(*adverse_de_names).filter(quarter=filter_period)
+    qs_adverse = AggregateValue.objects.what(*adverse_de_names).when(filter_period).filter(org_unit__level=3)
     qs_adverse = qs_adverse.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_adverse = qs_adverse.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_adverse = qs_adverse.annotate(period=F('quarter'))
-    qs_adverse = qs_adverse.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_adverse = qs_adverse.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_adverse = qs_adverse.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_adverse = qs_adverse.annotate(iso_period=F('period__iso'))
+    qs_adverse = qs_adverse.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_adverse = qs_adverse.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
 
     gen_raster = grabbag.rasterize(ou_list, de_adverse_meta, val_adverse, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
     val_adverse2 = list(gen_raster)
@@ -1608,7 +1633,7 @@ def lab_by_site(request):
     period_desc = dateutil.DateSpan.fromquarter(filter_period).format()
 
     # # all facilities (or equivalent)
-    qs_ou = OrgUnit.objects.filter(level=3).annotate(district=F('parent__parent__name'), subcounty=F('parent__name'), facility=F('name'))
+    qs_ou = OrgUnit.objects.filter(level=3).annotate(district=F('district_name'), subcounty=F('subcounty_name'), facility=F('name'))
     ou_list = list(qs_ou.values_list('district', 'subcounty', 'facility'))
 
     def val_with_subcat_fun(row, col):
@@ -1626,13 +1651,13 @@ def lab_by_site(request):
     )
     de_malaria_meta = list(product(malaria_de_names, (None,)))
 
-    qs_malaria = DataValue.objects.what(*malaria_de_names).filter(quarter=filter_period)
+    qs_malaria = AggregateValue.objects.what(*malaria_de_names).when(filter_period).filter(org_unit__level=3)
     qs_malaria = qs_malaria.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_malaria = qs_malaria.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_malaria = qs_malaria.annotate(period=F('quarter'))
-    qs_malaria = qs_malaria.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_malaria = qs_malaria.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_malaria = qs_malaria.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_malaria = qs_malaria.annotate(iso_period=F('period__iso'))
+    qs_malaria = qs_malaria.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_malaria = qs_malaria.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_malaria = list(val_malaria)
 
     gen_raster = grabbag.rasterize(ou_list, de_malaria_meta, val_malaria, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1650,14 +1675,14 @@ def lab_by_site(request):
     )
     de_hiv_determine_meta = list(product(['HIV tests done using Determine'], (None,)))
 
-    qs_hiv_determine = DataValue.objects.what(*hiv_determine_de_names).filter(quarter=filter_period)
+    qs_hiv_determine = AggregateValue.objects.what(*hiv_determine_de_names).when(filter_period).filter(org_unit__level=3)
     qs_hiv_determine = qs_hiv_determine.annotate(de_name=Value('HIV tests done using Determine', output_field=CharField()))
     qs_hiv_determine = qs_hiv_determine.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_hiv_determine = qs_hiv_determine.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_hiv_determine = qs_hiv_determine.annotate(period=F('quarter'))
-    qs_hiv_determine = qs_hiv_determine.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_hiv_determine = qs_hiv_determine.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_hiv_determine = qs_hiv_determine.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_hiv_determine = qs_hiv_determine.annotate(iso_period=F('period__iso'))
+    qs_hiv_determine = qs_hiv_determine.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_hiv_determine = qs_hiv_determine.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_hiv_determine = list(val_hiv_determine)
 
     gen_raster = grabbag.rasterize(ou_list, de_hiv_determine_meta, val_hiv_determine, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1675,14 +1700,14 @@ def lab_by_site(request):
     )
     de_hiv_statpak_meta = list(product(['HIV tests done using Stat Pak'], (None,)))
 
-    qs_hiv_statpak = DataValue.objects.what(*hiv_statpak_de_names).filter(quarter=filter_period)
+    qs_hiv_statpak = AggregateValue.objects.what(*hiv_statpak_de_names).when(filter_period).filter(org_unit__level=3)
     qs_hiv_statpak = qs_hiv_statpak.annotate(de_name=Value('HIV tests done using Stat Pak', output_field=CharField()))
     qs_hiv_statpak = qs_hiv_statpak.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_hiv_statpak = qs_hiv_statpak.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_hiv_statpak = qs_hiv_statpak.annotate(period=F('quarter'))
-    qs_hiv_statpak = qs_hiv_statpak.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_hiv_statpak = qs_hiv_statpak.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_hiv_statpak = qs_hiv_statpak.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_hiv_statpak = qs_hiv_statpak.annotate(iso_period=F('period__iso'))
+    qs_hiv_statpak = qs_hiv_statpak.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_hiv_statpak = qs_hiv_statpak.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_hiv_statpak = list(val_hiv_statpak)
 
     gen_raster = grabbag.rasterize(ou_list, de_hiv_statpak_meta, val_hiv_statpak, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1700,14 +1725,14 @@ def lab_by_site(request):
     )
     de_hiv_unigold_meta = list(product(['HIV tests done using Unigold'], (None,)))
 
-    qs_hiv_unigold = DataValue.objects.what(*hiv_unigold_de_names).filter(quarter=filter_period)
+    qs_hiv_unigold = AggregateValue.objects.what(*hiv_unigold_de_names).when(filter_period).filter(org_unit__level=3)
     qs_hiv_unigold = qs_hiv_unigold.annotate(de_name=Value('HIV tests done using Unigold', output_field=CharField()))
     qs_hiv_unigold = qs_hiv_unigold.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_hiv_unigold = qs_hiv_unigold.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_hiv_unigold = qs_hiv_unigold.annotate(period=F('quarter'))
-    qs_hiv_unigold = qs_hiv_unigold.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_hiv_unigold = qs_hiv_unigold.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_hiv_unigold = qs_hiv_unigold.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_hiv_unigold = qs_hiv_unigold.annotate(iso_period=F('period__iso'))
+    qs_hiv_unigold = qs_hiv_unigold.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_hiv_unigold = qs_hiv_unigold.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_hiv_unigold = list(val_hiv_unigold)
 
     gen_raster = grabbag.rasterize(ou_list, de_hiv_unigold_meta, val_hiv_unigold, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1721,13 +1746,13 @@ def lab_by_site(request):
     )
     de_tb_smear_meta = list(product(tb_smear_de_names, (None,)))
 
-    qs_tb_smear = DataValue.objects.what(*tb_smear_de_names).filter(quarter=filter_period)
+    qs_tb_smear = AggregateValue.objects.what(*tb_smear_de_names).when(filter_period).filter(org_unit__level=3)
     qs_tb_smear = qs_tb_smear.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_tb_smear = qs_tb_smear.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_tb_smear = qs_tb_smear.annotate(period=F('quarter'))
-    qs_tb_smear = qs_tb_smear.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_tb_smear = qs_tb_smear.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_tb_smear = qs_tb_smear.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_tb_smear = qs_tb_smear.annotate(iso_period=F('period__iso'))
+    qs_tb_smear = qs_tb_smear.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_tb_smear = qs_tb_smear.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_tb_smear = list(val_tb_smear)
 
     gen_raster = grabbag.rasterize(ou_list, de_tb_smear_meta, val_tb_smear, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1742,14 +1767,14 @@ def lab_by_site(request):
     )
     de_syphilis_meta = list(product(['Syphilis tests'], (None,)))
 
-    qs_syphilis = DataValue.objects.what(*syphilis_de_names).filter(quarter=filter_period)
+    qs_syphilis = AggregateValue.objects.what(*syphilis_de_names).when(filter_period).filter(org_unit__level=3)
     qs_syphilis = qs_syphilis.annotate(de_name=Value('Syphilis tests', output_field=CharField()))
     qs_syphilis = qs_syphilis.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_syphilis = qs_syphilis.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_syphilis = qs_syphilis.annotate(period=F('quarter'))
-    qs_syphilis = qs_syphilis.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_syphilis = qs_syphilis.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_syphilis = qs_syphilis.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_syphilis = qs_syphilis.annotate(iso_period=F('period__iso'))
+    qs_syphilis = qs_syphilis.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_syphilis = qs_syphilis.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_syphilis = list(val_syphilis)
 
     gen_raster = grabbag.rasterize(ou_list, de_syphilis_meta, val_syphilis, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1765,14 +1790,14 @@ def lab_by_site(request):
     )
     de_liver_meta = list(product(['LFTs'], (None,)))
 
-    qs_liver = DataValue.objects.what(*liver_de_names).filter(quarter=filter_period)
+    qs_liver = AggregateValue.objects.what(*liver_de_names).when(filter_period).filter(org_unit__level=3)
     qs_liver = qs_liver.annotate(de_name=Value('LFTs', output_field=CharField()))
     qs_liver = qs_liver.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_liver = qs_liver.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_liver = qs_liver.annotate(period=F('quarter'))
-    qs_liver = qs_liver.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_liver = qs_liver.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_liver = qs_liver.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_liver = qs_liver.annotate(iso_period=F('period__iso'))
+    qs_liver = qs_liver.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_liver = qs_liver.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_liver = list(val_liver)
 
     gen_raster = grabbag.rasterize(ou_list, de_liver_meta, val_liver, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1791,14 +1816,14 @@ def lab_by_site(request):
     )
     de_renal_meta = list(product(['RFTs'], (None,)))
 
-    qs_renal = DataValue.objects.what(*renal_de_names).filter(quarter=filter_period)
+    qs_renal = AggregateValue.objects.what(*renal_de_names).when(filter_period).filter(org_unit__level=3)
     qs_renal = qs_renal.annotate(de_name=Value('RFTs', output_field=CharField()))
     qs_renal = qs_renal.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_renal = qs_renal.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_renal = qs_renal.annotate(period=F('quarter'))
-    qs_renal = qs_renal.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_renal = qs_renal.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_renal = qs_renal.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_renal = qs_renal.annotate(iso_period=F('period__iso'))
+    qs_renal = qs_renal.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_renal = qs_renal.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_renal = list(val_renal)
 
     gen_raster = grabbag.rasterize(ou_list, de_renal_meta, val_renal, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
@@ -1812,13 +1837,13 @@ def lab_by_site(request):
     )
     de_other_haem_meta = list(product(other_haem_de_names, (None,)))
 
-    qs_other_haem = DataValue.objects.what(*other_haem_de_names).filter(quarter=filter_period)
+    qs_other_haem = AggregateValue.objects.what(*other_haem_de_names).when(filter_period).filter(org_unit__level=3)
     qs_other_haem = qs_other_haem.annotate(cat_combo=Value(None, output_field=CharField()))
 
-    qs_other_haem = qs_other_haem.annotate(district=F('org_unit__parent__parent__name'), subcounty=F('org_unit__parent__name'), facility=F('org_unit__name'))
-    qs_other_haem = qs_other_haem.annotate(period=F('quarter'))
-    qs_other_haem = qs_other_haem.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period')
-    val_other_haem = qs_other_haem.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'period').annotate(values_count=Count('numeric_value'), numeric_sum=Sum('numeric_value'))
+    qs_other_haem = qs_other_haem.annotate(district=F('org_unit__district_name'), subcounty=F('org_unit__subcounty_name'), facility=F('org_unit__name'))
+    qs_other_haem = qs_other_haem.annotate(iso_period=F('period__iso'))
+    qs_other_haem = qs_other_haem.order_by('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period')
+    val_other_haem = qs_other_haem.values('district', 'subcounty', 'facility', 'de_name', 'cat_combo', 'iso_period').annotate(values_count=Sum('values_count'), numeric_sum=Sum('numeric_sum'))
     val_other_haem = list(val_other_haem)
 
     gen_raster = grabbag.rasterize(ou_list, de_other_haem_meta, val_other_haem, lambda x: (x['district'], x['subcounty'], x['facility']), lambda x: (x['de_name'], x['cat_combo']), val_with_subcat_fun)
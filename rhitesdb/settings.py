@@ -116,6 +116,15 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static/")
 
 SOURCE_DOC_DIR = os.path.join(BASE_DIR, 'source_doc_storage')
 
+# number of processes used to parse the worksheets of a source document in parallel
+INGESTION_PROCESSES = 1
+# number of data values written (and committed, by the ingestion worker) per transaction
+INGESTION_CHUNK_SIZE = 5000
+
+# partition cannula_datavalue by year (needs PostgreSQL 11+), applied by migration 0018
+# or later with manage.py datavalue_partitions convert
+DATAVALUE_PARTITIONED = False
+
 LOGIN_REDIRECT_URL = '/'
 
 # Import optional settings